@@ -0,0 +1,197 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+import fast_copy
+
+DEFAULT_ROOT = os.environ.get('DOWNLOAD_CACHE_DIR') or os.path.join(
+    os.path.expanduser('~'), '.download_manager', 'artifacts')
+DEFAULT_QUOTA = int(os.environ.get('DOWNLOAD_CACHE_BYTES', 10 * 1024 * 1024 * 1024))
+# Whether store() may fall back to a full copy when the filesystem cannot clone (DOWNLOAD_CACHE_COPIES=1)
+STORE_COPIES = os.environ.get('DOWNLOAD_CACHE_COPIES') == '1'
+
+
+class ArtifactCache:
+    """
+    Content-addressed store of finished downloads, keyed by SHA-256.
+    Objects live under root/objects/<2 hex>/<digest>. An SQLite index maps each digest to its size
+    and last use, and each URL to the ETag/Last-Modified/digest it last served.
+    A download that is already cached is delivered to its destination without touching the network:
+    by reflink where the filesystem can share extents, otherwise by an in-kernel copy. 'hardlink' may be
+    added to `delivery`, but then the destination and the cache share one inode, so only use it when
+    the consumers never modify delivered files.
+    Once the cache exceeds max_bytes, the least recently used objects are evicted.
+    store() runs on the completion path of every download, so by default it only keeps a file the
+    filesystem can clone (or hardlink, if allowed): that costs no extra bytes written. Where neither
+    works the file is not cached, unless store_copies is set, in which case it is copied in full.
+    Usage:
+        cache = ArtifactCache()
+        digest = cache.lookup(url, etag=etag, size=size)
+        if digest and cache.deliver(digest, dest):
+            ...
+        cache.store(dest, sha256, url=url, etag=etag)
+    """
+    def __init__(self, root=DEFAULT_ROOT, max_bytes=DEFAULT_QUOTA, delivery=('reflink', 'copy'), store_copies=STORE_COPIES,
+                 logger=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.delivery = tuple(delivery)
+        self.store_copies = store_copies
+        self.logger = logger or logging.getLogger('ArtifactCache')
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, 'index.db'), timeout=10, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, size INTEGER, created REAL, last_used REAL)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, digest TEXT)')
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def has(self, digest):
+        if not digest:
+            return False
+        with self._lock:
+            row = self._db.execute('SELECT size FROM objects WHERE digest = ?', (digest,)).fetchone()
+        path = self.object_path(digest)
+        return row is not None and os.path.exists(path) and os.path.getsize(path) == row[0]
+
+    def lookup(self, url, etag=None, last_modified=None, size=None):
+        """
+        Digest of what url served last time, if the server still reports the same object
+        (matching ETag, or Last-Modified when there is no ETag) and that object is cached.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT etag, last_modified, digest FROM urls WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        cached_etag, cached_lm, digest = row
+        if etag or cached_etag:
+            if etag != cached_etag:
+                return None
+        elif not last_modified or last_modified != cached_lm:
+            return None
+        if not self.has(digest):
+            return None
+        if size and os.path.getsize(self.object_path(digest)) != size:
+            return None
+        return digest
+
+    def deliver(self, digest, dest):
+        """Place the cached object at dest. Returns the method used, or None if it is not cached or cannot be copied."""
+        if not self.has(digest):
+            return None
+        try:
+            method = fast_copy.place(self.object_path(digest), dest, self.delivery)
+        except OSError as e:
+            self.logger.warning(f"Cache delivery of {digest} to {dest} failed: {e}")
+            return None
+        size = os.path.getsize(dest)
+        with self._lock, self._db:
+            self._db.execute('UPDATE objects SET last_used = ? WHERE digest = ?', (time.time(), digest))
+            self.hits += 1
+            self.bytes_saved += size
+        self.logger.info(f"Delivered {dest} from cache ({method})")
+        return method
+
+    def note_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def store(self, path, digest, url=None, etag=None, last_modified=None):
+        """
+        Add the finished file at path under digest (a no-op if already cached), index url, then enforce the quota.
+        Returns False if the file was not cached: too big for the quota, or not clonable and store_copies is off.
+        """
+        size = os.path.getsize(path)
+        if self.max_bytes and size > self.max_bytes:
+            return False
+        if not self.has(digest):
+            obj = self.object_path(digest)
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            # The cache keeps its own copy unless hardlinks were explicitly allowed
+            methods = tuple(m for m in self.delivery if m != 'copy' or self.store_copies)
+            try:
+                fast_copy.place(path, obj, methods)
+            except OSError as e:
+                self.logger.debug(f"Not caching {path}: no cheap copy available ({e})")
+                return False
+            with self._lock, self._db:
+                now = time.time()
+                self._db.execute('INSERT OR REPLACE INTO objects (digest, size, created, last_used) VALUES (?, ?, ?, ?)',
+                                 (digest, size, now, now))
+        if url:
+            with self._lock, self._db:
+                self._db.execute('INSERT OR REPLACE INTO urls (url, etag, last_modified, digest) VALUES (?, ?, ?, ?)',
+                                 (url, etag, last_modified, digest))
+        self.evict()
+        return True
+
+    def evict(self):
+        """Drop least recently used objects until the cache fits in max_bytes."""
+        if not self.max_bytes:
+            return
+        with self._lock:
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            victims = self._db.execute('SELECT digest, size FROM objects ORDER BY last_used').fetchall()
+        for digest, size in victims:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.object_path(digest))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning(f"Failed to evict {digest}: {e}")
+                continue
+            with self._lock, self._db:
+                self._db.execute('DELETE FROM objects WHERE digest = ?', (digest,))
+                self._db.execute('DELETE FROM urls WHERE digest = ?', (digest,))
+                self.evictions += 1
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            objects, total = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects').fetchone()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes_saved': self.bytes_saved,
+                'evictions': self.evictions,
+                'objects': objects,
+                'bytes': total,
+                'max_bytes': self.max_bytes,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_cache_lock = threading.Lock()
+_cache = None
+
+
+def default_artifact_cache(logger=None):
+    """Process-wide cache at DEFAULT_ROOT; None if disabled (DOWNLOAD_CACHE_BYTES=0) or it cannot be opened."""
+    global _cache
+    if not DEFAULT_QUOTA:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ArtifactCache(logger=logger)
+            except Exception as e:
+                (logger or logging.getLogger('ArtifactCache')).warning(f"Artifact cache unavailable: {e}")
+                return None
+        return _cache
@@ -0,0 +1,300 @@
+import os
+import time
+import asyncio
+import logging
+from disk_writer import DiskWriter
+from segmented_download import split_ranges, check_range_response, RangeNotSupported
+from memory_budget import default_budget
+import http_pool
+
+
+class AsyncSegmentedDownloader:
+    """
+    asyncio counterpart of SegmentedDownloader: every range is a coroutine on one event loop
+    instead of a thread, and all of them share one httpx.AsyncClient.
+    With a ConcurrencyController the work is cut into smaller units and only controller.target
+    of them are in flight at once; otherwise `concurrency` is a fixed limit.
+    Readers hand chunks to a bounded queue drained by a few writer tasks that perform the
+    positional writes in the default executor; a full queue suspends the readers, so a slow disk
+    throttles the network instead of piling chunks up in memory. Readers also pay for every chunk from the
+    process-wide MemoryBudget before fetching it; the writer refunds it once the chunk is on disk.
+    Usage:
+        await AsyncSegmentedDownloader(url, path, total_size, concurrency=8).run()
+    """
+    QUEUE_DEPTH = 32
+    WRITER_TASKS = 2
+
+    def __init__(self, url, path, total_size, concurrency=8, chunk_size=1024*1024, writer=None, logger=None,
+                 progress=None, should_continue=None, retries=3, verify=False, timeout=30, journal=None, client=None,
+                 limiter=None, controller=None, budget=None):
+        if total_size <= 0:
+            raise ValueError("total_size must be known and positive for segmented downloads")
+        self.url = url
+        self.path = path
+        self.total_size = total_size
+        self.concurrency = max(1, concurrency)
+        self.chunk_size = chunk_size
+        self.writer = writer or DiskWriter()
+        self.logger = logger or logging.getLogger('AsyncSegmentedDownloader')
+        self.progress = progress
+        self.should_continue = should_continue or (lambda: True)
+        self.retries = max(1, retries)
+        self.verify = verify
+        self.timeout = timeout
+        self.journal = journal
+        self.client = client
+        self.limiter = limiter
+        self.controller = controller
+        # Process-wide credit for in-flight bytes (memory_budget.py); budget=False opts out
+        self.budget = default_budget() if budget is None else (budget or None)
+        self.complete = False
+        self.http_version = None
+        self._write_error = None
+        self._written = 0
+
+    def split_ranges(self):
+        gaps = self.journal.missing() if self.journal else [(0, self.total_size - 1)]
+        parts = self.concurrency * 4 if self.controller else self.concurrency
+        return split_ranges(gaps, parts, 256 * 1024)
+
+    def _running(self):
+        return self._write_error is None and self.should_continue()
+
+    async def run(self):
+        """
+        Download all ranges concurrently and write them in place.
+        Returns total bytes written; raises if any range cannot be completed.
+        """
+        ranges = self.split_ranges()
+        client = self.client or http_pool.new_async_client(verify=self.verify, timeout=self.timeout)
+        queue = asyncio.Queue(maxsize=self.QUEUE_DEPTH)
+        loop = asyncio.get_running_loop()
+        try:
+            # Opening, preallocating and the final sync all block on the disk, so like _write they run off the loop
+            f = await loop.run_in_executor(None, self._open)
+            try:
+                drains = [asyncio.create_task(self._drain(queue, f)) for _ in range(self.WRITER_TASKS)]
+                sem = asyncio.Semaphore(self.concurrency)
+                try:
+                    await asyncio.gather(*(self._fetch_range(client, sem, queue, start, end, idx)
+                                           for idx, (start, end) in enumerate(ranges)))
+                finally:
+                    for _ in drains:
+                        await queue.put(None)
+                    await asyncio.gather(*drains)
+            finally:
+                await loop.run_in_executor(None, self._finish, f)
+        finally:
+            if self.client is None:
+                await client.aclose()
+        if self._write_error:
+            raise self._write_error
+        self.complete = self._written == sum(e - s + 1 for s, e in ranges)
+        return self._written
+
+    def _open(self):
+        f = open(self.path, 'r+b' if os.path.exists(self.path) else 'w+b')
+        try:
+            self.writer.preallocate(f, self.total_size)
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    def _finish(self, f):
+        # The final sync and the forced checkpoint (which may fdatasync again) before the file is closed
+        try:
+            self.writer.fsync(f)
+            if self.journal:
+                self.journal.checkpoint(force=True)
+        finally:
+            f.close()
+
+    async def _drain(self, queue, f):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            offset, chunk = item
+            if self._write_error:
+                # Keep draining so readers blocked on put() wake up and see the error
+                self._refund(chunk)
+                continue
+            try:
+                written = await loop.run_in_executor(None, self._write, f, chunk, offset)
+            except Exception as e:
+                self._write_error = e
+                continue
+            finally:
+                self._refund(chunk)
+            self._written += written
+            if self.progress:
+                self.progress(written)
+
+    def _write(self, f, chunk, offset):
+        # Journalled off the event loop: a checkpoint may fdatasync the file first (see durability.py)
+        written = self.writer.write_at(f, chunk, offset)
+        if self.journal:
+            self.journal.add(offset, offset + written - 1)
+        return written
+
+    def _refund(self, chunk):
+        if self.budget:
+            self.budget.release(len(chunk))
+
+    async def _acquire_slot(self):
+        while not self.controller.try_acquire():
+            await asyncio.sleep(0.05)
+
+    async def _fetch_range(self, client, sem, queue, start, end, idx):
+        position = start
+        last_error = None
+        async with sem:
+            if self.controller:
+                await self._acquire_slot()
+            try:
+                position, last_error = await self._fetch_attempts(client, queue, start, end, idx)
+            finally:
+                if self.controller:
+                    self.controller.release()
+        if position <= end and self._running():
+            raise IOError(f"Range {idx} incomplete: {position - start}/{end - start + 1} bytes ({last_error})")
+        return position - start
+
+    async def _fetch_attempts(self, client, queue, start, end, idx):
+        position = start
+        last_error = None
+        for attempt in range(self.retries):
+            if position > end or not self._running():
+                break
+            try:
+                headers = {'Range': f'bytes={position}-{end}'}
+                sent = time.monotonic()
+                async with client.stream('GET', self.url, headers=headers) as r:
+                    if self.controller:
+                        self.controller.record_rtt(time.monotonic() - sent)
+                    self.http_version = r.http_version
+                    r.raise_for_status()
+                    check_range_response(r.status_code, position)
+                    size = self.budget.chunk_size(self.chunk_size) if self.budget else self.chunk_size
+                    chunks = r.aiter_bytes(size)
+                    if self.budget:
+                        chunks = self.budget.metered_async(chunks, size, self._running)
+                    async for chunk in chunks:
+                        # Budget credit this chunk holds until it is queued for the writer
+                        held = len(chunk) if self.budget else 0
+                        try:
+                            if not self._running():
+                                break
+                            if position + len(chunk) > end + 1:
+                                chunk = chunk[:end + 1 - position]
+                            if self.limiter:
+                                await self.limiter.consume_async(len(chunk))
+                            if chunk:
+                                await queue.put((position, chunk))
+                                if held:
+                                    held -= len(chunk)
+                            position += len(chunk)
+                            if self.controller:
+                                self.controller.record(len(chunk))
+                            if position > end:
+                                break
+                        finally:
+                            if held:
+                                self.budget.release(held)
+                last_error = None
+            except RangeNotSupported:
+                raise
+            except Exception as e:
+                last_error = e
+                self.logger.error(f"Range {idx} failed at byte {position} (attempt {attempt+1}): {e}")
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if status in (429, 503):
+                    if self.controller:
+                        self.controller.record_overload()
+                    await asyncio.sleep(attempt + 1)
+        return position, last_error
+
+
+class AsyncDownloadEngine:
+    """
+    Drives many HTTP downloads as coroutines on a single event loop with one shared AsyncClient,
+    so thousands of transfers cost sockets and coroutines rather than threads.
+    Each job is a DownloadManager; the engine probes it, streams it with AsyncSegmentedDownloader
+    and hands the blocking publish/scan step to a worker thread.
+    Usage:
+        results = AsyncDownloadEngine(max_downloads=500).run_many([DownloadManager(url, dest), ...])
+    """
+    def __init__(self, max_downloads=256, max_connections=512, verify=False, timeout=30, logger=None):
+        self.max_downloads = max(1, max_downloads)
+        self.max_connections = max_connections
+        self.verify = verify
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger('AsyncDownloadEngine')
+
+    def run_many(self, managers):
+        return asyncio.run(self.fetch_many(managers))
+
+    async def fetch_many(self, managers):
+        """Returns one {'url', 'dest', 'ok', 'error'} dict per manager, in input order."""
+        sem = asyncio.Semaphore(self.max_downloads)
+        client = http_pool.new_async_client(verify=self.verify, timeout=self.timeout,
+                                            max_connections=self.max_connections)
+        try:
+            async def guarded(mgr):
+                async with sem:
+                    try:
+                        await self.fetch(mgr, client)
+                        return {'url': mgr.url, 'dest': mgr.dest, 'ok': True, 'error': None}
+                    except Exception as e:
+                        self.logger.error(f"Async download failed: {mgr.url} -> {e}")
+                        await asyncio.to_thread(mgr._abort_extract)
+                        await asyncio.to_thread(mgr.cleanup_temp_files, True)
+                        return {'url': mgr.url, 'dest': mgr.dest, 'ok': False, 'error': str(e)}
+            return await asyncio.gather(*(guarded(m) for m in managers))
+        finally:
+            await client.aclose()
+
+    async def fetch(self, mgr, client):
+        entry = await asyncio.to_thread(mgr._stored_copy)
+        if entry and mgr._expected_digests():
+            await asyncio.to_thread(mgr._finish_not_modified, entry)
+            return True
+        if await asyncio.to_thread(mgr._deliver_from_cache):
+            return True
+        mgr.fetch_url = mgr.url
+        cached = await asyncio.to_thread(mgr._load_capabilities)
+        for url in ([cached] if cached else []) + [mgr.url]:
+            try:
+                async with client.stream('GET', url, headers=mgr._probe_headers(entry)) as r:
+                    if r.status_code == 304 and entry:
+                        await asyncio.to_thread(mgr._finish_not_modified, entry)
+                        return True
+                    r.raise_for_status()
+                    total_size = mgr._apply_probe(r.status_code, r.headers)
+                    await asyncio.to_thread(mgr._record_probe, str(r.url), r.status_code, r.headers, bool(r.history))
+                break
+            except Exception as e:
+                if url != cached:
+                    raise
+                self.logger.info(f"Cached redirect target {cached} failed ({e}); retrying {mgr.url}")
+                await asyncio.to_thread(mgr.capability_cache.forget_redirect, mgr.url)
+        if await asyncio.to_thread(mgr._deliver_from_cache, total_size):
+            return True
+        try:
+            if total_size > 0:
+                # Same free-space check and per-volume reservation as DownloadManager.download()
+                await asyncio.to_thread(mgr._reserve_space, total_size)
+            if total_size > 0 and mgr.accept_ranges is not False:
+                complete = await mgr._download_async(total_size, client=client)
+            else:
+                # No Range support: one sequential stream, still journalled, preallocated and size-checked
+                complete = await asyncio.to_thread(mgr._download_singlethreaded, total_size)
+            if complete:
+                await asyncio.to_thread(mgr._finish_http_download)
+            else:
+                await asyncio.to_thread(mgr._abort_extract)
+            return complete
+        finally:
+            await asyncio.to_thread(mgr._release_space)
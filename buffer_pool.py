@@ -0,0 +1,61 @@
+import threading
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+class BufferPool:
+    """
+    Free list of equally sized bytearrays for the receive path.
+    Readers fill a buffer with readinto() and pass memoryviews of it along; whoever writes it to disk
+    hands it back with release() (a memoryview of the buffer is accepted too). acquire() never blocks:
+    when the free list is empty a new buffer is made, and at most max_free buffers are kept for reuse,
+    so a buffer that is never released is simply garbage collected.
+    Usage:
+        pool = default_pool()
+        buf = pool.acquire()
+        n = stream.readinto(buf)
+        sink.submit(memoryview(buf)[:n], offset)   # writer calls pool.release(...) once written
+    """
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE, max_free=128):
+        self.buffer_size = buffer_size
+        self.max_free = max_free
+        self._free = []
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                self.reused += 1
+                return self._free.pop()
+            self.allocated += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buf):
+        """Return a buffer (or a memoryview of one); anything that did not come from this pool is ignored."""
+        if isinstance(buf, memoryview):
+            buf = buf.obj
+        if not isinstance(buf, bytearray) or len(buf) != self.buffer_size:
+            return
+        with self._lock:
+            if len(self._free) < self.max_free:
+                self._free.append(buf)
+
+    def stats(self):
+        with self._lock:
+            return {'buffer_size': self.buffer_size, 'allocated': self.allocated, 'reused': self.reused,
+                    'free': len(self._free)}
+
+
+_pools_lock = threading.Lock()
+_pools = {}
+
+
+def default_pool(buffer_size=DEFAULT_BUFFER_SIZE):
+    """Process-wide pool for buffer_size, shared by every download in the process."""
+    with _pools_lock:
+        pool = _pools.get(buffer_size)
+        if pool is None:
+            pool = _pools[buffer_size] = BufferPool(buffer_size)
+        return pool
@@ -0,0 +1,117 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+import http_pool
+from metadata_store import DEFAULT_PATH
+
+
+def origin_key(url):
+    scheme, host, port = http_pool.origin_of(url)
+    return f"{scheme}://{host}:{port}"
+
+
+class CapabilityCache:
+    """
+    What we have learned about each origin, kept for `ttl` seconds:
+      - accept_ranges: whether ranged GETs are honoured (False means segmenting would fetch the file N times);
+      - http2: whether httpx negotiated HTTP/2, so concurrent segments are cheap streams on one connection;
+      - max_connections: the concurrency ceiling ConcurrencyController settled on after the server pushed back.
+    It also remembers where a URL redirected to (for `redirect_ttl`), so repeat downloads and every segment
+    request go straight to the final location.
+    Stored in the same SQLite file as MetadataStore, so it is shared between processes.
+    Usage:
+        caps = CapabilityCache()
+        caps.update(url, accept_ranges=True)
+        caps.get(url) -> {'accept_ranges': True, 'http2': None, 'max_connections': None, 'updated': ...}
+    """
+    DEFAULT_TTL = 6 * 3600
+    REDIRECT_TTL = 3600
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, redirect_ttl=REDIRECT_TTL, logger=None):
+        self.path = path
+        self.ttl = ttl
+        self.redirect_ttl = redirect_ttl
+        self.logger = logger or logging.getLogger('CapabilityCache')
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS origins ('
+                ' origin TEXT PRIMARY KEY, accept_ranges INTEGER, http2 INTEGER, max_connections INTEGER, updated REAL)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS redirects (url TEXT PRIMARY KEY, target TEXT NOT NULL, updated REAL)')
+
+    def get(self, url):
+        """Fresh capabilities for url's origin, or None if unknown or older than ttl."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT accept_ranges, http2, max_connections, updated FROM origins WHERE origin = ?',
+                (origin_key(url),)).fetchone()
+        if row is None or time.time() - row[3] > self.ttl:
+            return None
+        return {
+            'accept_ranges': None if row[0] is None else bool(row[0]),
+            'http2': None if row[1] is None else bool(row[1]),
+            'max_connections': row[2],
+            'updated': row[3],
+        }
+
+    def update(self, url, **fields):
+        """Merge fields into url's origin entry; None values leave the stored value alone."""
+        current = self.get(url) or {}
+        merged = {k: current.get(k) for k in ('accept_ranges', 'http2', 'max_connections')}
+        merged.update({k: v for k, v in fields.items() if v is not None and k in merged})
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO origins (origin, accept_ranges, http2, max_connections, updated)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (origin_key(url),
+                 None if merged['accept_ranges'] is None else int(merged['accept_ranges']),
+                 None if merged['http2'] is None else int(merged['http2']),
+                 merged['max_connections'], time.time()))
+
+    def forget(self, url):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM origins WHERE origin = ?', (origin_key(url),))
+
+    def get_redirect(self, url):
+        with self._lock:
+            row = self._db.execute('SELECT target, updated FROM redirects WHERE url = ?', (url,)).fetchone()
+        if row is None or time.time() - row[1] > self.redirect_ttl:
+            return None
+        return row[0]
+
+    def set_redirect(self, url, target):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO redirects (url, target, updated) VALUES (?, ?, ?)',
+                             (url, target, time.time()))
+
+    def forget_redirect(self, url):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM redirects WHERE url = ?', (url,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_cache_lock = threading.Lock()
+_cache = None
+
+
+def default_cache(logger=None):
+    """Process-wide cache next to the metadata store; None if it cannot be opened."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = CapabilityCache(logger=logger)
+            except Exception as e:
+                (logger or logging.getLogger('CapabilityCache')).warning(f"Capability cache unavailable: {e}")
+                return None
+        return _cache
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import logging
+import threading
+
+
+class ChunkJournal:
+    """
+    Persistent record of the byte ranges already written to a download's .part file.
+    Ranges are kept merged in memory and checkpointed to a small JSON sidecar at most every
+    checkpoint_interval seconds (or checkpoint_bytes of new data), via write-to-temp + os.replace,
+    so a crash leaves either the previous or the new journal on disk, never a torn one.
+    Usage:
+        journal = ChunkJournal.load(dest + '.journal')
+        if not journal.matches(url, size, etag, last_modified):
+            journal.reset(url, size, etag, last_modified)
+        for start, end in journal.missing():
+            ...
+            journal.add(start, end)
+    """
+    def __init__(self, path, checkpoint_interval=2.0, checkpoint_bytes=64*1024*1024, logger=None):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_bytes = checkpoint_bytes
+        self.logger = logger or logging.getLogger('ChunkJournal')
+        self.url = None
+        self.total_size = 0
+        self.etag = None
+        self.last_modified = None
+        self.ranges = []  # Sorted, non-overlapping inclusive [start, end] pairs
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._dirty_bytes = 0
+        self._last_checkpoint = time.time()
+        # Called before each checkpoint is written, e.g. DiskWriter.sync_for_checkpoint to make the recorded
+        # bytes durable first; a journal must never survive a crash that the data it describes did not
+        self.on_checkpoint = None
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        journal = cls(path, **kwargs)
+        if not os.path.exists(path):
+            return journal
+        try:
+            with open(path, 'r') as jf:
+                state = json.load(jf)
+            journal.url = state.get('url')
+            journal.total_size = int(state.get('total_size', 0))
+            journal.etag = state.get('etag')
+            journal.last_modified = state.get('last_modified')
+            journal.ranges = [[int(s), int(e)] for s, e in state.get('ranges', [])]
+        except Exception as e:
+            journal.logger.warning(f"Ignoring unreadable journal {path}: {e}")
+            journal.ranges = []
+        return journal
+
+    def matches(self, url, total_size, etag=None, last_modified=None):
+        """
+        True if the journal describes the same remote object, so its ranges can be trusted.
+        Requires a matching size plus at least one matching validator (ETag preferred).
+        """
+        if not self.ranges or self.total_size != total_size:
+            return False
+        if etag and self.etag:
+            return etag == self.etag
+        if last_modified and self.last_modified:
+            return last_modified == self.last_modified
+        return False
+
+    def reset(self, url, total_size, etag=None, last_modified=None):
+        with self._lock:
+            self.url = url
+            self.total_size = total_size
+            self.etag = etag
+            self.last_modified = last_modified
+            self.ranges = []
+            self._dirty_bytes = 0
+        self.checkpoint(force=True)
+
+    def add(self, start, end):
+        """Record that bytes start..end (inclusive) are on disk, checkpointing if due."""
+        if end < start:
+            return
+        added = end - start + 1
+        with self._lock:
+            merged = []
+            placed = False
+            for s, e in self.ranges:
+                if e + 1 < start:
+                    merged.append([s, e])
+                elif end + 1 < s:
+                    if not placed:
+                        merged.append([start, end])
+                        placed = True
+                    merged.append([s, e])
+                else:
+                    start, end = min(s, start), max(e, end)
+            if not placed:
+                merged.append([start, end])
+            self.ranges = merged
+            # Count only the new bytes; the merged range can be the whole file, which would checkpoint (and sync) on every add
+            self._dirty_bytes += added
+        self.checkpoint()
+
+    def missing(self):
+        """Return the inclusive (start, end) gaps still to be fetched."""
+        with self._lock:
+            gaps = []
+            cursor = 0
+            for s, e in self.ranges:
+                if s > cursor:
+                    gaps.append((cursor, s - 1))
+                cursor = max(cursor, e + 1)
+            if cursor < self.total_size:
+                gaps.append((cursor, self.total_size - 1))
+            return gaps
+
+    def completed_bytes(self):
+        with self._lock:
+            return sum(e - s + 1 for s, e in self.ranges)
+
+    def contiguous_prefix(self):
+        """Number of bytes complete from offset 0, for sequential resume."""
+        with self._lock:
+            if self.ranges and self.ranges[0][0] == 0:
+                return self.ranges[0][1] + 1
+            return 0
+
+    def checkpoint(self, force=False):
+        # Only one thread persists at a time; routine checkpoints skip if one is already running
+        if not self._io_lock.acquire(blocking=force):
+            return
+        try:
+            now = time.time()
+            with self._lock:
+                if not force and self._dirty_bytes < self.checkpoint_bytes and now - self._last_checkpoint < self.checkpoint_interval:
+                    return
+                state = {
+                    'url': self.url,
+                    'total_size': self.total_size,
+                    'etag': self.etag,
+                    'last_modified': self.last_modified,
+                    'ranges': [list(r) for r in self.ranges]
+                }
+                self._dirty_bytes = 0
+                self._last_checkpoint = now
+            tmp_path = self.path + '.tmp'
+            try:
+                if self.on_checkpoint:
+                    self.on_checkpoint()
+                with open(tmp_path, 'w') as jf:
+                    json.dump(state, jf)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                self.logger.warning(f"Journal checkpoint failed for {self.path}: {e}")
+        finally:
+            self._io_lock.release()
+
+    def remove(self):
+        for p in (self.path, self.path + '.tmp'):
+            try:
+                if os.path.exists(p):
+                    os.remove(p)
+            except Exception as e:
+                self.logger.warning(f"Failed to remove journal file {p}: {e}")
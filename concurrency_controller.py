@@ -0,0 +1,139 @@
+import time
+import logging
+import threading
+
+
+class ConcurrencyController:
+    """
+    Closed-loop controller for the number of in-flight segments of one download.
+    Workers hold a slot while fetching; the controller measures aggregate goodput and
+    time-to-first-byte every `interval` seconds and moves the slot count:
+      - hill-climb: add one slot while each addition still raises goodput by `gain` or more;
+        when it stops helping, drop back one and hold, so it settles on the smallest
+        concurrency that saturates the path (and re-probes after `hold_intervals`);
+      - multiplicative decrease: halve on 503/429 or when first-byte latency inflates past
+        `rtt_inflation` x the best seen, and remember that level as the server's ceiling.
+    Usage:
+        ctl = ConcurrencyController(initial=4, maximum=32)
+        with ctl.slot():
+            ...
+            ctl.record(len(chunk))
+    """
+    def __init__(self, initial=4, minimum=1, maximum=32, interval=1.0, gain=0.05, rtt_inflation=2.0,
+                 hold_intervals=10, logger=None):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.target = min(self.maximum, max(self.minimum, initial))
+        self.ceiling = self.maximum
+        self.interval = interval
+        self.gain = gain
+        self.rtt_inflation = rtt_inflation
+        self.hold_intervals = hold_intervals
+        self.logger = logger or logging.getLogger('ConcurrencyController')
+        self._cond = threading.Condition()
+        self._active = 0
+        self._bytes = 0
+        self._overloaded = False
+        self._base_rtt = None
+        self._rtt = None
+        self._window_start = time.monotonic()
+        self._last_goodput = None
+        self._probing = True
+        self._hold = 0
+        self.goodput = 0.0
+        self.overloads = 0
+
+    # --- slots ---
+    def acquire(self, should_continue=None):
+        """Block until the number of active workers is below target. Returns False if told to stop."""
+        with self._cond:
+            while self._active >= self.target:
+                if should_continue and not should_continue():
+                    return False
+                self._cond.wait(0.25)
+            self._active += 1
+            return True
+
+    def try_acquire(self):
+        with self._cond:
+            if self._active >= self.target:
+                return False
+            self._active += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            self._cond.notify()
+
+    # --- measurements ---
+    def record(self, nbytes):
+        with self._cond:
+            self._bytes += nbytes
+        self._maybe_adjust()
+
+    def record_rtt(self, seconds):
+        with self._cond:
+            if self._base_rtt is None or seconds < self._base_rtt:
+                self._base_rtt = seconds
+            self._rtt = seconds if self._rtt is None else 0.8 * self._rtt + 0.2 * seconds
+
+    def record_overload(self):
+        with self._cond:
+            self._overloaded = True
+            self.overloads += 1
+        self._maybe_adjust(force=True)
+
+    def _maybe_adjust(self, force=False):
+        with self._cond:
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            if not force and elapsed < self.interval:
+                return
+            goodput = self._bytes / elapsed if elapsed > 0 else 0.0
+            self._bytes = 0
+            self._window_start = now
+            self.goodput = goodput
+            old = self.target
+            inflated = self._rtt and self._base_rtt and self._rtt > self._base_rtt * self.rtt_inflation
+            if self._overloaded or inflated:
+                self.ceiling = max(self.minimum, self.target - 1)
+                self.target = max(self.minimum, self.target // 2)
+                self._overloaded = False
+                self._rtt = self._base_rtt  # give the smaller window a clean RTT baseline
+                self._probing = False
+                self._hold = self.hold_intervals
+            elif self._probing:
+                if self._last_goodput is None or goodput >= self._last_goodput * (1 + self.gain):
+                    self.target = min(self.ceiling, self.target + 1)
+                else:
+                    # The last extra slot bought nothing: step back and settle
+                    self.target = max(self.minimum, self.target - 1)
+                    self._probing = False
+                    self._hold = self.hold_intervals
+            else:
+                self._hold -= 1
+                if self._hold <= 0:
+                    self._probing = True
+            self._last_goodput = goodput
+            if self.target != old:
+                self.logger.debug(f"Concurrency {old} -> {self.target} (goodput {goodput/1e6:.1f} MB/s)")
+                self._cond.notify_all()
+
+    def slot(self, should_continue=None):
+        return _Slot(self, should_continue)
+
+
+class _Slot:
+    def __init__(self, controller, should_continue):
+        self.controller = controller
+        self.should_continue = should_continue
+        self.acquired = False
+
+    def __enter__(self):
+        self.acquired = self.controller.acquire(self.should_continue)
+        return self.acquired
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.acquired:
+            self.controller.release()
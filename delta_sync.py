@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import mmap
+import bisect
+import zlib
+import hashlib
+
+# zsync-style delta transfer. The publisher ships a block manifest next to the file:
+#   {"version": 1, "size": N, "block_size": B, "sha256": "<whole file>",
+#    "blocks": [[adler32, "<blake2b-128 hex>"], ...]}
+# The client looks for those blocks in an older local copy (same offset first, then anywhere via a
+# rolling Adler-32), copies the ones it finds into the new .part file and range-fetches only the rest.
+
+DEFAULT_BLOCK_SIZE = 128 * 1024
+# The rolling search advances one byte per Python iteration (about 2 MB/s), so it is capped: each point where
+# the old file shifted costs at most one block of rolling to realign, and whatever is not found within the
+# budget is range-fetched rather than spending minutes of CPU on a multi-GB file
+MAX_ROLL_BYTES = 2 * 1024 * 1024
+_MOD = 65521
+
+
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def build_manifest(path, block_size=DEFAULT_BLOCK_SIZE):
+    """Block manifest for the file at path, as published alongside a release."""
+    blocks = []
+    whole = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            whole.update(block)
+            blocks.append([zlib.adler32(block), strong_hash(block)])
+    return {
+        'version': 1,
+        'size': os.path.getsize(path),
+        'block_size': block_size,
+        'sha256': whole.hexdigest(),
+        'blocks': blocks,
+    }
+
+
+def load_manifest(text):
+    manifest = json.loads(text)
+    if manifest.get('version') != 1:
+        raise ValueError(f"Unsupported delta manifest version {manifest.get('version')}")
+    block_size = int(manifest['block_size'])
+    size = int(manifest['size'])
+    if len(manifest['blocks']) != (size + block_size - 1) // block_size:
+        raise ValueError("Delta manifest block count does not match its size")
+    return manifest
+
+
+def _block_len(manifest, idx):
+    block_size = manifest['block_size']
+    return min(block_size, manifest['size'] - idx * block_size)
+
+
+def plan(manifest, base_path, max_roll=MAX_ROLL_BYTES):
+    """
+    Find the manifest's blocks in the old file at base_path.
+    Returns {block index: offset in the old file} for every block that can be copied locally.
+    Blocks are first checked at their own offset (the common case for a patched build), then the
+    remaining full-size blocks are searched with a rolling Adler-32 over the parts of the old file that
+    did not match in place.
+    After a hit the search jumps a whole block ahead, so runs of blocks that merely moved are
+    confirmed with one strong hash each instead of a byte-by-byte roll.
+    The search only runs when something moved: if the old file has the new size and some blocks matched
+    in place, the misses are blocks rewritten in place and are fetched. It also gives up after max_roll
+    bytes of byte-by-byte rolling.
+    """
+    block_size = manifest['block_size']
+    blocks = manifest['blocks']
+    found = {}
+    if not os.path.exists(base_path) or os.path.getsize(base_path) == 0:
+        return found
+    with open(base_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as old:
+        old_len = len(old)
+        for idx, (weak, strong) in enumerate(blocks):
+            start = idx * block_size
+            length = _block_len(manifest, idx)
+            if start + length <= old_len and strong_hash(old[start:start + length]) == strong:
+                found[idx] = start
+        wanted = {}
+        for idx, (weak, strong) in enumerate(blocks):
+            if idx not in found and _block_len(manifest, idx) == block_size:
+                wanted.setdefault(weak, []).append(idx)
+        shifted = old_len != manifest['size'] or not found
+        if wanted and shifted and max_roll > 0:
+            # Old regions that already matched in place are not worth rolling through
+            skip = {offset for offset in found.values()}
+            _rolling_search(old, old_len, block_size, blocks, wanted, found, skip, max_roll)
+    return found
+
+
+def _rolling_search(old, old_len, block_size, blocks, wanted, found, skip, max_roll):
+    skip = sorted(skip)
+    last = old_len - block_size
+    pos = 0
+    rolled = 0
+    while pos <= last and wanted and rolled < max_roll:
+        i = bisect.bisect_left(skip, pos)
+        if i < len(skip) and skip[i] == pos:
+            pos += block_size
+            continue
+        value = zlib.adler32(old[pos:pos + block_size])
+        a, b = value & 0xffff, value >> 16
+        # Roll through a local copy of the window up to the next in-place match, the end or the roll budget,
+        # stopping early at a weak-hash candidate
+        stop = min(last, pos + max_roll - rolled, skip[i] if i < len(skip) else last)
+        window = old[pos:stop + block_size]
+        k, steps = 0, stop - pos
+        key = (b << 16) | a
+        while key not in wanted and k < steps:
+            out_byte = window[k]
+            a = (a - out_byte + window[k + block_size]) % _MOD
+            b = (b - block_size * out_byte + a - 1) % _MOD
+            key = (b << 16) | a
+            k += 1
+        pos += k
+        rolled += k
+        if key not in wanted:
+            if pos >= last:
+                break
+            continue
+        candidates = wanted[key]
+        strong = strong_hash(old[pos:pos + block_size])
+        hits = [idx for idx in candidates if blocks[idx][1] == strong]
+        if not hits:
+            pos += 1
+            rolled += 1
+            continue
+        for idx in hits:
+            found[idx] = pos
+            candidates.remove(idx)
+        if not candidates:
+            del wanted[key]
+        pos += block_size
+
+
+def copy_blocks(manifest, found, base_path, f, writer, journal=None):
+    """
+    Write every locally found block into f at its final offset, skipping ranges the journal already has.
+    Returns the number of bytes reused.
+    """
+    block_size = manifest['block_size']
+    reused = 0
+    done = list(journal.ranges) if journal else []
+    with open(base_path, 'rb') as src, mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as old:
+        for idx in sorted(found):
+            start = idx * block_size
+            length = _block_len(manifest, idx)
+            if any(s <= start and start + length - 1 <= e for s, e in done):
+                continue
+            offset = found[idx]
+            writer.write_at(f, old[offset:offset + length], start)
+            if journal:
+                journal.add(start, start + length - 1)
+            reused += length
+    return reused
+
+
+if __name__ == "__main__":
+    # Publish a manifest: python delta_sync.py <file> [block_size] > <file>.delta.json
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BLOCK_SIZE
+    json.dump(build_manifest(sys.argv[1], size), sys.stdout)
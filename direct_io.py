@@ -0,0 +1,133 @@
+import os
+import mmap
+import errno
+import logging
+import threading
+
+# O_DIRECT needs the file offset, the length and the buffer address aligned to the device's logical
+# block size. 4096 covers every current disk (512-byte devices accept it too).
+ALIGNMENT = 4096
+O_DIRECT = getattr(os, 'O_DIRECT', 0)
+# Downloads at least this large bypass the page cache by default (DownloadManager direct_io='auto')
+DIRECT_IO_MIN_SIZE = 1024 * 1024 * 1024
+
+
+class AlignedBufferPool:
+    """
+    Reusable page-aligned staging buffers for O_DIRECT writes.
+    Buffers are anonymous mmaps (always page aligned) created on first use and kept for reuse; at most
+    max_buffers exist at once, so acquire() blocks while every buffer is out.
+    """
+    def __init__(self, buffer_size=4 * 1024 * 1024, max_buffers=16):
+        if buffer_size % ALIGNMENT:
+            raise ValueError(f"buffer_size must be a multiple of {ALIGNMENT}")
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self._free = []
+        self._created = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while not self._free and self._created >= self.max_buffers:
+                self._cond.wait()
+            if self._free:
+                return self._free.pop()
+            self._created += 1
+        return mmap.mmap(-1, self.buffer_size)
+
+    def release(self, buf):
+        with self._cond:
+            self._free.append(buf)
+            self._cond.notify()
+
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+def default_pool():
+    """Process-wide pool shared by every DiskWriter, so concurrent downloads do not each pin their own buffers."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = AlignedBufferPool()
+        return _pool
+
+
+def _pwrite_all(fd, view, offset):
+    written = 0
+    while written < len(view):
+        written += os.pwrite(fd, view[written:], offset + written)
+    return written
+
+
+class DirectFile:
+    """
+    A second, O_DIRECT descriptor on a file that is otherwise written through the page cache.
+    pwrite() sends the block-aligned middle of every buffer through O_DIRECT (copied into an aligned pool
+    buffer) and writes the unaligned head and tail, which may share a block with a neighbouring segment,
+    through the normal descriptor. Whole blocks are only ever written by one path, so the two never
+    overlap. If the filesystem refuses O_DIRECT (tmpfs, some network filesystems) the constructor or the
+    first write raises/disables it and everything goes through the normal descriptor.
+    """
+    def __init__(self, path, pool=None, logger=None):
+        if not O_DIRECT or not hasattr(os, 'pwrite'):
+            raise OSError(errno.EOPNOTSUPP, "O_DIRECT is not supported on this platform")
+        self.path = path
+        self.pool = pool or default_pool()
+        self.logger = logger or logging.getLogger('DirectFile')
+        self.fd = os.open(path, os.O_WRONLY | O_DIRECT)
+        self.disabled = False
+        self.direct_bytes = 0
+        self.buffered_bytes = 0
+
+    def pwrite(self, buffered_fd, data, offset):
+        """Write data at offset; buffered_fd is the file's normal descriptor. Returns bytes written."""
+        view = memoryview(data).cast('B')
+        end = offset + len(view)
+        a_start = -(-offset // ALIGNMENT) * ALIGNMENT
+        a_end = end // ALIGNMENT * ALIGNMENT
+        if self.disabled or a_end <= a_start:
+            self.buffered_bytes += len(view)
+            return _pwrite_all(buffered_fd, view, offset)
+        if a_start > offset:
+            _pwrite_all(buffered_fd, view[:a_start - offset], offset)
+        position = a_start
+        buf = self.pool.acquire()
+        try:
+            staging = memoryview(buf)
+            while position < a_end:
+                n = min(self.pool.buffer_size, a_end - position)
+                staging[:n] = view[position - offset:position - offset + n]
+                try:
+                    _pwrite_all(self.fd, staging[:n], position)
+                except OSError as e:
+                    if e.errno != errno.EINVAL:
+                        raise
+                    self.logger.warning(f"O_DIRECT rejected for {self.path} ({e}); using buffered writes")
+                    self.disabled = True
+                    _pwrite_all(buffered_fd, view[position - offset:a_end - offset], position)
+                    self.buffered_bytes += a_end - position
+                    position = a_end
+                    break
+                self.direct_bytes += n
+                position += n
+            staging.release()
+        finally:
+            self.pool.release(buf)
+        if end > a_end:
+            _pwrite_all(buffered_fd, view[a_end - offset:], a_end)
+        self.buffered_bytes += (a_start - offset) + (end - a_end)
+        return len(view)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,213 @@
+import os
+import sys
+import time
+import errno
+import ctypes
+import ctypes.util
+import shutil
+import sqlite3
+import logging
+import threading
+
+from io_scheduler import device_of
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+DEFAULT_PATH = os.environ.get('DOWNLOAD_RESERVATIONS_DB') or os.path.join(
+    os.path.expanduser('~'), '.download_manager', 'reservations.db')
+# Space left untouched on every volume, so the system and other programs are never starved by downloads
+MIN_FREE_BYTES = int(os.environ.get('DOWNLOAD_MIN_FREE_BYTES', 64 * 1024 * 1024))
+# Reservations older than this are treated as leaked even if their pid has been reused by another process
+STALE_SECONDS = 7 * 24 * 3600
+
+
+class InsufficientSpace(OSError):
+    """Raised before a transfer starts when its destination volume cannot hold it."""
+    def __init__(self, path, needed, available):
+        super().__init__(errno.ENOSPC, f"{needed} bytes needed on the volume of {path}, {max(0, available)} available")
+        self.path = path
+        self.needed = needed
+        self.available = available
+
+
+def _load_fallocate():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        fn = getattr(libc, 'fallocate64', None) or libc.fallocate
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_fallocate = _load_fallocate()
+
+
+def fallocate(fd, size):
+    """
+    Reserve size bytes of disk blocks for fd in as few extents as the filesystem can manage.
+    Returns False when the filesystem cannot allocate ahead (the caller falls back to a sparse
+    truncate); raises OSError(ENOSPC) when the volume is full. On Linux the fallocate syscall is
+    used directly: glibc's posix_fallocate emulates unsupported filesystems by writing every block.
+    """
+    if size <= 0:
+        return True
+    if _fallocate is not None:
+        if _fallocate(fd, 0, 0, size) == 0:
+            return True
+        err = ctypes.get_errno()
+        if err in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+            return False
+        raise OSError(err, os.strerror(err))
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return True
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+                return False
+            raise
+    return False
+
+
+def allocated_bytes(path):
+    """Bytes of disk actually allocated to path (0 if it does not exist)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    blocks = getattr(st, 'st_blocks', None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+def free_bytes(path):
+    """Free bytes on the volume that holds path; path need not exist yet."""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return shutil.disk_usage(path).free
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if psutil:
+        return psutil.pid_exists(pid)
+    if sys.platform.startswith('win'):
+        return True  # cannot tell without psutil; the age limit reclaims it eventually
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class ReservationLedger:
+    """
+    Per-volume record of the disk space promised to downloads that are still running.
+    Before a transfer starts, DownloadManager reserves the bytes its .part file still has to grow by;
+    the check counts what every other live reservation on the same volume has not yet allocated, so
+    two downloads that each fit alone but not together are refused up front instead of one of them
+    hitting ENOSPC near the end. Entries of processes that died are dropped on the next reserve().
+    Backed by SQLite (WAL mode), so separate processes share one ledger.
+    Usage:
+        ledger = ReservationLedger()
+        rid = ledger.reserve(dest + '.part', total_size)   # raises InsufficientSpace
+        try:
+            ...
+        finally:
+            ledger.release(rid)
+    """
+    def __init__(self, path=DEFAULT_PATH, min_free=MIN_FREE_BYTES, logger=None):
+        self.path = path
+        self.min_free = min_free
+        self.logger = logger or logging.getLogger('ReservationLedger')
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode: reserve() runs its own BEGIN IMMEDIATE so the check and insert are atomic across processes
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS reservations ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT, device TEXT NOT NULL, path TEXT NOT NULL,'
+                ' bytes INTEGER NOT NULL, pid INTEGER NOT NULL, created REAL NOT NULL)')
+
+    def reserve(self, path, size):
+        """
+        Reserve room for path to reach size bytes and return the reservation id.
+        Raises InsufficientSpace if the volume's free space, less what other live reservations still
+        need and the min_free margin, cannot cover it.
+        """
+        path = os.path.abspath(path)
+        device = str(device_of(path))
+        needed = max(0, size - allocated_bytes(path))
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                outstanding = 0
+                now = time.time()
+                for rid, other, nbytes, pid, created in self._db.execute(
+                        'SELECT id, path, bytes, pid, created FROM reservations WHERE device = ?', (device,)).fetchall():
+                    if now - created > STALE_SECONDS or not _pid_alive(pid):
+                        self._db.execute('DELETE FROM reservations WHERE id = ?', (rid,))
+                        continue
+                    # Blocks a reservation has already allocated are gone from the free count
+                    outstanding += max(0, nbytes - allocated_bytes(other))
+                available = free_bytes(path) - outstanding - self.min_free
+                if needed > available:
+                    raise InsufficientSpace(path, needed, available)
+                rid = self._db.execute(
+                    'INSERT INTO reservations (device, path, bytes, pid, created) VALUES (?, ?, ?, ?, ?)',
+                    (device, path, size, os.getpid(), now)).lastrowid
+                self._db.execute('COMMIT')
+                return rid
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def release(self, rid):
+        with self._lock:
+            self._db.execute('DELETE FROM reservations WHERE id = ?', (rid,))
+
+    def outstanding(self, path):
+        """Bytes reserved on path's volume by live downloads but not yet allocated."""
+        device = str(device_of(path))
+        with self._lock:
+            rows = self._db.execute('SELECT path, bytes FROM reservations WHERE device = ?', (device,)).fetchall()
+        return sum(max(0, nbytes - allocated_bytes(other)) for other, nbytes in rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_ledger_lock = threading.Lock()
+_ledger = None
+
+
+def default_ledger(logger=None):
+    """Process-wide ledger at DEFAULT_PATH, opened on first use; None if it cannot be opened."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            try:
+                _ledger = ReservationLedger(logger=logger)
+            except Exception as e:
+                (logger or logging.getLogger('ReservationLedger')).warning(f"Disk reservation ledger unavailable: {e}")
+                return None
+        return _ledger
@@ -2,6 +2,11 @@ import os
 import threading
 import time
 import logging
+import weakref
+from rate_limiter import TokenBucket
+from direct_io import DirectFile
+from durability import DEFAULT_DURABILITY, TRICKLE_BYTES, check_mode, sync_data, start_writeback
+from disk_space import fallocate
 
 class DiskWriter:
     """
@@ -11,12 +16,15 @@ class DiskWriter:
         with DiskWriter(...) as writer:
             writer.write(f, data)
     """
-    def __init__(self, throttle_bps=None, chunk_size=1024*1024, fsync_interval=5, logger=None, adaptive=True, use_directio=False, prefetch=False, max_performance=False):
+    IOV_MAX = 1024  # buffers per pwritev call (the POSIX minimum for IOV_MAX)
+
+    def __init__(self, throttle_bps=None, chunk_size=1024*1024, fsync_interval=5, logger=None, adaptive=True, use_directio=False, prefetch=False, max_performance=False, limiter=None, hasher=None,
+                 durability=DEFAULT_DURABILITY, scheduler=None, priority='normal'):
         if chunk_size < 4096 or chunk_size > 128*1024*1024:
             raise ValueError("chunk_size must be between 4KB and 128MB")
         self.throttle_bps = throttle_bps if (throttle_bps is None or throttle_bps > 0) else None
         self.chunk_size = chunk_size
-        self.fsync_interval = max(1, fsync_interval)  # seconds between fsyncs
+        self.fsync_interval = max(1, fsync_interval)  # seconds between syncs in 'periodic-fdatasync' mode
         self.logger = logger or logging.getLogger('DiskWriter')
         self._lock = threading.Lock()
         self.adaptive = adaptive
@@ -27,6 +35,23 @@ class DiskWriter:
             self.throttle_bps = None
             self.adaptive = True
             self.prefetch = True
+        # A shared limiter (e.g. the owning download's bucket) takes precedence over a private throttle
+        self.limiter = limiter or (TokenBucket(self.throttle_bps) if self.throttle_bps else None)
+        # Optional StreamingHasher fed with every buffer as it is written (see stream_hash.py)
+        self.hasher = hasher
+        # use_directio: open files get a companion O_DIRECT descriptor (see direct_io.py), dropped with the file
+        self._direct = weakref.WeakKeyDictionary()
+        # When written data is synced; see durability.py. Files written so far are tracked for checkpoint syncs.
+        self.durability = check_mode(durability)
+        self._files = weakref.WeakSet()
+        self._unsynced = 0
+        self._last_sync = time.time()
+        self.syncs = 0
+        # Optional io_scheduler.DeviceScheduler shared by every writer on the destination's device; the write
+        # syscalls then run on its workers in priority order ('installer', 'normal', 'background'), while
+        # hashing, extract sinks and durability bookkeeping stay on the calling thread
+        self.scheduler = scheduler
+        self.priority = priority
         self._closed = False
 
     def __enter__(self):
@@ -37,7 +62,24 @@ class DiskWriter:
 
     def close(self):
         self._closed = True
-        # No resources to release, but method is here for API completeness
+        for direct in list(self._direct.values()):
+            if direct:
+                direct.close()
+        self._direct.clear()
+
+    def _direct_file(self, f):
+        """The O_DIRECT companion for f, or None if direct I/O is off or the file cannot use it."""
+        if not self.use_directio:
+            return None
+        with self._lock:
+            if f not in self._direct:
+                try:
+                    self._direct[f] = DirectFile(f.name, logger=self.logger)
+                except (OSError, AttributeError, TypeError) as e:
+                    self.logger.info(f"Direct I/O unavailable for {getattr(f, 'name', f)} ({e}); using buffered writes")
+                    self._direct[f] = None
+            direct = self._direct[f]
+        return direct if direct and not direct.disabled else None
 
     def write(self, f, data):
         """
@@ -49,7 +91,6 @@ class DiskWriter:
             raise RuntimeError("DiskWriter is closed")
         if not hasattr(f, 'write') or not hasattr(f, 'flush'):
             raise ValueError("f must be a writable file-like object")
-        last_fsync = time.time()
         total_written = 0
         chunk_size = self.chunk_size
         min_chunk = 64 * 1024
@@ -57,24 +98,40 @@ class DiskWriter:
         last_time = time.time()
         last_bytes = 0
         offset = 0
+        position = None
+        if self.hasher:
+            try:
+                position = f.tell()
+            except (OSError, ValueError):
+                position = None
+        # Streams are read into one reused buffer and in-memory data is sliced as memoryviews, so no
+        # chunk allocates a new bytes object; chunks are only valid until the next get_chunk()
+        readinto = getattr(data, 'readinto', None)
+        if readinto:
+            buffer = memoryview(bytearray(max(max_chunk, chunk_size)))
+        elif isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data).cast('B')
         def get_chunk():
+            if readinto:
+                try:
+                    n = readinto(buffer[:chunk_size])
+                except Exception as e:
+                    self.logger.error(f"Error reading from stream: {e}")
+                    raise
+                return buffer[:n or 0]
             if hasattr(data, 'read'):
                 try:
                     return data.read(chunk_size)
                 except Exception as e:
                     self.logger.error(f"Error reading from stream: {e}")
                     raise
-            elif isinstance(data, (bytes, bytearray)):
+            elif isinstance(data, (bytes, bytearray, memoryview)):
                 nonlocal offset
-                if offset >= len(data):
-                    return b''
-                chunk = data[offset:offset+chunk_size]
+                chunk = view[offset:offset+chunk_size]
                 offset += len(chunk)
                 return chunk
             else:
                 raise ValueError("Unsupported data type for DiskWriter.write")
-        # Optionally use direct I/O (Windows: FILE_FLAG_NO_BUFFERING, Linux: O_DIRECT)
-        # Not implemented here for cross-platform safety, but can be added if needed
         if self.prefetch and hasattr(data, 'read'):
             import queue
             q = queue.Queue(maxsize=2)
@@ -100,6 +157,12 @@ class DiskWriter:
                 if not chunk:
                     break
                 self._write_chunk(f, chunk)
+                if self.hasher:
+                    if position is None:
+                        self.hasher.update(chunk)
+                    else:
+                        self.hasher.update_at(position, chunk, f)
+                        position += len(chunk)
                 total_written += len(chunk)
                 now = time.time()
                 # Adaptive chunk size logic: increase if fast, decrease if slow
@@ -112,28 +175,180 @@ class DiskWriter:
                         chunk_size = new_chunk
                     last_time = now
                     last_bytes = total_written
-                if self.throttle_bps:
-                    time.sleep(len(chunk) / self.throttle_bps)
-                if time.time() - last_fsync > self.fsync_interval:
-                    try:
-                        os.fsync(f.fileno())
-                    except Exception as e:
-                        self.logger.debug(f"fsync failed: {e}")
-                    last_fsync = time.time()
-            try:
-                os.fsync(f.fileno())
-            except Exception as e:
-                self.logger.debug(f"Final fsync failed: {e}")
+                if self.limiter:
+                    self.limiter.consume(len(chunk))
+                self._written(f, len(chunk))
+            if self.hasher:
+                # Out-of-order catch-up reads the file back, so Python's buffer must be on the fd
+                f.flush()
             return total_written
         except Exception as e:
             self.logger.error(f"Disk write failed: {e}")
             raise
 
+    def write_at(self, f, data, offset):
+        """
+        Positional write of a single buffer at offset, for segments that land out of order.
+        Uses os.pwrite where available so concurrent segments never share a file position;
+        elsewhere falls back to seek+write under the writer lock.
+        Returns bytes written.
+        """
+        if self._closed:
+            raise RuntimeError("DiskWriter is closed")
+        try:
+            written = self._issue(lambda: self._pwrite(f, data, offset), len(data), (f.fileno(), offset))
+        except Exception as e:
+            self.logger.error(f"Positional write at {offset} failed: {e}")
+            raise
+        # Hashing (and any extract sink behind the hasher) runs on the caller's thread, never on a device worker
+        if self.hasher:
+            self.hasher.update_at(offset, data, f)
+        self._written(f, written)
+        return written
+
+    def _issue(self, fn, nbytes, key):
+        """Run the write syscall(s) in fn, through the device scheduler when there is one."""
+        if self.scheduler:
+            return self.scheduler.submit(fn, nbytes, self.priority, key=key)
+        return fn()
+
+    def _pwrite(self, f, data, offset):
+        direct = self._direct_file(f)
+        if direct:
+            return direct.pwrite(f.fileno(), data, offset)
+        if hasattr(os, 'pwrite'):
+            view = memoryview(data)
+            fd = f.fileno()
+            written = 0
+            while written < len(view):
+                written += os.pwrite(fd, view[written:], offset + written)
+            return written
+        with self._lock:
+            f.seek(offset)
+            f.write(data)
+        return len(data)
+
+    def write_at_many(self, f, buffers, offset):
+        """
+        Write consecutive buffers starting at offset with one vectored os.pwritev, without joining them first.
+        Falls back to one pwrite per buffer where pwritev is missing or direct I/O is on. Returns bytes written.
+        """
+        if self._closed:
+            raise RuntimeError("DiskWriter is closed")
+        views = [memoryview(b) for b in buffers]
+        size = sum(len(v) for v in views)
+        try:
+            self._issue(lambda: self._pwritev(f, views, offset), size, (f.fileno(), offset))
+        except Exception as e:
+            self.logger.error(f"Vectored write at {offset} failed: {e}")
+            raise
+        if self.hasher:
+            position = offset
+            for v in views:
+                self.hasher.update_at(position, v, f)
+                position += len(v)
+        self._written(f, size)
+        return size
+
+    def _pwritev(self, f, views, offset):
+        if len(views) == 1 or not hasattr(os, 'pwritev') or self._direct_file(f):
+            position = offset
+            for v in views:
+                position += self._pwrite(f, v, position)
+            return position - offset
+        size = sum(len(v) for v in views)
+        fd = f.fileno()
+        written = 0
+        while written < size:
+            # pwritev may stop short; carry on from the first byte it did not write
+            skip = written
+            iov = []
+            for v in views:
+                if skip >= len(v):
+                    skip -= len(v)
+                    continue
+                iov.append(v[skip:])
+                skip = 0
+            written += os.pwritev(fd, iov[:self.IOV_MAX], offset + written)
+        return written
+
+    def preallocate(self, f, size):
+        """
+        Size the destination up front so segments can be written at their final offsets.
+        The blocks are allocated in one go where the filesystem supports it, so concurrent segments do not
+        leave the file fragmented and the volume cannot run out of space halfway through.
+        """
+        try:
+            f.flush()
+            if not fallocate(f.fileno(), size):
+                self.logger.debug("Filesystem cannot preallocate; extending sparsely")
+            f.truncate(size)
+        except Exception as e:
+            self.logger.error(f"Preallocation to {size} bytes failed: {e}")
+            raise
+
+    def fsync(self, f):
+        """End-of-transfer sync: flush f and make its data durable unless durability is 'none'."""
+        try:
+            f.flush()
+            if self.durability != 'none':
+                self._sync(f)
+        except Exception as e:
+            self.logger.debug(f"fsync failed: {e}")
+
+    def sync_for_checkpoint(self):
+        """
+        ChunkJournal.on_checkpoint hook: in 'checkpoint-aligned' mode, make everything written so far durable
+        before the journal that records it is persisted.
+        """
+        if self.durability != 'checkpoint-aligned':
+            return
+        for f in list(self._files):
+            try:
+                if not f.closed:
+                    f.flush()
+                    self._sync(f)
+            except Exception as e:
+                self.logger.debug(f"Checkpoint sync failed: {e}")
+
+    def _sync(self, f):
+        sync_data(f.fileno())
+        self._last_sync = time.time()
+        self.syncs += 1
+
+    def _written(self, f, n):
+        """Per-write durability bookkeeping: background writeback every TRICKLE_BYTES, periodic syncs."""
+        if self.durability == 'none':
+            return
+        self._files.add(f)
+        self._unsynced += n
+        if self._unsynced >= TRICKLE_BYTES:
+            self._unsynced = 0
+            try:
+                start_writeback(f.fileno())
+            except Exception as e:
+                self.logger.debug(f"sync_file_range failed: {e}")
+        if self.durability == 'periodic-fdatasync' and time.time() - self._last_sync > self.fsync_interval:
+            try:
+                f.flush()
+                self._sync(f)
+            except Exception as e:
+                self.logger.debug(f"Periodic fdatasync failed: {e}")
+
     def _write_chunk(self, f, chunk):
+        return self._issue(lambda: self._write_chunk_now(f, chunk), len(chunk), (f.fileno(), 0))
+
+    def _write_chunk_now(self, f, chunk):
+        direct = self._direct_file(f)
         with self._lock:
             try:
+                if direct:
+                    f.flush()
+                    position = f.tell()
+                    direct.pwrite(f.fileno(), chunk, position)
+                    f.seek(position + len(chunk))
+                    return
                 f.write(chunk)
-                f.flush()
             except Exception as e:
                 self.logger.error(f"Disk write failed: {e}")
                 raise
@@ -148,6 +363,7 @@ class DiskWriter:
             try:
                 with open(tmp_path, mode) as f:
                     self.write(f, data)
+                    self.fsync(f)
                 os.replace(tmp_path, path)
                 self.logger.info(f"safe_write succeeded for {path} on attempt {attempt+1}")
                 return True
@@ -7,8 +7,10 @@ import logging
 import threading
 import base64
 import json
+import asyncio
 import shutil
 from urllib.parse import urlparse
+from urllib.request import url2pathname
 try:
     import paramiko  # For SFTP
 except ImportError:
@@ -27,6 +29,29 @@ from virus_check_utils import scan_if_unsigned
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from disk_writer import DiskWriter
+from segmented_download import SegmentedDownloader
+from chunk_journal import ChunkJournal
+from async_download import AsyncSegmentedDownloader
+from rate_limiter import TokenBucket, CompositeLimiter
+from shared_rate_table import process_limiter
+from concurrency_controller import ConcurrencyController
+from mirrors import MirrorSet, MirrorMismatch, parse_metalink
+from stream_hash import StreamingHasher, new_hash, parse_expected
+from metadata_store import MetadataStore, default_store
+from capability_cache import default_cache
+from artifact_cache import default_artifact_cache
+from stream_pipeline import ExtractPipeline
+import http_pool
+import delta_sync
+import fast_copy
+from write_behind import WriteBehind
+from buffer_pool import default_pool
+from memory_budget import default_budget
+from direct_io import DIRECT_IO_MIN_SIZE
+from durability import DEFAULT_DURABILITY, check_mode
+import io_scheduler
+from disk_space import InsufficientSpace, MIN_FREE_BYTES, allocated_bytes, default_ledger, free_bytes
+from tree_copy import TreeCopy, smb_unc, DEFAULT_WORKERS as TREE_WORKERS
 
 # --- DownloadManager class definition ---
 
@@ -73,8 +98,9 @@ def handle_takeover(conn):
                 # Update parameters if needed (e.g., url, virus_check, etc.)
                 print(f"[Takeover] Updating existing download for {dest}")
                 mgr.url = url
+                if req.get('bandwidth') is not None:
+                    mgr.set_bandwidth(req.get('bandwidth'))
                 # Optionally update other parameters here
-                # You could also implement a method to update bandwidth, threads, etc.
                 conn.sendall(b'{"status":"ok","msg":"updated existing download"}')
             else:
                 try:
@@ -116,6 +142,10 @@ def start_takeover_server():
 
 class DownloadManager:
     def _auto_tune(self, total_size):
+        """
+        Upper bound on in-flight segments and the read chunk size for a file of this size.
+        How many segments actually run is decided at runtime by ConcurrencyController.
+        """
         import multiprocessing
         cpu_count = multiprocessing.cpu_count()
         if total_size >= 2 * 1024 * 1024 * 1024:
@@ -127,9 +157,21 @@ class DownloadManager:
         else:
             threads = min(8, cpu_count)
             chunk_size = 1 * 1024 * 1024
+        caps = self.capabilities or {}
+        if caps.get('http2'):
+            # Segments are multiplexed streams on a shared connection, so core count matters less
+            threads = max(threads, min(16, http_pool.MAX_CONNECTIONS_PER_ORIGIN))
+        if caps.get('max_connections'):
+            threads = min(threads, caps['max_connections'])
         return threads, chunk_size
 
     def download(self):
+        if self._is_metalink():
+            try:
+                self._load_metalink()
+            except Exception as e:
+                self.logger.error(f"Failed to load metalink {self.url}: {e}")
+                return
         parsed = urlparse(self.url)
         scheme = parsed.scheme.lower()
         try:
@@ -157,38 +199,68 @@ class DownloadManager:
                 return
             if scheme == 'smb':
                 self.download_smb()
-                return
+                return self.result
             if scheme == 'file':
                 self.download_file_url()
-                return
+                return self.result
             if self.url.startswith('data:'):
                 self.download_data_url()
                 return
             total_size = 0
+            status = None
+            entry = self._stored_copy()
+            if entry and self._expected_digests():
+                # dest already holds exactly the content we were asked for
+                self._finish_not_modified(entry)
+                self.spin_down()
+                return self.result
+            if self._deliver_from_cache():
+                self.spin_down()
+                return self.result
+            redirect = self._load_capabilities()
             try:
-                with requests.get(self.url, stream=True, timeout=30) as r:
-                    r.raise_for_status()
-                    total_size = int(r.headers.get('content-length', 0))
+                status, total_size = self._probe_http(entry, redirect)
             except Exception as e:
                 self.logger.error(f"Failed to get HTTP headers: {e}")
                 total_size = 0
+            if status == 304 and entry:
+                self._finish_not_modified(entry)
+                self.spin_down()
+                return self.result
+            if status and self._deliver_from_cache(total_size):
+                self.spin_down()
+                return self.result
+            # Segmenting a server that ignores Range would fetch the whole file once per segment
+            segmentable = total_size > 0 and self.accept_ranges is not False
+            if total_size > 0:
+                self._reserve_space(total_size)
             if self.status:
                 self.print_status()
-            if self.threads > 1 and total_size > 0:
-                self._download_multithreaded(total_size)
+            if self.delta_manifest and segmentable:
+                complete = self._download_delta(total_size)
+            elif len(self.mirror_urls) > 1 and segmentable:
+                complete = self._download_multithreaded(total_size, mirrors=self._probe_mirrors(total_size))
+            elif self.engine == 'async' and segmentable:
+                complete = asyncio.run(self._download_async(total_size))
+            elif self.threads > 1 and segmentable:
+                complete = self._download_multithreaded(total_size)
             else:
-                self._download_singlethreaded(total_size)
-            if self.virus_check:
-                try:
-                    scan_if_unsigned(self.dest)
-                except Exception as e:
-                    self.logger.error(f"Virus scan failed: {e}")
-            self.cleanup_temp_files()
+                complete = self._download_singlethreaded(total_size)
+            if not complete:
+                self.logger.info(f"Download of {self.dest} stopped early; partial data kept for resume.")
+                self._abort_extract()
+                self.spin_down()
+                return
+            self._finish_http_download()
             self.spin_down()
+            return self.result
         except Exception as e:
             self.logger.error(f"Download failed: {e}")
-            self.cleanup_temp_files()
+            self._abort_extract()
+            self.cleanup_temp_files(keep_partial=True)
             self.spin_down()
+        finally:
+            self._release_space()
 
     def download_ftp(self):
         from ftplib import FTP
@@ -203,6 +275,7 @@ class DownloadManager:
             def callback(data):
                 writer.write(f, data)
             ftp.retrbinary(f'RETR {parsed.path}', callback)
+            writer.fsync(f)
         ftp.quit()
         logging.info(f"FTP download complete: {self.dest}")
         if self.virus_check:
@@ -225,6 +298,7 @@ class DownloadManager:
         with open(self.dest, 'wb') as out_f:
             with sftp.open(parsed.path, 'rb') as in_f:
                 writer.write(out_f, in_f)
+            writer.fsync(out_f)
         sftp.close()
         transport.close()
         logging.info(f"SFTP download complete: {self.dest}")
@@ -240,10 +314,15 @@ class DownloadManager:
         if not smbclient:
             logging.error("smbclient is not installed. SMB not supported.")
             return
-        parsed = urlparse(self.url)
-        writer = self._get_disk_writer()
-        with smbclient.open_file(self.url, mode='rb') as src, open(self.dest, 'wb') as dst:
-            writer.write(dst, src)
+        if smbclient.path.isdir(smb_unc(self.url)):
+            self._copy_tree(self.url)
+            return
+        part = self.dest + '.part'
+        # Large reused buffer instead of DiskWriter's per-chunk reads and flushes
+        with smbclient.open_file(smb_unc(self.url), mode='rb') as src, open(part, 'wb') as dst:
+            fast_copy.copy_stream(src, dst, on_chunk=self._local_copy_step)
+        if not self._finish_local_copy(part):
+            return
         logging.info(f"SMB download complete: {self.dest}")
         if self.virus_check:
             try:
@@ -255,11 +334,17 @@ class DownloadManager:
 
     def download_file_url(self):
         parsed = urlparse(self.url)
-        src_path = parsed.path
-        writer = self._get_disk_writer()
-        with open(src_path, 'rb') as src, open(self.dest, 'wb') as dst:
-            writer.write(dst, src)
-        logging.info(f"File URL copy complete: {self.dest}")
+        src_path = url2pathname(parsed.path)
+        if os.path.isdir(src_path):
+            self._copy_tree(src_path)
+            return
+        part = self.dest + '.part'
+        # reflink / copy_file_range / sendfile: the data never passes through Python, and on an
+        # NFS or SMB mount copy_file_range can turn into a server-side copy
+        method, _ = fast_copy.copy_file(src_path, part, on_chunk=self._local_copy_step)
+        if not self._finish_local_copy(part):
+            return
+        logging.info(f"File URL copy complete: {self.dest} ({method})")
         if self.virus_check:
             try:
                 scan_if_unsigned(self.dest)
@@ -268,6 +353,42 @@ class DownloadManager:
         self.cleanup_temp_files()
         self.spin_down()
 
+    def _copy_tree(self, source):
+        """Mirror a directory source into self.dest; self.result becomes the tree manifest."""
+        workers = self.threads if self.threads > 1 else TREE_WORKERS
+        tree = TreeCopy(source, self.dest, workers=workers, on_chunk=self.read_limiter.consume,
+                        should_continue=lambda: self.running, logger=self.logger)
+        self.result = tree.run()
+        logging.info(f"Tree copy of {source} into {self.dest} finished: {self.result['totals']}")
+        if self.virus_check:
+            try:
+                scan_if_unsigned(self.dest)
+            except Exception as e:
+                logging.error(f"Virus scan failed: {e}")
+        self.cleanup_temp_files()
+        self.spin_down()
+
+    def _local_copy_step(self, n):
+        # Local copies are charged to the same bandwidth budget and honour stop() like transfers
+        self.read_limiter.consume(n)
+        return self.running
+
+    def _finish_local_copy(self, part):
+        """
+        Move a finished local copy into place; a stopped one is discarded. Returns True if dest was written.
+        The copy bypassed DiskWriter, so the durability mode is applied to the .part file here: a crash
+        must never leave a truncated file under the final name.
+        """
+        if not self.running:
+            if os.path.exists(part):
+                os.remove(part)
+            logging.info(f"Copy to {self.dest} stopped")
+            return False
+        with open(part, 'r+b') as f:
+            self._get_disk_writer().fsync(f)
+        os.replace(part, self.dest)
+        return True
+
     def download_data_url(self):
         header, encoded = self.url.split(',', 1)
         if ';base64' in header:
@@ -277,6 +398,7 @@ class DownloadManager:
         writer = self._get_disk_writer()
         with open(self.dest, 'wb') as f:
             writer.write(f, data)
+            writer.fsync(f)
         logging.info(f"Data URL download complete: {self.dest}")
         if self.virus_check:
             try:
@@ -310,8 +432,11 @@ class DownloadManager:
         self.cleanup_temp_files()
         self.spin_down()
 
-    def cleanup_temp_files(self):
-        temp_files = [self.dest + ".part", self.dest + ".tmp", self.dest + ".meta"]
+    def cleanup_temp_files(self, keep_partial=False):
+        # keep_partial leaves the .part file and its journal behind so the next attempt can resume
+        temp_files = [self.dest + ".tmp", self.dest + ".meta"]
+        if not keep_partial:
+            temp_files += [self.dest + ".part", self.dest + ".journal", self.dest + ".journal.tmp"]
         for f in temp_files:
             try:
                 if os.path.exists(f):
@@ -347,95 +472,643 @@ class DownloadManager:
         except Exception as e:
             print(f"[Status] Could not retrieve throttler status: {e}")
 
+    def _open_journal(self, total_size):
+        """
+        Load the chunk journal for this destination, discarding it (and the .part file)
+        unless it was written for the same remote object as the one the server now reports.
+        Returns None when the size is unknown, since such downloads cannot be resumed safely.
+        """
+        if total_size <= 0:
+            return None
+        part_path = self.dest + '.part'
+        journal = ChunkJournal.load(self.dest + '.journal', logger=self.logger)
+        if os.path.exists(part_path) and journal.matches(self.url, total_size, self.etag, self.last_modified):
+            self.logger.info(f"Resuming {self.dest}: {journal.completed_bytes()}/{total_size} bytes already on disk")
+            return journal
+        if journal.ranges:
+            self.logger.info(f"Discarding stale partial download for {self.dest}")
+        try:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        except Exception as e:
+            self.logger.warning(f"Failed to remove stale part file {part_path}: {e}")
+        journal.reset(self.url, total_size, self.etag, self.last_modified)
+        return journal
+
+    def _reserve_space(self, total_size):
+        """
+        Fail before anything is transferred when the destination volume cannot take the rest of the file,
+        counting the space other running downloads have reserved there. Held until download() returns.
+        """
+        part_path = self.dest + '.part'
+        if self.space_ledger:
+            self.space_reservation = self.space_ledger.reserve(part_path, total_size)
+            return
+        needed = total_size - allocated_bytes(part_path)
+        available = free_bytes(part_path) - MIN_FREE_BYTES
+        if needed > available:
+            raise InsufficientSpace(part_path, needed, available)
+
+    def _release_space(self):
+        if self.space_reservation is not None:
+            try:
+                self.space_ledger.release(self.space_reservation)
+            except Exception as e:
+                self.logger.warning(f"Failed to release disk reservation for {self.dest}: {e}")
+            self.space_reservation = None
+
+    def _finalize_part(self):
+        # Atomic publish: the destination only ever holds a complete file
+        os.replace(self.dest + '.part', self.dest)
+        ChunkJournal(self.dest + '.journal', logger=self.logger).remove()
+
+    def _finish_http_download(self):
+        digests = self._verify_part()
+        self._finalize_part()
+        if self.virus_check:
+            try:
+                scan_if_unsigned(self.dest)
+            except Exception as e:
+                self.logger.error(f"Virus scan failed: {e}")
+        extracted = self._finish_extract()
+        self.cleanup_temp_files()
+        self.result = {
+            'url': self.url,
+            'dest': self.dest,
+            'size': os.path.getsize(self.dest),
+            'hashes': digests,
+            'verified': bool(self._expected_digests()) and all(a in digests for a in self._expected_digests()),
+            'segments': self.segment_hashes,
+            'not_modified': False,
+            'cached': None,
+            'delta': self.delta_stats,
+            'extracted': extracted,
+            'writes': self.write_stats,
+        }
+        if self.artifact_cache and digests.get('sha256'):
+            try:
+                self.artifact_cache.store(self.dest, digests['sha256'], url=self.url, etag=self.etag,
+                                          last_modified=self.last_modified)
+            except Exception as e:
+                self.logger.warning(f"Failed to cache {self.dest}: {e}")
+        if self.metadata_store:
+            try:
+                self.metadata_store.put(self.url, self.dest, etag=self.etag, last_modified=self.last_modified,
+                                        size=self.result['size'], hashes=digests)
+            except Exception as e:
+                self.logger.warning(f"Failed to record metadata for {self.dest}: {e}")
+        return self.result
+
+    def _finish_extract(self):
+        # The payload was decoded into a staging directory as it arrived; publish it now that the file checked out
+        if not self.pipeline:
+            return None
+        pipeline, self.pipeline = self.pipeline, None
+        try:
+            return pipeline.close(self.dest)
+        except Exception as e:
+            self.logger.error(f"Extracting {self.dest} failed: {e}")
+            return None
+
+    def _extract_delivered(self):
+        """
+        extract_to for a dest that was not transferred (304 or artifact cache hit): there is no stream to
+        decode as it arrives, so the file on disk is fed through the pipeline instead.
+        """
+        if not self.extract_to:
+            return None
+        try:
+            pipeline = ExtractPipeline(self.extract_to, os.path.basename(self.dest), logger=self.logger)
+        except ValueError as e:
+            self.logger.warning(f"Not extracting {self.dest}: {e}")
+            return None
+        try:
+            with open(self.dest, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    pipeline.write(chunk)
+            return pipeline.close(self.dest)
+        except Exception as e:
+            pipeline.abort()
+            self.logger.error(f"Extracting {self.dest} failed: {e}")
+            return None
+
+    def _abort_extract(self):
+        if self.pipeline:
+            self.pipeline.abort()
+            self.pipeline = None
+
+    def _load_capabilities(self):
+        """
+        Read what the capability cache knows about this URL's origin before probing, so a known origin gets
+        its engine, segment count and concurrency ceiling from the start. Returns the cached redirect target, if any.
+        """
+        self.capabilities = None
+        if not self.capability_cache:
+            return None
+        try:
+            redirect = self.capability_cache.get_redirect(self.url)
+            self.capabilities = self.capability_cache.get(redirect or self.url)
+        except Exception as e:
+            self.logger.warning(f"Failed to read capability cache: {e}")
+            return None
+        if self.capabilities:
+            self.accept_ranges = self.capabilities['accept_ranges']
+        return redirect
+
+    def _probe_http(self, entry=None, cached=None):
+        """
+        One small request for the object's size, validators and range support.
+        Starts at the cached redirect target when there is one and falls back to self.url if that fails.
+        Returns (status_code, total_size).
+        """
+        self.fetch_url = self.url
+        for url in ([cached] if cached else []) + [self.url]:
+            try:
+                with http_pool.get_session().get(url, headers=self._probe_headers(entry), stream=True, timeout=30) as r:
+                    if r.status_code == 304:
+                        return 304, 0
+                    r.raise_for_status()
+                    total_size = self._apply_probe(r.status_code, r.headers)
+                    self._record_probe(r.url, r.status_code, r.headers, bool(r.history))
+                    return r.status_code, total_size
+            except Exception as e:
+                if url != cached:
+                    raise
+                self.logger.info(f"Cached redirect target {cached} failed ({e}); retrying {self.url}")
+                self.capability_cache.forget_redirect(self.url)
+
+    def _record_probe(self, final_url, status_code, headers, redirected):
+        """
+        Note what the probe showed: transfers go to final_url, and the origin's range support is cached.
+        The probe decides for this URL, but one resource ignoring Range (a dynamically generated file, say)
+        does not overturn an origin known to honour it; that entry is left to expire instead of being refreshed.
+        """
+        self.fetch_url = final_url
+        self.accept_ranges = status_code == 206 and headers.get('accept-ranges', 'bytes').lower() != 'none'
+        if not self.capability_cache:
+            return
+        try:
+            if redirected:
+                self.capability_cache.set_redirect(self.url, final_url)
+            known = self.capability_cache.get(final_url)
+            if known and known['accept_ranges'] and not self.accept_ranges:
+                self.logger.info(f"{final_url} ignored Range although its origin honours it; fetching it in one stream")
+            else:
+                self.capability_cache.update(final_url, accept_ranges=self.accept_ranges)
+                known = self.capability_cache.get(final_url)
+            self.capabilities = known
+        except Exception as e:
+            self.logger.warning(f"Failed to update capability cache: {e}")
+
+    def _record_transfer(self, engine, controller):
+        """After a segmented transfer, remember whether HTTP/2 was used and any ceiling the server forced."""
+        if not self.capability_cache:
+            return
+        try:
+            self.capability_cache.update(
+                self.fetch_url,
+                http2=(engine.http_version == 'HTTP/2') if engine.http_version else None,
+                max_connections=controller.ceiling if controller.overloads else None)
+        except Exception as e:
+            self.logger.warning(f"Failed to update capability cache: {e}")
+
+    def _probe_headers(self, entry=None):
+        # One byte is enough to learn the size (from Content-Range) and the validators
+        headers = {'Range': 'bytes=0-0'}
+        headers.update(MetadataStore.conditional_headers(entry))
+        return headers
+
+    def _apply_probe(self, status_code, headers):
+        """Record the validators of a probe response and return the object's total size (0 if unknown)."""
+        self.etag = headers.get('etag')
+        self.last_modified = headers.get('last-modified')
+        if status_code == 206:
+            total = headers.get('content-range', '').rsplit('/', 1)[-1].strip()
+            return int(total) if total.isdigit() else 0
+        return int(headers.get('content-length', 0))
+
+    def _stored_copy(self):
+        """
+        Metadata entry for the file already at dest, usable for a conditional request.
+        None if there is no entry, the file was changed since we wrote it, or its digest contradicts expected_hash.
+        """
+        if not self.conditional or not self.metadata_store or not os.path.exists(self.dest):
+            return None
+        try:
+            entry = self.metadata_store.get(self.url, self.dest)
+        except Exception as e:
+            self.logger.warning(f"Metadata lookup failed for {self.dest}: {e}")
+            return None
+        if not entry or not (entry['etag'] or entry['last_modified']):
+            return None
+        st = os.stat(self.dest)
+        if st.st_size != entry['size'] or entry['mtime'] is None or abs(st.st_mtime - entry['mtime']) > 0.001:
+            return None
+        for algo, expected in self._expected_digests().items():
+            if entry['hashes'].get(algo) != expected:
+                return None
+        return entry
+
+    def _finish_not_modified(self, entry):
+        self.logger.info(f"{self.dest} is up to date; {self.url} not modified")
+        self.cleanup_temp_files()
+        self.result = {
+            'url': self.url,
+            'dest': self.dest,
+            'size': entry['size'],
+            'hashes': entry['hashes'],
+            'verified': bool(self._expected_digests()),
+            'segments': [],
+            'not_modified': True,
+            'cached': None,
+        }
+        self.result['extracted'] = self._extract_delivered()
+        return self.result
+
+    def _deliver_from_cache(self, total_size=None):
+        """
+        Serve dest from the artifact cache. Before the probe only an expected SHA-256 identifies the content;
+        after it (total_size given) the URL's last known digest is used if the server reports the same object.
+        Returns the result dict, or None on a miss.
+        """
+        if not self.artifact_cache:
+            return None
+        digest = self._expected_digests().get('sha256')
+        if not digest and total_size is not None:
+            digest = self.artifact_cache.lookup(self.url, self.etag, self.last_modified, total_size or None)
+        method = self.artifact_cache.deliver(digest, self.dest) if digest else None
+        if not method:
+            if total_size is not None:
+                self.artifact_cache.note_miss()
+            return None
+        self.cleanup_temp_files()
+        self.result = {
+            'url': self.url,
+            'dest': self.dest,
+            'size': os.path.getsize(self.dest),
+            'hashes': {'sha256': digest},
+            'verified': 'sha256' in self._expected_digests(),
+            'segments': [],
+            'not_modified': False,
+            'cached': method,
+        }
+        self.result['extracted'] = self._extract_delivered()
+        if self.metadata_store:
+            try:
+                self.metadata_store.put(self.url, self.dest, etag=self.etag, last_modified=self.last_modified,
+                                        size=self.result['size'], hashes=self.result['hashes'])
+            except Exception as e:
+                self.logger.warning(f"Failed to record metadata for {self.dest}: {e}")
+        return self.result
+
+    def _expected_digests(self):
+        if self.expected_hash:
+            return parse_expected(self.expected_hash)
+        hashes = (self.metalink or {}).get('hashes') or {}
+        for algo in ('sha512', 'sha256', 'sha1', 'md5'):
+            if algo in hashes:
+                return {algo: hashes[algo]}
+        if self.delta_sha256:
+            return {'sha256': self.delta_sha256}
+        return {}
+
+    def _start_hasher(self, journal=None):
+        """
+        Fresh StreamingHasher for this attempt, covering hash_algorithms plus the expected hash's algorithm.
+        Bytes resumed from the journal are already on disk and get read back once by the hasher.
+        """
+        algorithms = []
+        for algo in list(self.hash_algorithms) + list(self._expected_digests()):
+            algo = algo.lower().replace('-', '')
+            if algo in algorithms:
+                continue
+            try:
+                new_hash(algo)
+            except ValueError as e:
+                self.logger.warning(f"Skipping {algo} digest: {e}")
+                continue
+            algorithms.append(algo)
+        self._abort_extract()
+        if self.extract_to:
+            try:
+                self.pipeline = ExtractPipeline(self.extract_to, os.path.basename(self.dest), logger=self.logger)
+            except ValueError as e:
+                self.logger.warning(f"Not extracting {self.dest}: {e}")
+        sinks = [self.pipeline] if self.pipeline else []
+        self.hasher = StreamingHasher(algorithms, sinks=sinks) if algorithms or sinks else None
+        self.segment_hashes = []
+        if self.hasher and journal:
+            for start, end in journal.ranges:
+                self.hasher.mark_written(start, end + 1)
+        return self.hasher
+
+    def _verify_part(self):
+        """
+        Complete the digests computed while writing and compare them with the expected hash.
+        A mismatch deletes the partial file and its journal (the data is bad, not merely incomplete) and raises IOError.
+        """
+        if not self.hasher:
+            return {}
+        part_path = self.dest + '.part'
+        digests = self.hasher.finish(part_path, os.path.getsize(part_path))
+        if self.hasher.read_back_bytes:
+            self.logger.debug(f"Hashing {self.dest} re-read {self.hasher.read_back_bytes} bytes")
+        for algo, expected in self._expected_digests().items():
+            actual = digests.get(algo)
+            if actual is None:
+                self.logger.warning(f"Cannot verify {algo} digest of {self.dest}: algorithm unavailable")
+            elif actual != expected:
+                self._abort_extract()
+                self.cleanup_temp_files()
+                raise IOError(f"{algo} mismatch for {self.dest}: expected {expected}, got {actual}")
+            else:
+                self.logger.info(f"Verified {algo} digest of {self.dest}")
+        return digests
+
     def _download_singlethreaded(self, total_size):
-        min_chunk = 64 * 1024
-        max_chunk = 8 * 1024 * 1024
-        chunk_size = CHUNK_SIZE
-        writer = self._get_disk_writer()
+        part_path = self.dest + '.part'
+        journal = self._open_journal(total_size)
+        writer = self._get_disk_writer(total_size=total_size, journal=journal)
+        offset = journal.contiguous_prefix() if journal else 0
+        if journal and not offset and journal.ranges:
+            # Only a prefix can be resumed sequentially; anything else is rewritten from scratch
+            journal.reset(self.url, total_size, self.etag, self.last_modified)
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
         try:
-            with requests.get(self.url, stream=True, verify=False) as r, open(self.dest, 'wb') as f, tqdm(
-                total=total_size, unit='B', unit_scale=True, desc=os.path.basename(self.dest)) as pbar:
+            with http_pool.get_session().get(self.fetch_url, headers=headers, stream=True, verify=False) as r:
                 r.raise_for_status()
-                last_time = time.time()
-                last_bytes = 0
-                chunk_size = CHUNK_SIZE
-                for chunk in r.iter_content(chunk_size=chunk_size):
-                    if not self.running:
-                        break
-                    writer.write(f, chunk)
-                    pbar.update(len(chunk))
-                    now = time.time()
-                    elapsed = now - last_time
-                    if elapsed > 0.5:
-                        speed = (pbar.n - last_bytes) / elapsed
-                        if speed > 0:
-                            target_time = 0.3
-                            new_chunk = int(speed * target_time)
-                            new_chunk = max(64 * 1024, min(8 * 1024 * 1024, new_chunk))
-                            if abs(new_chunk - chunk_size) > 64 * 1024:
-                                chunk_size = new_chunk
-                        last_time = now
-                        last_bytes = pbar.n
+                if offset and r.status_code != 206:
+                    self.logger.info("Server ignored resume Range request; restarting from byte 0")
+                    offset = 0
+                    journal.reset(self.url, total_size, self.etag, self.last_modified)
+                writer.hasher = self._start_hasher()
+                if writer.hasher and offset:
+                    writer.hasher.mark_written(0, offset)
+                on_written = (lambda o, n: journal.add(o, o + n - 1)) if journal else None
+                with open(part_path, 'r+b' if offset else 'wb') as f, tqdm(
+                    total=total_size, initial=offset, unit='B', unit_scale=True, desc=os.path.basename(self.dest)) as pbar:
+                    if total_size > 0 and not offset:
+                        writer.preallocate(f, total_size)
+                    # Disk writes happen on a writer thread so a slow disk does not stall the socket reads
+                    pool = default_pool(CHUNK_SIZE)
+                    budget = default_budget()
+                    sink = WriteBehind(writer, f, threads=1, logger=self.logger, pool=pool, budget=budget)
+                    try:
+                        self._stream_to(sink, r, offset, pbar, on_written, pool, budget)
+                    finally:
+                        try:
+                            sink.close()
+                        finally:
+                            self.write_stats = sink.stats()
+                            writer.fsync(f)
+                    offset += sink.bytes_written
         except Exception as e:
             logging.error(f"Download failed: {e}")
+            raise
+        finally:
+            if journal:
+                journal.checkpoint(force=True)
+        return self.running and (total_size <= 0 or offset >= total_size)
 
-    def _download_multithreaded(self, total_size):
-        import httpx
+    def _stream_to(self, sink, r, offset, pbar, on_written, pool, budget):
+        """
+        Hand a sequential response body, read into pooled buffers, to the write-behind sink starting at file offset.
+        Each chunk is paid for from budget before it is read; the sink refunds it once written.
+        """
+        for chunk in http_pool.iter_body(r, pool, budget, lambda: self.running):
+            if not self.running:
+                budget.release(len(chunk))
+                break
+            try:
+                self.read_limiter.consume(len(chunk))
+                sink.submit(chunk, offset, on_written)
+            except BaseException:
+                budget.release(len(chunk))
+                raise
+            offset += len(chunk)
+            pbar.update(len(chunk))
+
+    def _concurrency_controller(self, max_threads):
+        # Start small and let the controller climb; self.threads acts as a floor for the first probe
+        initial = min(max_threads, max(2, self.threads))
+        controller = ConcurrencyController(initial=initial, maximum=max_threads, logger=self.logger)
+        ceiling = (self.capabilities or {}).get('max_connections')
+        if ceiling:
+            # The origin settled at this level before: start there instead of climbing again, and never probe past it
+            controller.ceiling = max(controller.minimum, min(controller.maximum, ceiling))
+            controller.target = controller.ceiling
+        return controller
+
+    def _download_multithreaded(self, total_size, mirrors=None, journal=None):
         threads, chunk_size = self._auto_tune(total_size)
         if self.mode == 'max_speed':
+            # max_speed raises the ceiling; the controller still backs off if the link or server cannot take it
             threads = max(32, threads)
             chunk_size = max(8 * 1024 * 1024, chunk_size)
-        url = self.url
-        results = [None] * threads
-        ranges = [(i * (total_size // threads), (i + 1) * (total_size // threads) - 1 if i < threads - 1 else total_size - 1, i)
-                  for i in range(threads)]
-        def download_range(start, end, idx):
-            headers = {'Range': f'bytes={start}-{end}'}
+        controller = self._concurrency_controller(threads)
+        journal = journal or self._open_journal(total_size)
+        writer = self._get_disk_writer(self._start_hasher(journal), total_size, journal)
+        with tqdm(total=total_size, initial=journal.completed_bytes(), unit='B', unit_scale=True,
+                  desc=os.path.basename(self.dest)) as pbar:
+            engine = SegmentedDownloader(self.fetch_url, self.dest + '.part', total_size, threads=threads, chunk_size=chunk_size,
+                                         writer=writer, logger=self.logger, progress=pbar.update,
+                                         should_continue=lambda: self.running, journal=journal,
+                                         limiter=self.read_limiter, controller=controller, mirrors=mirrors,
+                                         segment_hash=self.hasher.algorithms[0] if self.hasher else None)
+            engine.run()
+        self.segment_hashes = sorted(engine.segment_hashes, key=lambda s: s['start'])
+        self.write_stats = engine.write_stats
+        if self.write_stats and self.write_stats['stalls']:
+            self.logger.info(f"Disk writes throttled the transfer of {self.dest}: {self.write_stats}")
+        self._record_transfer(engine, controller)
+        return engine.complete
+
+    def _download_delta(self, total_size):
+        """
+        zsync-style update: copy the blocks the old local file already has into the .part file and record
+        them in the journal, so the segmented engine range-fetches only the blocks that changed.
+        Falls back to a full segmented download if the manifest is unusable.
+        """
+        base = self.delta_base or self.dest
+        try:
+            manifest = delta_sync.load_manifest(self._read_resource(self.delta_manifest))
+            if manifest['size'] != total_size:
+                raise ValueError(f"manifest describes {manifest['size']} bytes, server has {total_size}")
+        except Exception as e:
+            self.logger.warning(f"Delta manifest unusable ({e}); downloading {self.dest} in full")
+            return self._download_multithreaded(total_size)
+        self.delta_sha256 = manifest.get('sha256')
+        journal = self._open_journal(total_size)
+        found = delta_sync.plan(manifest, base)
+        part_path = self.dest + '.part'
+        writer = self._get_disk_writer(total_size=total_size, journal=journal)
+        with open(part_path, 'r+b' if os.path.exists(part_path) else 'w+b') as f:
+            writer.preallocate(f, total_size)
+            reused = delta_sync.copy_blocks(manifest, found, base, f, writer, journal) if found else 0
+            writer.fsync(f)
+        journal.checkpoint(force=True)
+        self.delta_stats = {'blocks': len(manifest['blocks']), 'reused_blocks': len(found), 'reused_bytes': reused}
+        self.logger.info(f"Delta update of {self.dest}: {len(found)}/{len(manifest['blocks'])} blocks found locally")
+        return self._download_multithreaded(total_size, journal=journal)
+
+    async def _download_async(self, total_size, client=None):
+        # engine='async': same segmentation and journal as the threaded path, driven by coroutines
+        concurrency, chunk_size = self._auto_tune(total_size)
+        if self.mode == 'max_speed':
+            concurrency = max(32, concurrency)
+            chunk_size = max(8 * 1024 * 1024, chunk_size)
+        controller = self._concurrency_controller(concurrency)
+        journal = self._open_journal(total_size)
+        writer = self._get_disk_writer(self._start_hasher(journal), total_size, journal)
+        with tqdm(total=total_size, initial=journal.completed_bytes(), unit='B', unit_scale=True,
+                  desc=os.path.basename(self.dest)) as pbar:
+            engine = AsyncSegmentedDownloader(self.fetch_url, self.dest + '.part', total_size, concurrency=concurrency,
+                                              chunk_size=chunk_size, writer=writer, logger=self.logger,
+                                              progress=pbar.update, should_continue=lambda: self.running,
+                                              journal=journal, client=client, limiter=self.read_limiter,
+                                              controller=controller)
+            await engine.run()
+        await asyncio.to_thread(self._record_transfer, engine, controller)
+        return engine.complete
+
+    def _is_metalink(self):
+        path = urlparse(self.url).path.lower() or self.url.lower()
+        return path.endswith('.metalink') or path.endswith('.meta4')
+
+    def _read_resource(self, location):
+        # Small side documents (metalinks, delta manifests) may be given as an HTTP(S) URL, file:// URL or path
+        parsed = urlparse(location)
+        if parsed.scheme in ('http', 'https'):
+            r = http_pool.get_session().get(location, timeout=30, verify=False)
+            r.raise_for_status()
+            return r.content
+        with open(parsed.path if parsed.scheme == 'file' else location, 'rb') as mf:
+            return mf.read()
+
+    def _load_metalink(self):
+        self.metalink = parse_metalink(self._read_resource(self.url))
+        # Only HTTP(S) mirrors can be raced range by range
+        urls = [u for u in self.metalink['urls'] if urlparse(u).scheme in ('http', 'https')] or self.metalink['urls']
+        if not urls:
+            raise ValueError("Metalink lists no URLs")
+        self.url = urls[0]
+        self.mirror_urls = urls
+        self.logger.info(f"Metalink resolved to {len(urls)} mirror(s) for {self.dest}")
+
+    def _probe_mirrors(self, total_size):
+        """
+        Check every mirror with a one-byte ranged GET and drop those that fail, ignore Range,
+        or report a different length; the survivors are raced by SegmentedDownloader.
+        """
+        mirror_set = MirrorSet([self.fetch_url] + [u for u in self.mirror_urls[1:] if u != self.fetch_url], logger=self.logger)
+        def probe(mirror):
             try:
-                with httpx.Client(http2=True, timeout=30, verify=False) as client:
-                    r = client.get(url, headers=headers)
+                with http_pool.get_session().get(mirror.url, headers={'Range': 'bytes=0-0'}, stream=True,
+                                                 timeout=15, verify=False) as r:
                     r.raise_for_status()
-                    return idx, r.content
+                    if r.status_code != 206:
+                        mirror_set.drop(mirror, "ignores Range requests")
+                        return
+                    mirror_set.check_response(mirror, total_size, r.headers.get('content-range'), None)
+                    mirror.etag = r.headers.get('etag')
+            except MirrorMismatch:
+                pass
             except Exception as e:
-                logging.error(f"Thread {idx} failed: {e}")
-                try:
-                    r = requests.get(url, headers=headers, stream=True, timeout=30, verify=False)
-                    r.raise_for_status()
-                    return idx, r.content
-                except Exception as e2:
-                    logging.error(f"Thread {idx} fallback failed: {e2}")
-                    return idx, b''
-        with ThreadPoolExecutor(max_workers=threads) as executor, tqdm(
-            total=total_size, unit='B', unit_scale=True, desc=os.path.basename(self.dest)) as pbar:
-            futures = {executor.submit(download_range, start, end, idx): idx for start, end, idx in ranges}
-            for future in as_completed(futures):
-                idx, data = future.result()
-                results[idx] = data
-                pbar.update(len(data))
-        try:
-            writer = self._get_disk_writer()
-            with open(self.dest, 'wb') as f:
-                for part in results:
-                    if part:
-                        writer.write(f, part)
-        except Exception as e:
-            logging.error(f"Failed to write file: {e}")
+                mirror_set.drop(mirror, f"probe failed: {e}")
+        with ThreadPoolExecutor(max_workers=min(8, len(mirror_set.mirrors))) as executor:
+            list(executor.map(probe, mirror_set.mirrors))
+        if self.metalink and self.metalink.get('size') and self.metalink['size'] != total_size:
+            self.logger.warning(f"Metalink size {self.metalink['size']} differs from server size {total_size}")
+        if not mirror_set.alive():
+            raise IOError("No usable mirrors")
+        return mirror_set
+
+    def set_bandwidth(self, bps):
+        """Apply a new bandwidth cap (bytes/sec, None for unlimited) to every reader of this download, mid-transfer."""
+        self.manual_bandwidth = int(bps) if bps else None
+        self.limiter.set_rate(self.manual_bandwidth)
+        self.logger.info(f"Bandwidth for {self.dest} set to {self.manual_bandwidth or 'unlimited'} bytes/s")
 
-    def _get_disk_writer(self):
-        return DiskWriter()
-    def __init__(self, url, dest, virus_check=True, threads=1, manual_bandwidth=None, mode='auto', status=False):
+    def _get_disk_writer(self, hasher=None, total_size=0, journal=None):
+        # Stream-based protocols are throttled as they are written; segmented HTTP readers draw from the same bucket
+        # A hasher given here sees segments out of order, and reads back what it cannot hold in memory; with
+        # O_DIRECT those pages are never cached, so 'auto' keeps hashed segmented writes in the page cache
+        direct = self.direct_io is True or (self.direct_io == 'auto' and total_size >= DIRECT_IO_MIN_SIZE
+                                            and hasher is None)
+        writer = DiskWriter(limiter=self.read_limiter, hasher=hasher, use_directio=direct, durability=self.durability,
+                            scheduler=io_scheduler.scheduler_for(self.dest, self.logger), priority=self.io_priority)
+        if journal:
+            journal.on_checkpoint = writer.sync_for_checkpoint
+        return writer
+    def __init__(self, url, dest, virus_check=True, threads=1, manual_bandwidth=None, mode='auto', status=False, engine='threads', mirrors=None,
+                 expected_hash=None, hash_algorithms=('sha256',), conditional=True, metadata_store=None,
+                 capability_cache=None, artifact_cache=None, delta_manifest=None, delta_base=None,
+                 extract_to=None, direct_io='auto', durability=DEFAULT_DURABILITY, io_priority='normal',
+                 space_ledger=None):
+        # url may be a list of equivalent mirrors; the first one is the primary
+        if isinstance(url, (list, tuple)):
+            mirrors = list(url[1:]) + list(mirrors or [])
+            url = url[0]
         self.url = url
+        self.mirror_urls = list(dict.fromkeys([url] + list(mirrors or [])))
+        self.metalink = None
         self.dest = dest
         self.virus_check = virus_check
         self.threads = threads
         self.manual_bandwidth = manual_bandwidth
+        self.limiter = TokenBucket(manual_bandwidth)
         self.mode = mode
         self.status = status
+        self.engine = engine  # 'threads' or 'async' (HTTP transfers on one asyncio event loop)
         self.idle_event = threading.Event()
         self.shutdown_event = threading.Event()
         self.last_activity = time.time()
         self.logger = logging.getLogger('DownloadManager')
+        # Readers also draw from ThrottleService's cross-process budget when it has published one
+        self.read_limiter = CompositeLimiter(self.limiter, process_limiter(self.logger))
         self.running = True
+        self.etag = None
+        self.last_modified = None
+        # expected_hash: 'sha256:<hex>', a bare sha256 hex digest or {algo: hex}; defaults to the metalink's hash
+        self.expected_hash = expected_hash
+        self.hash_algorithms = tuple(hash_algorithms or ())
+        self.hasher = None
+        self.segment_hashes = []
+        self.result = None
+        # conditional: skip the transfer when the server says the copy recorded in metadata_store is current
+        self.conditional = conditional
+        self.metadata_store = metadata_store or (default_store(self.logger) if conditional else None)
+        # Per-origin knowledge (range support, HTTP/2, tolerated concurrency, redirects) shared across downloads
+        self.capability_cache = capability_cache or default_cache(self.logger)
+        self.capabilities = None
+        self.fetch_url = url  # where transfers go; the final target when self.url redirects
+        self.accept_ranges = None
+        # Content-addressed store of finished downloads; a hit is copied locally instead of fetched
+        # (artifact_cache=False disables it for this download). Finished files are only added where the
+        # filesystem can clone them, unless the cache was opened with store_copies
+        self.artifact_cache = default_artifact_cache(self.logger) if artifact_cache is None else (artifact_cache or None)
+        # delta_manifest: URL or path of a delta_sync block manifest; delta_base: old local copy (default: dest)
+        self.delta_manifest = delta_manifest
+        self.delta_base = delta_base
+        self.delta_sha256 = None
+        self.delta_stats = None
+        # extract_to: directory that receives the decompressed/unpacked payload, decoded while it downloads;
+        # an existing directory keeps its other contents, only the paths the archive contains are replaced
+        self.extract_to = extract_to
+        self.pipeline = None
+        # direct_io: True/False, or 'auto' to bypass the page cache for downloads of DIRECT_IO_MIN_SIZE or more
+        # (except segmented downloads that are hashed or extracted as they arrive)
+        self.direct_io = direct_io
+        self.write_stats = None  # WriteBehind.stats() of the last transfer
+        # durability: when written data is synced to disk (see durability.py); 'none' for scratch downloads
+        self.durability = check_mode(durability)
+        # io_priority: class of this download's writes in the per-device scheduler ('installer', 'normal', 'background')
+        if io_priority not in io_scheduler.PRIORITIES:
+            raise ValueError(f"io_priority must be one of {', '.join(io_scheduler.PRIORITIES)}")
+        self.io_priority = io_priority
+        # Per-volume ledger of disk space promised to running downloads (space_ledger=False: check free space only)
+        self.space_ledger = default_ledger(self.logger) if space_ledger is None else (space_ledger or None)
+        self.space_reservation = None
 
     def is_torrent(self):
         return (self.url.startswith('magnet:') or self.url.endswith('.torrent'))
@@ -455,8 +1128,10 @@ import logging
 import threading
 import base64
 import json
+import asyncio
 import shutil
 from urllib.parse import urlparse
+from urllib.request import url2pathname
 try:
     import paramiko  # For SFTP
 except ImportError:
@@ -475,6 +1150,29 @@ from virus_check_utils import scan_if_unsigned
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from disk_writer import DiskWriter
+from segmented_download import SegmentedDownloader
+from chunk_journal import ChunkJournal
+from async_download import AsyncSegmentedDownloader
+from rate_limiter import TokenBucket, CompositeLimiter
+from shared_rate_table import process_limiter
+from concurrency_controller import ConcurrencyController
+from mirrors import MirrorSet, MirrorMismatch, parse_metalink
+from stream_hash import StreamingHasher, new_hash, parse_expected
+from metadata_store import MetadataStore, default_store
+from capability_cache import default_cache
+from artifact_cache import default_artifact_cache
+from stream_pipeline import ExtractPipeline
+import http_pool
+import delta_sync
+import fast_copy
+from write_behind import WriteBehind
+from buffer_pool import default_pool
+from memory_budget import default_budget
+from direct_io import DIRECT_IO_MIN_SIZE
+from durability import DEFAULT_DURABILITY, check_mode
+import io_scheduler
+from disk_space import InsufficientSpace, MIN_FREE_BYTES, allocated_bytes, default_ledger, free_bytes
+from tree_copy import TreeCopy, smb_unc, DEFAULT_WORKERS as TREE_WORKERS
 
 CHUNK_SIZE = 1024 * 1024  # 1MB default chunk size
 # Placeholders for IPC constants (define these elsewhere as needed)
@@ -1,7 +1,13 @@
 import threading
-import queue
+import time
 import os
+from collections import deque
 from download_manager import DownloadManager
+from async_download import AsyncDownloadEngine
+from artifact_cache import default_artifact_cache
+import http_pool
+import io_scheduler
+from memory_budget import default_budget
 from throttle_utils import SMALL_DOWNLOAD_THRESHOLD
 
 import socket
@@ -9,17 +15,112 @@ import json
 
 COMMAND_PORT = 54506  # Unique port for DownloadManagerPool commands
 COMMAND_TOKEN = os.environ.get('THROTTLE_IPC_TOKEN', 'super-secure-random-token-2025')
+# Workers that fetch small downloads concurrently; resizable at runtime (SET_SMALL_WORKERS)
+DEFAULT_SMALL_WORKERS = int(os.environ.get('DOWNLOAD_SMALL_WORKERS', 8))
+# A queued item gains one priority class for every AGING_SECONDS it waits, so background work is never starved
+AGING_SECONDS = 30.0
+
+
+class SmallDownloadQueue:
+    """
+    Priority queue of small downloads with aging.
+    Items are kept in one FIFO per priority class (io_scheduler.PRIORITIES, most urgent first); get()
+    takes the head whose class rank, less one rank per AGING_SECONDS waited, is lowest, so a steady
+    stream of urgent items delays older background items but cannot hold them back forever.
+    get() blocks until an item arrives or should_stop() is true; task_done()/join() work like queue.Queue's.
+    Usage:
+        q = SmallDownloadQueue()
+        q.put(item, 'background')
+        item = q.get(lambda: not running)   # None once should_stop() is true
+        ...
+        q.task_done()
+    """
+    def __init__(self, aging_seconds=AGING_SECONDS):
+        self.aging_seconds = aging_seconds
+        self._cond = threading.Condition()
+        self._queues = {p: deque() for p in io_scheduler.PRIORITIES}
+        self._unfinished = 0
+        self.completed = 0
+
+    def put(self, item, priority='normal'):
+        if priority not in self._queues:
+            raise ValueError(f"priority must be one of {', '.join(io_scheduler.PRIORITIES)}")
+        with self._cond:
+            self._queues[priority].append((time.monotonic(), item))
+            self._unfinished += 1
+            self._cond.notify()
+
+    def _pop(self):
+        now = time.monotonic()
+        best = None
+        for rank, priority in enumerate(io_scheduler.PRIORITIES):
+            q = self._queues[priority]
+            if q:
+                queued_at = q[0][0]
+                key = (rank - (now - queued_at) / self.aging_seconds, queued_at)
+                if best is None or key < best[0]:
+                    best = (key, q)
+        return best[1].popleft()[1] if best else None
+
+    def get(self, should_stop):
+        with self._cond:
+            while True:
+                if should_stop():
+                    return None
+                item = self._pop()
+                if item is not None:
+                    return item
+                self._cond.wait(1.0)
+
+    def task_done(self):
+        with self._cond:
+            self._unfinished -= 1
+            self.completed += 1
+            self._cond.notify_all()
+
+    def join(self):
+        """Block until every item put so far has been taken and marked done."""
+        with self._cond:
+            while self._unfinished:
+                self._cond.wait()
+
+    def wake(self):
+        """Make blocked get() calls re-check should_stop()."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def clear(self):
+        """Drop every queued item (each counts as done)."""
+        with self._cond:
+            dropped = sum(len(q) for q in self._queues.values())
+            for q in self._queues.values():
+                q.clear()
+            self._unfinished -= dropped
+            self._cond.notify_all()
+        return dropped
+
+    def stats(self):
+        with self._cond:
+            return {'queued': {p: len(q) for p, q in self._queues.items()}, 'unfinished': self._unfinished,
+                    'completed': self.completed}
+
 
 class DownloadManagerPool:
-    def __init__(self):
+    def __init__(self, small_workers=DEFAULT_SMALL_WORKERS):
         self.large_threads = []  # Each large file gets its own thread/instance
-        self.small_queue = queue.Queue()
-        self.small_thread = None
+        self.small_queue = SmallDownloadQueue()
+        self.small_workers = max(1, small_workers)
+        self.small_threads = []  # started on the first small download, up to small_workers
         self.lock = threading.Lock()
         self.running = True
         self.active_downloads = {}  # Map: dest -> thread or DownloadManager
 
-    def add_download(self, url, dest, size=None, **kwargs):
+    def add_download(self, url, dest, size=None, priority=None, **kwargs):
+        """
+        Start a download. Large ones (size >= SMALL_DOWNLOAD_THRESHOLD) get their own thread; the rest are
+        queued for the small-download workers by priority ('installer', 'normal', 'background'), which
+        defaults to the download's io_priority.
+        """
         # If size is not provided, treat as small (or could probe with HEAD request)
         is_large = size is not None and size >= SMALL_DOWNLOAD_THRESHOLD
         if is_large:
@@ -29,11 +130,52 @@ class DownloadManagerPool:
                 self.large_threads.append(t)
                 self.active_downloads[dest] = t
         else:
-            self.small_queue.put((url, dest, kwargs))
+            self.small_queue.put((url, dest, kwargs), priority or kwargs.get('io_priority', 'normal'))
+            self._spawn_small_workers()
+
+    def set_small_workers(self, count):
+        """Resize the small-download worker pool; surplus workers exit after their current download."""
+        if not isinstance(count, int) or count < 1:
+            return False
+        with self.lock:
+            self.small_workers = count
+        self._spawn_small_workers()
+        self.small_queue.wake()
+        return True
+
+    def _spawn_small_workers(self):
+        with self.lock:
+            self.small_threads = [t for t in self.small_threads if t.is_alive()]
+            while self.running and len(self.small_threads) < self.small_workers:
+                t = threading.Thread(target=self._small_worker, daemon=True)
+                self.small_threads.append(t)
+                t.start()
+
+    def _retire_small_worker(self):
+        """True (and the calling worker is unregistered) if the pool has more small workers than wanted."""
+        with self.lock:
+            me = threading.current_thread()
+            if self.running and len(self.small_threads) <= self.small_workers:
+                return False
+            if me in self.small_threads:
+                self.small_threads.remove(me)
+            return True
+
+    def download_many_async(self, jobs, max_downloads=256, **kwargs):
+        """
+        Run many HTTP(S) downloads as coroutines on one event loop instead of a thread each.
+        jobs is an iterable of (url, dest); blocks until all finish and returns per-job results.
+        """
+        managers = [DownloadManager(url, dest, engine='async', **kwargs) for url, dest in jobs]
+        with self.lock:
+            for mgr in managers:
+                self.active_downloads[mgr.dest] = mgr
+        try:
+            return AsyncDownloadEngine(max_downloads=max_downloads).run_many(managers)
+        finally:
             with self.lock:
-                if self.small_thread is None or not self.small_thread.is_alive():
-                    self.small_thread = threading.Thread(target=self._run_small_batch, daemon=True)
-                    self.small_thread.start()
+                for mgr in managers:
+                    self.active_downloads.pop(mgr.dest, None)
 
     def _run_large(self, url, dest, kwargs):
         try:
@@ -50,9 +192,13 @@ class DownloadManagerPool:
             else:
                 print(f"[Error] Large download failed: {url} -> {e}")
 
-    def _run_small_batch(self):
-        while not self.small_queue.empty() and self.running:
-            url, dest, kwargs = self.small_queue.get()
+    def _small_worker(self):
+        # Workers stay up while the queue is empty; they only exit on stop() or when the pool is shrunk
+        while True:
+            item = self.small_queue.get(self._retire_small_worker)
+            if item is None:
+                return
+            url, dest, kwargs = item
             try:
                 mgr = DownloadManager(url, dest, **kwargs)
                 with self.lock:
@@ -72,9 +218,8 @@ class DownloadManagerPool:
         # Wait for all large downloads
         for t in self.large_threads:
             t.join()
-        # Wait for small downloads
-        if self.small_thread:
-            self.small_thread.join()
+        # Wait for small downloads, including ones queued while waiting
+        self.small_queue.join()
 
     def spin_down_thread(self, download_id=None, count=1):
         # For demo: just print, real logic would reduce threads for a download
@@ -82,6 +227,14 @@ class DownloadManagerPool:
         # Implement logic to reduce threads for a given download if possible
         return True
 
+    def set_bandwidth(self, download_id, bps):
+        with self.lock:
+            mgr = self.active_downloads.get(download_id)
+        if not isinstance(mgr, DownloadManager):
+            return False
+        mgr.set_bandwidth(bps)
+        return True
+
     def pause(self, download_id=None):
         print(f"[Command] Pausing download: {download_id if download_id else 'ALL'}")
         # Implement logic to pause downloads
@@ -110,6 +263,35 @@ class DownloadManagerPool:
                 count = req.get('count', 1)
                 ok = self.spin_down_thread(download_id, count)
                 conn.sendall(b'OK' if ok else b'ERROR')
+            elif cmd == 'SET_BANDWIDTH':
+                download_id = req.get('download_id')
+                ok = self.set_bandwidth(download_id, req.get('bandwidth'))
+                conn.sendall(b'OK' if ok else b'ERROR')
+            elif cmd == 'SET_SMALL_WORKERS':
+                ok = self.set_small_workers(req.get('count'))
+                conn.sendall(b'OK' if ok else b'ERROR')
+            elif cmd == 'SMALL_QUEUE_STATS':
+                with self.lock:
+                    workers = {'workers': len(self.small_threads), 'target': self.small_workers}
+                conn.sendall(json.dumps(dict(self.small_queue.stats(), **workers)).encode())
+            elif cmd == 'IO_STATS':
+                conn.sendall(json.dumps(io_scheduler.stats()).encode())
+            elif cmd == 'SET_DISK_BUDGET':
+                # Device-wide write budget (bytes/s, null for unlimited) for the device holding 'path'
+                ok = io_scheduler.set_budget(req.get('path', '.'), req.get('bandwidth'))
+                conn.sendall(b'OK' if ok else b'ERROR')
+            elif cmd == 'MEMORY_STATS':
+                conn.sendall(json.dumps(default_budget().stats()).encode())
+            elif cmd == 'SET_MEMORY_BUDGET':
+                # Process-wide cap (bytes) on downloaded data held in memory before it reaches disk
+                limit = req.get('bytes')
+                ok = isinstance(limit, int) and limit > 0
+                if ok:
+                    default_budget().set_limit(limit)
+                conn.sendall(b'OK' if ok else b'ERROR')
+            elif cmd == 'CACHE_STATS':
+                cache = default_artifact_cache()
+                conn.sendall(json.dumps(cache.stats() if cache else {}).encode())
             elif cmd == 'PAUSE':
                 download_id = req.get('download_id')
                 ok = self.pause(download_id)
@@ -123,10 +305,10 @@ class DownloadManagerPool:
 
     def stop(self):
         self.running = False
-        # Optionally, clear the queue
-        while not self.small_queue.empty():
-            self.small_queue.get()
-            self.small_queue.task_done()
+        # Drop queued small downloads; idle workers see running is False and exit
+        self.small_queue.clear()
+        # Workers share the process-wide HTTP pools; release their sockets once nothing is running
+        http_pool.close_all()
 
 # Example usage:
 if __name__ == "__main__":
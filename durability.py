@@ -0,0 +1,55 @@
+import os
+import sys
+import ctypes
+import ctypes.util
+
+# How hard DiskWriter works to get written data onto stable storage:
+#   none                - never sync; for scratch data that is worthless after a crash
+#   end-only            - one fdatasync when the transfer finishes
+#   periodic-fdatasync  - fdatasync every fsync_interval seconds, and at the end
+#   checkpoint-aligned  - fdatasync just before a resume journal checkpoint is persisted, and at the end,
+#                         so the journal never claims bytes a crash could lose (the default)
+DURABILITY_MODES = ('none', 'end-only', 'periodic-fdatasync', 'checkpoint-aligned')
+DEFAULT_DURABILITY = 'checkpoint-aligned'
+
+# Dirty bytes after which writeback is started in the background (sync_file_range, Linux only), so the
+# page cache never builds up a backlog that makes the next fdatasync or the kernel's own flush stall
+TRICKLE_BYTES = 8 * 1024 * 1024
+SYNC_FILE_RANGE_WRITE = 2
+
+
+def _load_sync_file_range():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        fn = libc.sync_file_range
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_uint]
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_sync_file_range = _load_sync_file_range()
+
+
+def check_mode(mode):
+    if mode not in DURABILITY_MODES:
+        raise ValueError(f"durability must be one of {', '.join(DURABILITY_MODES)}, not {mode!r}")
+    return mode
+
+
+def sync_data(fd):
+    """Make fd's data durable; fdatasync skips the metadata-only journal commit where the OS offers it."""
+    if hasattr(os, 'fdatasync'):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+
+def start_writeback(fd, offset=0, length=0):
+    """Ask the kernel to begin writing back fd's dirty pages (whole file by default) without waiting. Returns False if unsupported."""
+    if _sync_file_range is None:
+        return False
+    return _sync_file_range(fd, offset, length, SYNC_FILE_RANGE_WRITE) == 0
@@ -0,0 +1,150 @@
+import os
+import sys
+import errno
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Linux ioctl that makes dst share src's extents (btrfs, XFS with reflink=1, bcachefs, OCFS2).
+FICLONE = 0x40049409
+# Kernel copy errors that mean "not possible for these two files", as opposed to real I/O failures
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.EBADF, errno.ENOTSUP}
+# Bytes per kernel call: large enough to keep syscalls rare, small enough that throttling,
+# progress and cancellation (on_chunk) stay responsive
+COPY_STEP = 16 * 1024 * 1024
+BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def reflink(src, dst):
+    """Clone src to dst as a copy-on-write reflink. Raises OSError where the filesystem cannot do it."""
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "reflink is not supported on this platform")
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    # sendfile writes at the destination's file position
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def copy_fds(src_fd, dst_fd, size, on_chunk=None, start=0):
+    """
+    Copy bytes [start, size) between two regular-file descriptors at the same offsets.
+    Tries os.copy_file_range (in-kernel, may become a reflink or a server-side copy on NFS/SMB mounts),
+    then os.sendfile, then a readinto loop; a method the kernel refuses is dropped and the next one
+    continues from the same offset. on_chunk(n) is called after every step and may return False to stop.
+    Returns (method, bytes copied).
+    """
+    offset = start
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append(('copy_file_range', _copy_file_range))
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        methods.append(('sendfile', _sendfile))
+    for name, step in methods:
+        try:
+            while offset < size:
+                n = step(src_fd, dst_fd, offset, min(COPY_STEP, size - offset))
+                if n == 0:
+                    break
+                offset += n
+                if on_chunk and on_chunk(n) is False:
+                    return name, offset - start
+            if offset >= size:
+                return name, offset - start
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+    with os.fdopen(os.dup(src_fd), 'rb', buffering=0) as src, os.fdopen(os.dup(dst_fd), 'wb', buffering=0) as dst:
+        src.seek(offset)
+        dst.seek(offset)
+        copied = copy_stream(src, dst, on_chunk)
+    return 'readinto', offset - start + copied
+
+
+def copy_stream(src, dst, on_chunk=None, buffer_size=BUFFER_SIZE):
+    """
+    Copy a file-like source (e.g. an SMB handle) into dst through one reusable buffer:
+    readinto() fills it and dst is written from a memoryview, so no per-chunk bytes objects are made.
+    Returns bytes copied; stops early if on_chunk(n) returns False.
+    """
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    total = 0
+    readinto = getattr(src, 'readinto', None)
+    while True:
+        if readinto:
+            n = readinto(buf)
+        else:
+            data = src.read(buffer_size)
+            n = len(data)
+            buf[:n] = data
+        if not n:
+            break
+        written = 0
+        while written < n:
+            written += dst.write(view[written:n]) or (n - written)
+        total += n
+        if on_chunk and on_chunk(n) is False:
+            break
+    return total
+
+
+def copy_file(src, dst, on_chunk=None, reflink_ok=True):
+    """
+    Copy the regular file src to dst as cheaply as the platform allows: reflink first (no data is
+    moved at all), then copy_fds. Returns (method, complete); complete is False if on_chunk stopped it.
+    """
+    size = os.path.getsize(src)
+    if reflink_ok:
+        try:
+            reflink(src, dst)
+            if on_chunk:
+                on_chunk(0)
+            return 'reflink', True
+        except OSError:
+            pass
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        method, copied = copy_fds(s.fileno(), d.fileno(), size, on_chunk)
+    return method, copied == size
+
+
+def place(src, dst, methods=('reflink', 'copy')):
+    """
+    Materialise src at dst using the first of methods ('reflink', 'hardlink', 'copy') that works.
+    The file appears at dst atomically (written beside it, then os.replace). Returns the method used.
+    """
+    tmp = dst + '.placing'
+    last_error = None
+    for method in methods:
+        try:
+            if method == 'hardlink':
+                os.link(src, tmp)
+            elif method == 'reflink':
+                reflink(src, tmp)
+            elif method == 'copy':
+                method, _ = copy_file(src, tmp, reflink_ok=False)
+            else:
+                raise ValueError(f"Unknown copy method {method}")
+            os.replace(tmp, dst)
+            return method
+        except OSError as e:
+            last_error = e
+            try:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            except OSError:
+                pass
+    raise last_error or OSError(errno.EINVAL, "No copy method given")
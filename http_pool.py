@@ -0,0 +1,148 @@
+import ssl
+import logging
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+try:
+    import httpx
+except ImportError:
+    httpx = None
+try:
+    import h2  # noqa: F401  (httpx only negotiates HTTP/2 when this is installed)
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
+# Process-wide connection pools shared by every DownloadManager (including DownloadManagerPool workers).
+# Clients are keyed by origin so segments of one download, and separate downloads from the same host,
+# reuse warm keep-alive connections; with HTTP/2 httpx multiplexes concurrent segments as streams
+# over a handful of connections instead of opening one TCP+TLS session per range.
+MAX_CONNECTIONS_PER_ORIGIN = 32
+KEEPALIVE_EXPIRY = 90  # seconds an idle connection is kept open for reuse
+
+_lock = threading.Lock()
+_clients = {}
+_ssl_contexts = {}
+_session = None
+logger = logging.getLogger('HttpPool')
+
+
+def origin_of(url):
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    port = parsed.port or (443 if scheme == 'https' else 80)
+    return scheme, (parsed.hostname or '').lower(), port
+
+
+def _ssl_context(verify):
+    # One context per verification mode: the CA bundle is parsed once and every pooled
+    # connection shares the same context (and therefore its TLS session cache).
+    ctx = _ssl_contexts.get(verify)
+    if ctx is None:
+        ctx = ssl.create_default_context()
+        if not verify:
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        _ssl_contexts[verify] = ctx
+    return ctx
+
+
+def get_client(url, verify=False, timeout=30):
+    """
+    Return the shared httpx.Client for url's origin, creating it on first use.
+    Callers must not close the returned client; use close_all() at shutdown.
+    """
+    if httpx is None:
+        raise ImportError("httpx is not installed")
+    key = origin_of(url) + (bool(verify),)
+    with _lock:
+        client = _clients.get(key)
+        if client is None or client.is_closed:
+            limits = httpx.Limits(max_connections=MAX_CONNECTIONS_PER_ORIGIN,
+                                  max_keepalive_connections=MAX_CONNECTIONS_PER_ORIGIN,
+                                  keepalive_expiry=KEEPALIVE_EXPIRY)
+            # pool=None: segments queue for a connection instead of failing with PoolTimeout
+            client = httpx.Client(http2=HAS_HTTP2, verify=_ssl_context(bool(verify)), limits=limits,
+                                  timeout=httpx.Timeout(timeout, pool=None), follow_redirects=True)
+            _clients[key] = client
+            logger.debug(f"Opened pooled client for {key[0]}://{key[1]}:{key[2]} (http2={HAS_HTTP2})")
+        return client
+
+
+def new_async_client(verify=False, timeout=30, max_connections=MAX_CONNECTIONS_PER_ORIGIN):
+    """
+    Build an httpx.AsyncClient with the same pooling policy as get_client().
+    Async clients are bound to one event loop, so the caller owns and closes it.
+    """
+    if httpx is None:
+        raise ImportError("httpx is not installed")
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                          keepalive_expiry=KEEPALIVE_EXPIRY)
+    return httpx.AsyncClient(http2=HAS_HTTP2, verify=_ssl_context(bool(verify)), limits=limits,
+                             timeout=httpx.Timeout(timeout, pool=None), follow_redirects=True)
+
+
+def get_session():
+    """Return the shared requests.Session used for fallbacks and non-ranged transfers."""
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=MAX_CONNECTIONS_PER_ORIGIN)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def iter_body(r, pool, budget=None, should_continue=None):
+    """
+    Yield the body of a streamed requests response as memoryviews of buffers taken from pool (a BufferPool).
+    For identity-encoded bodies, http.client's readinto() copies from the socket straight into the pooled
+    buffer, so no bytes object is made per read; the consumer releases each buffer once it is written.
+    Content-encoded bodies (which urllib3 must decode) fall back to iter_content.
+    With a MemoryBudget, credit is taken before every read and each read is limited to the credit granted,
+    so reads shrink under memory pressure; every yielded chunk carries len(chunk) credits for the consumer
+    to release once it is written. Stops early if should_continue() turns false while waiting for credit.
+    """
+    fp = getattr(r.raw, '_fp', None)
+    encoding = r.headers.get('content-encoding', 'identity').strip().lower()
+    if encoding not in ('', 'identity') or not hasattr(fp, 'readinto') or not hasattr(r.raw, 'release_conn'):
+        chunks = r.iter_content(chunk_size=pool.buffer_size)
+        yield from budget.metered(chunks, pool.buffer_size, should_continue) if budget else chunks
+        return
+    while True:
+        granted = budget.acquire(pool.buffer_size, should_continue=should_continue) if budget else pool.buffer_size
+        if not granted:
+            return
+        buf = pool.acquire()
+        try:
+            n = fp.readinto(memoryview(buf)[:granted])
+        except BaseException:
+            pool.release(buf)
+            if budget:
+                budget.release(granted)
+            raise
+        if budget:
+            budget.release(granted - (n or 0))
+        if not n:
+            pool.release(buf)
+            # Body fully read: hand the connection back for keep-alive reuse (urllib3 never saw the reads)
+            r.raw.release_conn()
+            return
+        yield memoryview(buf)[:n]
+
+
+def close_all():
+    global _session
+    with _lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception as e:
+                logger.debug(f"Error closing pooled client: {e}")
+        _clients.clear()
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,224 @@
+import os
+import sys
+import time
+import heapq
+import logging
+import itertools
+import threading
+
+# Priority classes, most urgent first. Installer writes are never held back by the device budget
+# (they are still charged to it, so background work yields the bandwidth they use).
+PRIORITIES = ('installer', 'normal', 'background')
+# Device-wide write budget in bytes/s for every device (None/0 = unlimited); see set_budget() for per-device limits
+DEFAULT_BUDGET = int(os.environ.get('DOWNLOAD_DISK_BPS', 0)) or None
+# One batch is up to this many bytes of queued writes, issued in (file, offset) order
+BATCH_BYTES = 16 * 1024 * 1024
+BURST_SECONDS = 0.25
+
+
+def device_of(path):
+    """Identifier of the device holding path (st_dev; the drive on Windows). path need not exist yet."""
+    path = os.path.abspath(path)
+    if sys.platform.startswith('win'):
+        return os.path.splitdrive(path)[0].upper() or path
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev
+
+
+def is_rotational(device):
+    """True for spinning disks (Linux sysfs); False when SSD/NVMe or unknown."""
+    if not isinstance(device, int) or not sys.platform.startswith('linux'):
+        return False
+    base = f"/sys/dev/block/{os.major(device)}:{os.minor(device)}"
+    # Partitions keep their queue settings on the parent disk
+    for candidate in (os.path.join(base, 'queue', 'rotational'), os.path.join(base, '..', 'queue', 'rotational')):
+        try:
+            with open(candidate) as f:
+                return f.read().strip() == '1'
+        except OSError:
+            continue
+    return False
+
+
+class DeviceScheduler:
+    """
+    Orders the disk writes of every download in the process that target one device.
+    DiskWriter hands each write syscall to submit() together with its size, priority class and a (file, offset)
+    sort key; worker threads take batches of queued writes, most urgent class first, and issue each batch
+    sorted by file and offset so concurrent downloads do not interleave small scattered writes.
+    Only the pwrite/pwritev itself runs on a worker: hashing, extraction and durability bookkeeping stay on
+    the caller's thread, so one slow download cannot hold up the device for everyone else.
+    An optional device budget (bytes/s) paces 'normal' and 'background' writes; 'installer' writes go
+    straight through but consume the budget, leaving the rest to the bulk downloads.
+    Spinning disks get one worker (fully sequential), SSD/NVMe several to keep the device queue busy.
+    Usage:
+        scheduler = scheduler_for(path)
+        scheduler.submit(lambda: os.pwrite(fd, data, offset), len(data), 'background', key=(fd, offset))
+    """
+    def __init__(self, device, budget_bps=DEFAULT_BUDGET, workers=None, logger=None):
+        self.device = device
+        self.budget_bps = budget_bps if budget_bps and budget_bps > 0 else None
+        self.logger = logger or logging.getLogger('IOScheduler')
+        self.workers = workers or (1 if is_rotational(device) else 4)
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (priority index, seq, job)
+        self._seq = itertools.count()
+        self._next_free = time.monotonic()  # GCRA-style: when the budget next has room
+        self._started = time.monotonic()
+        self.busy_seconds = 0.0
+        self.bytes = {p: 0 for p in PRIORITIES}
+        self.waits = {p: 0.0 for p in PRIORITIES}
+        self.jobs = {p: 0 for p in PRIORITIES}
+        self.batches = 0
+        self.max_depth = 0
+        self._threads = []
+        for _ in range(self.workers):
+            t = threading.Thread(target=self._run, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def set_budget(self, bps):
+        with self._cond:
+            self.budget_bps = bps if bps and bps > 0 else None
+            self._next_free = min(self._next_free, time.monotonic())
+            self._cond.notify_all()
+
+    def submit(self, fn, nbytes, priority='normal', key=(0, 0)):
+        """Run fn() on a device worker in priority order and return its result (or raise its exception)."""
+        job = _Job(fn, nbytes, priority if priority in PRIORITIES else 'normal', key)
+        with self._cond:
+            heapq.heappush(self._queue, (PRIORITIES.index(job.priority), next(self._seq), job))
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._cond.notify()
+        job.done.wait()
+        if job.error:
+            raise job.error
+        return job.result
+
+    def stats(self):
+        with self._cond:
+            elapsed = max(1e-6, time.monotonic() - self._started)
+            return {
+                'device': str(self.device),
+                'workers': self.workers,
+                'budget_bps': self.budget_bps,
+                'queued': len(self._queue),
+                'max_depth': self.max_depth,
+                'batches': self.batches,
+                'bytes': dict(self.bytes),
+                'jobs': dict(self.jobs),
+                'wait_seconds': {p: round(w, 3) for p, w in self.waits.items()},
+                # Share of wall time the workers spent inside writes, per worker
+                'utilization': round(min(1.0, self.busy_seconds / (elapsed * self.workers)), 3),
+            }
+
+    def _budget_delay(self, now):
+        if not self.budget_bps:
+            return 0.0
+        return max(0.0, self._next_free - BURST_SECONDS - now)
+
+    def _charge(self, nbytes, now):
+        if self.budget_bps:
+            self._next_free = max(now, self._next_free) + nbytes / self.budget_bps
+
+    def _take_batch(self):
+        """Pop queued jobs for one batch: installer jobs always, paced classes only while the budget has room."""
+        while True:
+            while not self._queue:
+                self._cond.wait()
+            now = time.monotonic()
+            top = self._queue[0][2]
+            delay = 0.0 if top.priority == 'installer' else self._budget_delay(now)
+            if delay <= 0:
+                break
+            # Re-checked early if something more urgent arrives or the budget changes
+            self._cond.wait(delay)
+        batch = []
+        size = 0
+        level = self._queue[0][0]
+        while self._queue and self._queue[0][0] == level and (not batch or size + self._queue[0][2].nbytes <= BATCH_BYTES):
+            entry = heapq.heappop(self._queue)
+            job = entry[2]
+            if job.priority != 'installer' and batch and self._budget_delay(now):
+                heapq.heappush(self._queue, entry)
+                break
+            self._charge(job.nbytes, now)
+            batch.append(job)
+            size += job.nbytes
+        batch.sort(key=lambda job: job.key)
+        self.batches += 1
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            started = time.monotonic()
+            for job in batch:
+                job.run()
+            finished = time.monotonic()
+            with self._cond:
+                self.busy_seconds += finished - started
+                for job in batch:
+                    self.bytes[job.priority] += job.nbytes
+                    self.jobs[job.priority] += 1
+                    self.waits[job.priority] += started - job.queued_at
+
+
+class _Job:
+    __slots__ = ('fn', 'nbytes', 'priority', 'key', 'queued_at', 'done', 'result', 'error')
+
+    def __init__(self, fn, nbytes, priority, key):
+        self.fn = fn
+        self.nbytes = nbytes
+        self.priority = priority
+        self.key = key
+        self.queued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.fn()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+
+_registry_lock = threading.Lock()
+_schedulers = {}
+
+
+def scheduler_for(path, logger=None):
+    """Process-wide DeviceScheduler for the device holding path; None if the device cannot be determined."""
+    try:
+        device = device_of(path)
+    except OSError as e:
+        (logger or logging.getLogger('IOScheduler')).debug(f"No I/O scheduler for {path}: {e}")
+        return None
+    with _registry_lock:
+        scheduler = _schedulers.get(device)
+        if scheduler is None:
+            scheduler = _schedulers[device] = DeviceScheduler(device, logger=logger)
+        return scheduler
+
+
+def set_budget(path, bps):
+    """Set the write budget (bytes/s, None for unlimited) of the device holding path."""
+    scheduler = scheduler_for(path)
+    if scheduler:
+        scheduler.set_budget(bps)
+    return scheduler is not None
+
+
+def stats():
+    """Per-device utilization and queueing figures for every device written to so far."""
+    with _registry_lock:
+        schedulers = list(_schedulers.values())
+    return [s.stats() for s in schedulers]
@@ -0,0 +1,188 @@
+import os
+import time
+import asyncio
+import threading
+
+# Bytes of received-but-not-yet-written data allowed across every download in the process
+DEFAULT_LIMIT = int(os.environ.get('DOWNLOAD_MEMORY_BUDGET', 256 * 1024 * 1024))
+# Smallest chunk a reader is shrunk to under pressure
+MIN_CHUNK = 64 * 1024
+
+
+class MemoryBudget:
+    """
+    Process-wide credit pool for in-flight download data.
+    A reader takes credit before it fetches a chunk and whoever writes the chunk to disk gives it back, so
+    the bytes sitting in sockets' read buffers, write-behind queues and scheduler batches never exceed
+    limit, however many downloads and threads are running. When credit is short a reader is granted a
+    smaller chunk (down to minimum) rather than made to wait for the full amount; it only blocks when not
+    even minimum is free, and a reader is always let through when nothing else is in flight.
+    Usage:
+        budget = default_budget()
+        n = budget.acquire(chunk_size)        # may be less than chunk_size
+        data = read_up_to(n)
+        budget.release(n - len(data))         # the rest is released by the writer once on disk
+    """
+    def __init__(self, limit=DEFAULT_LIMIT, min_chunk=MIN_CHUNK):
+        self.limit = max(1, limit)
+        self.min_chunk = min_chunk
+        self._cond = threading.Condition()
+        self.in_use = 0
+        self.high_water = 0
+        self.grants = 0
+        self.shrunk = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def set_limit(self, limit):
+        with self._cond:
+            self.limit = max(1, limit)
+            self._cond.notify_all()
+
+    def _grant(self, nbytes, minimum):
+        """Credit that can be granted right now (0 = wait). Caller holds the lock."""
+        free = self.limit - self.in_use
+        if free >= minimum or self.in_use == 0:
+            granted = min(nbytes, max(free, minimum))
+            self.in_use += granted
+            self.high_water = max(self.high_water, self.in_use)
+            self.grants += 1
+            if granted < nbytes:
+                self.shrunk += 1
+            return granted
+        return 0
+
+    def acquire(self, nbytes, minimum=None, should_continue=None):
+        """
+        Take credit for up to nbytes and return the amount granted, at least min(minimum, nbytes).
+        Blocks while less than minimum is free; returns 0 if should_continue() turns false while waiting.
+        """
+        minimum = min(nbytes, self.min_chunk if minimum is None else minimum)
+        with self._cond:
+            granted = self._grant(nbytes, minimum)
+            if granted:
+                return granted
+            started = time.monotonic()
+            self.waits += 1
+            try:
+                while True:
+                    self._cond.wait(0.5)
+                    granted = self._grant(nbytes, minimum)
+                    if granted or (should_continue and not should_continue()):
+                        return granted
+            finally:
+                self.wait_seconds += time.monotonic() - started
+
+    async def acquire_async(self, nbytes, should_continue=None):
+        """Take credit for exactly nbytes without blocking the event loop; 0 if should_continue() turned false."""
+        with self._cond:
+            granted = self._grant(nbytes, nbytes)
+        if granted:
+            return granted
+        started = time.monotonic()
+        try:
+            while not granted:
+                if should_continue and not should_continue():
+                    return 0
+                await asyncio.sleep(0.05)
+                with self._cond:
+                    granted = self._grant(nbytes, nbytes)
+            return granted
+        finally:
+            with self._cond:
+                self.waits += 1
+                self.wait_seconds += time.monotonic() - started
+
+    def release(self, nbytes):
+        if nbytes <= 0:
+            return
+        with self._cond:
+            self.in_use = max(0, self.in_use - nbytes)
+            self._cond.notify_all()
+
+    def settle(self, granted, used):
+        """Adjust a grant to the size of the chunk actually received (which may overshoot it for decoded bodies)."""
+        if used > granted:
+            with self._cond:
+                self.in_use += used - granted
+                self.high_water = max(self.high_water, self.in_use)
+        else:
+            self.release(granted - used)
+
+    def chunk_size(self, preferred):
+        """
+        Chunk size for a stream whose chunking is fixed when it is opened: preferred, halved while it is
+        more than a quarter of the credit currently free, but never below min_chunk.
+        """
+        with self._cond:
+            free = max(0, self.limit - self.in_use)
+        size = preferred
+        while size > self.min_chunk and size > free // 4:
+            size //= 2
+        return max(min(preferred, self.min_chunk), size)
+
+    def metered(self, chunks, nbytes, should_continue=None):
+        """
+        Iterate chunks (of at most about nbytes each), taking nbytes of credit before every pull.
+        Each yielded chunk carries len(chunk) credits, which the consumer releases once it is written.
+        """
+        it = iter(chunks)
+        while True:
+            granted = self.acquire(nbytes, nbytes, should_continue)
+            if not granted:
+                return
+            try:
+                chunk = next(it, None)
+            except BaseException:
+                self.release(granted)
+                raise
+            if not chunk:
+                self.release(granted)
+                return
+            self.settle(granted, len(chunk))
+            yield chunk
+
+    async def metered_async(self, chunks, nbytes, should_continue=None):
+        """Async counterpart of metered() for an async iterator of chunks."""
+        it = chunks.__aiter__()
+        while True:
+            granted = await self.acquire_async(nbytes, should_continue)
+            if not granted:
+                return
+            try:
+                chunk = await it.__anext__()
+            except StopAsyncIteration:
+                chunk = None
+            except BaseException:
+                self.release(granted)
+                raise
+            if not chunk:
+                self.release(granted)
+                return
+            self.settle(granted, len(chunk))
+            yield chunk
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'in_use': self.in_use,
+                'high_water': self.high_water,
+                'grants': self.grants,
+                'shrunk_grants': self.shrunk,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 3),
+            }
+
+
+_budget_lock = threading.Lock()
+_budget = None
+
+
+def default_budget():
+    """The budget shared by every download in the process."""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = MemoryBudget()
+        return _budget
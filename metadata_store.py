@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+DEFAULT_PATH = os.environ.get('DOWNLOAD_METADATA_DB') or os.path.join(
+    os.path.expanduser('~'), '.download_manager', 'metadata.db')
+
+
+class MetadataStore:
+    """
+    Remembers what was last downloaded to each (url, dest): the server's ETag and Last-Modified,
+    the size, the digests and the mtime of the file we wrote.
+    DownloadManager turns an entry into If-None-Match / If-Modified-Since headers; a 304 answer means
+    the file on disk is current and nothing is transferred.
+    Backed by SQLite (WAL mode), so separate processes can share one store safely.
+    Usage:
+        store = MetadataStore()
+        entry = store.get(url, dest)
+        store.put(url, dest, etag=..., last_modified=..., size=..., hashes={'sha256': ...})
+    """
+    def __init__(self, path=DEFAULT_PATH, logger=None):
+        self.path = path
+        self.logger = logger or logging.getLogger('MetadataStore')
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS downloads ('
+                ' url TEXT NOT NULL, dest TEXT NOT NULL, etag TEXT, last_modified TEXT,'
+                ' size INTEGER, hashes TEXT, mtime REAL, updated REAL,'
+                ' PRIMARY KEY (url, dest))')
+
+    def get(self, url, dest):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT etag, last_modified, size, hashes, mtime, updated FROM downloads WHERE url = ? AND dest = ?',
+                (url, os.path.abspath(dest))).fetchone()
+        if row is None:
+            return None
+        return {
+            'url': url,
+            'dest': dest,
+            'etag': row[0],
+            'last_modified': row[1],
+            'size': row[2],
+            'hashes': json.loads(row[3] or '{}'),
+            'mtime': row[4],
+            'updated': row[5],
+        }
+
+    def put(self, url, dest, etag=None, last_modified=None, size=None, hashes=None, mtime=None):
+        if mtime is None and os.path.exists(dest):
+            mtime = os.stat(dest).st_mtime
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO downloads (url, dest, etag, last_modified, size, hashes, mtime, updated)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, os.path.abspath(dest), etag, last_modified, size, json.dumps(hashes or {}), mtime, time.time()))
+
+    def delete(self, url, dest):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM downloads WHERE url = ? AND dest = ?', (url, os.path.abspath(dest)))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+
+_store_lock = threading.Lock()
+_store = None
+
+
+def default_store(logger=None):
+    """Process-wide store at DEFAULT_PATH, opened on first use; None if it cannot be opened."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            try:
+                _store = MetadataStore(logger=logger)
+            except Exception as e:
+                (logger or logging.getLogger('MetadataStore')).warning(f"Metadata store unavailable: {e}")
+                return None
+        return _store
@@ -0,0 +1,134 @@
+import random
+import logging
+import threading
+import xml.etree.ElementTree as ET
+
+
+class MirrorMismatch(Exception):
+    """Raised when a mirror serves a different object (size or ETag) than the one being assembled."""
+
+
+class Mirror:
+    def __init__(self, url, priority=0):
+        self.url = url
+        self.priority = priority
+        self.etag = None
+        self.rate = None  # EWMA bytes/sec while actively streaming
+        self.bytes = 0
+        self.failures = 0
+        self.dropped = None  # reason string once removed from rotation
+
+    def __repr__(self):
+        return f"Mirror({self.url}, rate={self.rate}, dropped={self.dropped})"
+
+
+class MirrorSet:
+    """
+    Pool of equivalent URLs for one file, raced against each other.
+    Every range request picks a mirror: mirrors without a measurement yet are tried first so each
+    gets timed, after that the choice is weighted by measured throughput, so the fastest mirrors
+    receive most of the work. Mirrors that keep failing (timeouts, resets, HTTP errors) or that
+    serve a mismatched object are dropped; the last live mirror is never dropped for transient errors.
+    """
+    MAX_FAILURES = 3
+
+    def __init__(self, urls, logger=None):
+        if not urls:
+            raise ValueError("At least one mirror URL is required")
+        self.mirrors = [Mirror(u, priority=i) for i, u in enumerate(urls)]
+        self.logger = logger or logging.getLogger('MirrorSet')
+        self._lock = threading.Lock()
+
+    def alive(self):
+        with self._lock:
+            return [m for m in self.mirrors if not m.dropped]
+
+    def pick(self):
+        with self._lock:
+            live = [m for m in self.mirrors if not m.dropped]
+            if not live:
+                raise IOError("All mirrors have been dropped")
+            untested = [m for m in live if m.rate is None]
+            if untested:
+                return min(untested, key=lambda m: (m.bytes, m.priority))
+            total = sum(m.rate for m in live)
+            if total <= 0:
+                return live[0]
+            point = random.uniform(0, total)
+            for m in live:
+                point -= m.rate
+                if point <= 0:
+                    return m
+            return live[-1]
+
+    def record(self, mirror, nbytes, seconds):
+        if seconds <= 0:
+            return
+        with self._lock:
+            sample = nbytes / seconds
+            mirror.rate = sample if mirror.rate is None else 0.7 * mirror.rate + 0.3 * sample
+            mirror.bytes += nbytes
+            mirror.failures = 0
+
+    def fail(self, mirror, error):
+        with self._lock:
+            mirror.failures += 1
+            live = [m for m in self.mirrors if not m.dropped]
+            if mirror.failures >= self.MAX_FAILURES and len(live) > 1:
+                self._drop(mirror, f"{mirror.failures} consecutive failures ({error})")
+
+    def drop(self, mirror, reason):
+        with self._lock:
+            self._drop(mirror, reason)
+
+    def _drop(self, mirror, reason):
+        if not mirror.dropped:
+            mirror.dropped = reason
+            self.logger.warning(f"Dropping mirror {mirror.url}: {reason}")
+
+    def check_response(self, mirror, total_size, content_range, etag):
+        """Validate a ranged response against the object being assembled; drops the mirror on mismatch."""
+        if content_range and '/' in content_range:
+            reported = content_range.rsplit('/', 1)[1].strip()
+            if reported != '*' and int(reported) != total_size:
+                self.drop(mirror, f"length {reported} != {total_size}")
+                raise MirrorMismatch(f"{mirror.url} reports length {reported}, expected {total_size}")
+        if etag and mirror.etag and etag != mirror.etag:
+            self.drop(mirror, f"ETag changed from {mirror.etag} to {etag}")
+            raise MirrorMismatch(f"{mirror.url} changed ETag mid-download")
+
+
+def parse_metalink(text):
+    """
+    Parse a Metalink 4 (RFC 5854) or 3.0 document.
+    Returns {'name', 'size', 'urls', 'hashes'} for the first file entry; urls are ordered by priority.
+    """
+    root = ET.fromstring(text)
+    ns = root.tag[1:].split('}')[0] if root.tag.startswith('{') else ''
+    q = (lambda tag: f'{{{ns}}}{tag}') if ns else (lambda tag: tag)
+    file_el = root.find(f'.//{q("file")}')
+    if file_el is None:
+        raise ValueError("Metalink contains no <file> entry")
+    size_el = file_el.find(q('size'))
+    urls = []
+    for url_el in file_el.iter(q('url')):
+        if not url_el.text:
+            continue
+        # Metalink 4 uses priority (1 = best); 3.0 uses preference (100 = best)
+        if url_el.get('priority'):
+            rank = int(url_el.get('priority'))
+        elif url_el.get('preference'):
+            rank = 100 - int(url_el.get('preference'))
+        else:
+            rank = 999999
+        urls.append((rank, len(urls), url_el.text.strip()))
+    hashes = {}
+    for hash_el in file_el.iter(q('hash')):
+        if hash_el.text and hash_el.get('type'):
+            hashes[hash_el.get('type').lower().replace('-', '')] = hash_el.text.strip().lower()
+    return {
+        'name': file_el.get('name'),
+        'size': int(size_el.text) if size_el is not None and size_el.text else None,
+        'urls': [u for _, _, u in sorted(urls)],
+        'hashes': hashes,
+    }
@@ -0,0 +1,97 @@
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every reader of a download.
+    rate is in bytes/sec (None or 0 means unlimited); burst is the bucket capacity in bytes.
+    Consumers take tokens for the bytes they just received and may run the bucket into debt;
+    they then wait until the debt is repaid, so chunks larger than the burst still average out to
+    exactly `rate`. Waits use a condition variable with computed timeouts (sub-second accuracy)
+    and set_rate() wakes all waiters, so a new allocation applies mid-download.
+    Usage:
+        bucket = TokenBucket(10 * 1024 * 1024)
+        bucket.consume(len(chunk))
+    """
+    MIN_BURST = 64 * 1024
+    BURST_SECONDS = 0.5
+
+    def __init__(self, rate=None, burst=None):
+        self._cond = threading.Condition()
+        self.rate = None
+        self.burst = 0
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        """Change the limit live; None or <= 0 removes it."""
+        with self._cond:
+            self._refill()
+            self.rate = rate if rate and rate > 0 else None
+            if self.rate:
+                self.burst = burst if burst and burst > 0 else max(self.MIN_BURST, int(self.rate * self.BURST_SECONDS))
+                self._tokens = min(self._tokens, self.burst)
+            else:
+                self.burst = 0
+                self._tokens = 0.0
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def _take(self, n):
+        with self._cond:
+            if not self.rate:
+                return
+            self._refill()
+            self._tokens -= n
+
+    def _debt_delay(self):
+        with self._cond:
+            if not self.rate:
+                return 0.0
+            self._refill()
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def consume(self, n):
+        """Account for n bytes, blocking the caller until the bucket is back out of debt."""
+        if not self.rate or n <= 0:
+            return
+        self._take(n)
+        with self._cond:
+            while self.rate:
+                self._refill()
+                if self._tokens >= 0:
+                    return
+                self._cond.wait(-self._tokens / self.rate)
+
+    async def consume_async(self, n, poll=0.25):
+        """Coroutine flavour of consume(); re-checks at least every `poll` seconds to pick up rate changes."""
+        if not self.rate or n <= 0:
+            return
+        self._take(n)
+        while True:
+            delay = self._debt_delay()
+            if delay <= 0:
+                return
+            await asyncio.sleep(min(delay, poll))
+
+
+class CompositeLimiter:
+    """Charges every chunk to several limiters in turn, e.g. a per-download bucket and a shared budget."""
+    def __init__(self, *limiters):
+        self.limiters = [l for l in limiters if l is not None]
+
+    def consume(self, n):
+        for limiter in self.limiters:
+            limiter.consume(n)
+
+    async def consume_async(self, n):
+        for limiter in self.limiters:
+            await limiter.consume_async(n)
@@ -0,0 +1,372 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from disk_writer import DiskWriter
+from write_behind import WriteBehind
+from buffer_pool import default_pool
+from memory_budget import default_budget
+from mirrors import MirrorMismatch
+from stream_hash import new_hash
+import http_pool
+
+
+class RangeNotSupported(Exception):
+    """Raised when a server answers a ranged GET with something other than the requested bytes."""
+
+
+def split_ranges(gaps, parts, min_unit=1):
+    """
+    Cut inclusive (start, end) gaps into about `parts` units of at least min_unit bytes each.
+    """
+    remaining = sum(e - s + 1 for s, e in gaps)
+    if remaining <= 0:
+        return []
+    step = max(min_unit, -(-remaining // max(1, parts)))
+    ranges = []
+    for start, end in gaps:
+        while start <= end:
+            piece_end = min(end, start + step - 1)
+            ranges.append((start, piece_end))
+            start = piece_end + 1
+    return ranges
+
+
+def check_range_response(status_code, start):
+    if status_code == 206:
+        return
+    if status_code == 200 and start == 0:
+        # Whole body from offset 0 is still the bytes we asked for, just without an end bound
+        return
+    raise RangeNotSupported(f"Server ignored Range request (HTTP {status_code})")
+
+
+class Segment:
+    """A contiguous byte range owned by one worker; end may shrink when another worker steals its tail."""
+    def __init__(self, idx, start, end):
+        self.idx = idx
+        self.start = start
+        self.position = start
+        self.end = end
+        self.started_at = None
+        self.digest = None
+
+    def remaining(self):
+        return max(0, self.end - self.position + 1)
+
+    def rate(self, now):
+        if self.started_at is None or now - self.started_at < 0.5:
+            return None
+        return (self.position - self.start) / (now - self.started_at)
+
+
+class SegmentedDownloader:
+    """
+    Multi-range HTTP engine that streams every segment straight to its own offset in a preallocated file.
+    Received chunks go to a bounded write-behind queue (write_behind.py) and are written at their offsets by
+    writer threads, so peak RSS stays flat as the file grows and a slow disk never blocks a socket read;
+    once the queue is full, readers wait for the disk. Every chunk is also paid for from a process-wide
+    MemoryBudget before it is fetched and refunded once written, so all downloads together stay within it;
+    under pressure readers fetch smaller chunks instead of failing.
+    Work is handed out in small units; once the queue is empty an idle worker steals the tail of the
+    in-flight segment with the longest expected finish time, so one slow connection cannot hold back the file.
+    With a ConcurrencyController, `threads` workers exist but only controller.target of them fetch at once.
+    With a MirrorSet every attempt picks a mirror, so ranges are spread over all live mirrors by speed.
+    Usage:
+        SegmentedDownloader(url, path, total_size, threads=8).run()
+    """
+    UNITS_PER_THREAD = 4
+    MIN_STEAL_BYTES = 256 * 1024
+
+    def __init__(self, url, path, total_size, threads=4, chunk_size=1024*1024, writer=None, logger=None,
+                 progress=None, should_continue=None, retries=3, verify=False, timeout=30, journal=None, limiter=None,
+                 controller=None, mirrors=None, segment_hash=None, write_behind=WriteBehind.DEFAULT_MAX_BYTES,
+                 budget=None):
+        if total_size <= 0:
+            raise ValueError("total_size must be known and positive for segmented downloads")
+        self.url = url
+        self.path = path
+        self.total_size = total_size
+        self.threads = max(1, min(threads, total_size))
+        self.chunk_size = chunk_size
+        self.writer = writer or DiskWriter()
+        self.logger = logger or logging.getLogger('SegmentedDownloader')
+        self.progress = progress
+        self.should_continue = should_continue or (lambda: True)
+        self.retries = max(1, retries)
+        self.verify = verify
+        self.timeout = timeout
+        self.journal = journal
+        self.limiter = limiter
+        self.controller = controller
+        self.mirrors = mirrors
+        # Algorithm for per-segment digests; each finished segment lands in segment_hashes as {'start', 'end', 'digest'}
+        self.segment_hash = segment_hash
+        self.segment_hashes = []
+        # Bytes that may wait in the write-behind queue (0 writes on the network threads); see write_behind.py
+        self.write_behind = write_behind
+        self.write_stats = None
+        self._sink = None
+        # Receive buffers (bytearrays filled by readinto) shared with every download using this chunk size
+        self.pool = default_pool(chunk_size)
+        # Process-wide credit for in-flight bytes (memory_budget.py); budget=False opts out
+        self.budget = default_budget() if budget is None else (budget or None)
+        self.http_version = None  # as negotiated by httpx, e.g. 'HTTP/2'
+        self.complete = False
+        self.steals = 0
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._active = []
+        self._next_idx = 0
+        self._aborted = False
+
+    def split_ranges(self):
+        """
+        Return inclusive (start, end) work units covering the bytes still to fetch.
+        Units are several times smaller than threads would need, so fast workers naturally take more of them.
+        With a journal only the missing gaps are split, so a resumed download skips finished bytes.
+        """
+        gaps = self.journal.missing() if self.journal else [(0, self.total_size - 1)]
+        return split_ranges(gaps, self.threads * self.UNITS_PER_THREAD, self.MIN_STEAL_BYTES)
+
+    def run(self):
+        """
+        Download all ranges in parallel and write them in place.
+        Returns total bytes written; raises if any segment cannot be completed.
+        """
+        mode = 'r+b' if os.path.exists(self.path) else 'w+b'
+        total = 0
+        ranges = self.split_ranges()
+        for start, end in ranges:
+            self._pending.append(self._new_segment(start, end))
+        workers = min(self.threads, len(ranges))
+        with open(self.path, mode) as f:
+            self.writer.preallocate(f, self.total_size)
+            if self.write_behind:
+                self._sink = WriteBehind(self.writer, f, self.write_behind, logger=self.logger, pool=self.pool,
+                                         budget=self.budget)
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                    futures = [executor.submit(self._worker, f) for _ in range(workers)]
+                    for future in as_completed(futures):
+                        try:
+                            total += future.result()
+                        except Exception:
+                            # Stop the other workers from picking up new work; they finish their current chunk
+                            self._aborted = True
+                            raise
+            finally:
+                try:
+                    if self._sink:
+                        self._sink.close()
+                finally:
+                    if self._sink:
+                        self.write_stats = self._sink.stats()
+                        self._sink = None
+                    self.writer.fsync(f)
+                    if self.journal:
+                        self.journal.checkpoint(force=True)
+        if self.steals:
+            self.logger.info(f"Work stealing rebalanced {self.steals} segment(s) for {os.path.basename(self.path)}")
+        # False when stopped early via should_continue; the caller must not publish the file
+        self.complete = total == sum(e - s + 1 for s, e in ranges)
+        return total
+
+    def _on_written(self, offset, length):
+        if self.journal:
+            self.journal.add(offset, offset + length - 1)
+
+    def _new_segment(self, start, end):
+        seg = Segment(self._next_idx, start, end)
+        self._next_idx += 1
+        return seg
+
+    def _running(self):
+        return not self._aborted and self.should_continue()
+
+    def _has_work(self):
+        with self._lock:
+            return bool(self._pending) or any(s.remaining() for s in self._active)
+
+    def _worker(self, f):
+        total = 0
+        while self._running():
+            if self.controller and not self.controller.acquire(lambda: self._running() and self._has_work()):
+                break
+            try:
+                seg = self._next_segment()
+                if seg is None:
+                    break
+                try:
+                    total += self._fetch_segment(f, seg)
+                finally:
+                    with self._lock:
+                        self._active.remove(seg)
+            finally:
+                if self.controller:
+                    self.controller.release()
+        return total
+
+    def _next_segment(self):
+        """Take the next queued unit, or split the tail off the in-flight segment expected to finish last."""
+        with self._lock:
+            if self._pending:
+                seg = self._pending.popleft()
+            else:
+                seg = self._steal()
+            if seg is not None:
+                seg.started_at = time.time()
+                self._active.append(seg)
+            return seg
+
+    def _steal(self):
+        now = time.time()
+        min_split = max(2 * self.chunk_size, self.MIN_STEAL_BYTES)
+        rates = [r for r in (s.rate(now) for s in self._active) if r]
+        default_rate = sum(rates) / len(rates) if rates else 1.0
+        victim = None
+        worst_eta = 0
+        for seg in self._active:
+            remaining = seg.remaining()
+            if remaining < 2 * min_split:
+                continue
+            eta = remaining / (seg.rate(now) or default_rate)
+            if eta > worst_eta:
+                victim, worst_eta = seg, eta
+        if victim is None:
+            return None
+        # remaining >= 4 chunks, so the split point is always past any chunk the victim already holds
+        mid = victim.position + victim.remaining() // 2
+        stolen = self._new_segment(mid, victim.end)
+        victim.end = mid - 1
+        self.steals += 1
+        self.logger.debug(f"Worker stole bytes {stolen.start}-{stolen.end} from segment {victim.idx}")
+        return stolen
+
+    def _fetch_segment(self, f, seg):
+        last_error = None
+        if self.segment_hash and seg.digest is None:
+            seg.digest = new_hash(self.segment_hash)
+        attempts = self.retries * (len(self.mirrors.mirrors) if self.mirrors else 1)
+        for attempt in range(attempts):
+            with self._lock:
+                end = seg.end
+            if seg.position > end or not self._running():
+                break
+            mirror = self.mirrors.pick() if self.mirrors else None
+            url = mirror.url if mirror else self.url
+            # Alternate between httpx and requests so a client-specific failure does not burn every retry
+            stream = self._iter_httpx if http_pool.httpx and attempt % 2 == 0 else self._iter_requests
+            started = time.monotonic()
+            fetched = 0
+            try:
+                for chunk in stream(url, seg.position, end, mirror):
+                    # Budget credit this chunk holds; whatever is not handed to the write-behind sink is refunded here
+                    held = len(chunk) if self.budget else 0
+                    try:
+                        if not self._running():
+                            break
+                        if self.limiter:
+                            self.limiter.consume(len(chunk))
+                        with self._lock:
+                            # Re-read the bound every chunk: a thief may have taken the tail of this range
+                            end = seg.end
+                        if seg.position + len(chunk) > end + 1:
+                            chunk = chunk[:end + 1 - seg.position]
+                        if chunk:
+                            offset = seg.position
+                            if self._sink:
+                                written = len(chunk)
+                                if seg.digest:
+                                    seg.digest.update(chunk)
+                            else:
+                                written = self.writer.write_at(f, chunk, offset)
+                                self._on_written(offset, written)
+                                if seg.digest:
+                                    seg.digest.update(chunk)
+                                self.pool.release(chunk)
+                            with self._lock:
+                                seg.position += written
+                            fetched += written
+                            if self.controller:
+                                self.controller.record(written)
+                            if self.progress:
+                                self.progress(written)
+                            if self._sink:
+                                # Last use of chunk here: once written, the sink returns its buffer to the pool and
+                                # another reader may refill it. Journalled by the writer thread once on disk.
+                                self._sink.submit(chunk, offset, self._on_written)
+                                if held:
+                                    held -= written
+                        if seg.position > end:
+                            break
+                    finally:
+                        if held:
+                            self.budget.release(held)
+                last_error = None
+            except RangeNotSupported as e:
+                if not mirror or len(self.mirrors.alive()) <= 1:
+                    raise
+                last_error = e
+                self.mirrors.drop(mirror, str(e))
+            except MirrorMismatch as e:
+                last_error = e
+            except Exception as e:
+                last_error = e
+                self.logger.error(f"Segment {seg.idx} failed at byte {seg.position} (attempt {attempt+1}): {e}")
+                if mirror:
+                    self.mirrors.fail(mirror, e)
+                if self._note_overload(e):
+                    time.sleep(attempt + 1)
+            finally:
+                if mirror and fetched:
+                    self.mirrors.record(mirror, fetched, time.monotonic() - started)
+        with self._lock:
+            end = seg.end
+        if seg.position <= end and self._running():
+            raise IOError(f"Segment {seg.idx} incomplete: {seg.position - seg.start}/{end - seg.start + 1} bytes ({last_error})")
+        if seg.digest and seg.position > seg.start:
+            with self._lock:
+                self.segment_hashes.append({'start': seg.start, 'end': seg.position - 1, 'digest': seg.digest.hexdigest()})
+        return seg.position - seg.start
+
+    def _note_overload(self, error):
+        """Tell the controller about 429/503 answers; returns True if the caller should back off."""
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+        if status in (429, 503):
+            if self.controller:
+                self.controller.record_overload()
+            return True
+        return False
+
+    def _iter_httpx(self, url, start, end, mirror=None):
+        headers = {'Range': f'bytes={start}-{end}'}
+        client = http_pool.get_client(url, verify=self.verify, timeout=self.timeout)
+        sent = time.monotonic()
+        with client.stream('GET', url, headers=headers) as r:
+            if self.controller:
+                self.controller.record_rtt(time.monotonic() - sent)
+            self.http_version = r.http_version
+            r.raise_for_status()
+            check_range_response(r.status_code, start)
+            if mirror:
+                self.mirrors.check_response(mirror, self.total_size, r.headers.get('content-range'), r.headers.get('etag'))
+            # httpx fixes the chunk size per stream, so pressure on the budget shrinks it when the range is opened
+            size = self.budget.chunk_size(self.chunk_size) if self.budget else self.chunk_size
+            chunks = r.iter_bytes(size)
+            yield from self.budget.metered(chunks, size, self._running) if self.budget else chunks
+
+    def _iter_requests(self, url, start, end, mirror=None):
+        headers = {'Range': f'bytes={start}-{end}'}
+        session = http_pool.get_session()
+        sent = time.monotonic()
+        with session.get(url, headers=headers, stream=True, timeout=self.timeout, verify=self.verify) as r:
+            if self.controller:
+                self.controller.record_rtt(time.monotonic() - sent)
+            r.raise_for_status()
+            check_range_response(r.status_code, start)
+            if mirror:
+                self.mirrors.check_response(mirror, self.total_size, r.headers.get('content-range'), r.headers.get('etag'))
+            yield from http_pool.iter_body(r, self.pool, self.budget, self._running)
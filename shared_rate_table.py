@@ -0,0 +1,234 @@
+import os
+import time
+import struct
+import asyncio
+import logging
+import threading
+from multiprocessing import shared_memory
+try:
+    from multiprocessing import resource_tracker
+except ImportError:
+    resource_tracker = None
+
+# Cross-process bandwidth budget. ThrottleService owns a small shared-memory table of GCRA
+# (virtual-time token bucket) slots: one global slot, one for the installer class shared by every
+# DownloadManager process, and one per detected download pid. Downloader processes attach once and
+# charge bytes straight into the table, so enforcement on the read path costs no IPC round-trip.
+#
+# Updates are plain read-modify-write of one 8-byte field without a lock. Two processes charging
+# the same slot at the same instant can lose one update, which lets at most one extra chunk through
+# early; the budget still converges because every later charge starts from the newest value.
+
+TABLE_NAME = 'throttle_rate_table'
+MAGIC = b'THRT'
+VERSION = 1
+MAX_SLOTS = 128
+GLOBAL_KEY = -2
+INSTALLER_KEY = -1
+FREE_KEY = 0
+STALE_AFTER = 30  # seconds without a ThrottleService publish before downloaders ignore the table
+KEY_REFRESH = 1.0  # seconds between checks whether ThrottleService has (de)allocated this process's own slot
+
+_HEADER = struct.Struct('<4sIId')   # magic, version, slot count, last publish (monotonic)
+_HEADER_SIZE = 32
+_SLOT = struct.Struct('<qddd')      # key, rate (bytes/s), burst (bytes), theoretical arrival time
+_TAT_OFFSET = 24
+
+
+class SharedRateTable:
+    """
+    Fixed-size table of token-bucket slots in named shared memory.
+    ThrottleService creates it and calls publish(); downloaders attach() and charge it through SharedLimiter.
+    """
+    def __init__(self, shm, owner=False, logger=None):
+        self.shm = shm
+        self.owner = owner
+        self.logger = logger or logging.getLogger('SharedRateTable')
+        self.slots = MAX_SLOTS
+
+    @classmethod
+    def create(cls, name=TABLE_NAME, logger=None):
+        size = _HEADER_SIZE + MAX_SLOTS * _SLOT.size
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a previous service instance; take it over and reinitialise
+            shm = shared_memory.SharedMemory(name=name)
+        shm.buf[:size] = bytes(size)
+        _HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, MAX_SLOTS, time.monotonic())
+        table = cls(shm, owner=True, logger=logger)
+        table._write_slot(0, GLOBAL_KEY, 0.0, 0.0, 0.0)
+        return table
+
+    @classmethod
+    def attach(cls, name=TABLE_NAME, logger=None):
+        """Open an existing table, or return None if ThrottleService has not published one."""
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except (FileNotFoundError, OSError):
+            return None
+        if resource_tracker is not None and hasattr(shm, '_name'):
+            # Attaching processes must not unlink the owner's segment when they exit
+            try:
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except Exception:
+                pass
+        magic, version, _, _ = _HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            shm.close()
+            return None
+        return cls(shm, owner=False, logger=logger)
+
+    def close(self):
+        try:
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+        except Exception as e:
+            self.logger.debug(f"Error closing rate table: {e}")
+
+    def _slot_offset(self, idx):
+        return _HEADER_SIZE + idx * _SLOT.size
+
+    def _read_slot(self, idx):
+        return _SLOT.unpack_from(self.shm.buf, self._slot_offset(idx))
+
+    def _write_slot(self, idx, key, rate, burst, tat):
+        _SLOT.pack_into(self.shm.buf, self._slot_offset(idx), key, rate, burst, tat)
+
+    def _find(self, key):
+        for idx in range(self.slots):
+            if self._read_slot(idx)[0] == key:
+                return idx
+        return None
+
+    def is_fresh(self):
+        _, _, _, published = _HEADER.unpack_from(self.shm.buf, 0)
+        return time.monotonic() - published < STALE_AFTER
+
+    def publish(self, allocations, global_rate=None):
+        """
+        Owner only: replace the slot set with {key: bytes_per_sec}. Existing slots keep their
+        virtual time so a reallocation does not hand out a fresh burst.
+        """
+        if global_rate is not None:
+            self.set_rate(GLOBAL_KEY, global_rate)
+        for idx in range(1, self.slots):
+            key = self._read_slot(idx)[0]
+            if key != FREE_KEY and key not in allocations:
+                self._write_slot(idx, FREE_KEY, 0.0, 0.0, 0.0)
+        for key, rate in allocations.items():
+            self.set_rate(key, rate)
+        _HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, self.slots, time.monotonic())
+
+    def set_rate(self, key, rate, burst=None):
+        rate = float(rate) if rate and rate > 0 else 0.0
+        burst = float(burst) if burst else max(64 * 1024, rate * 0.5)
+        idx = self._find(key)
+        if idx is None:
+            idx = self._find(FREE_KEY)
+            if idx is None:
+                self.logger.warning(f"Rate table full; no slot for {key}")
+                return False
+            tat = 0.0
+        else:
+            tat = self._read_slot(idx)[3]
+        self._write_slot(idx, key, rate, burst, tat)
+        return True
+
+    def get_rate(self, key):
+        idx = self._find(key)
+        return self._read_slot(idx)[1] if idx is not None else None
+
+    def charge(self, key, n, slot_hint=None):
+        """
+        Account n bytes against a slot (GCRA) and return (delay_seconds, slot_index).
+        delay is how long the caller should wait to stay within the slot's rate.
+        """
+        idx = slot_hint
+        if idx is None or self._read_slot(idx)[0] != key:
+            idx = self._find(key)
+            if idx is None:
+                return 0.0, None
+        _, rate, burst, tat = self._read_slot(idx)
+        if rate <= 0:
+            return 0.0, idx
+        now = time.monotonic()
+        new_tat = max(tat, now) + n / rate
+        struct.pack_into('<d', self.shm.buf, self._slot_offset(idx) + _TAT_OFFSET, new_tat)
+        return max(0.0, new_tat - now - burst / rate), idx
+
+
+class SharedLimiter:
+    """
+    Limiter view of one process's slots in the shared table, with the same consume()/consume_async()
+    interface as TokenBucket. Charges the process's own slot (its pid if ThrottleService allocated one,
+    otherwise the shared installer slot) and the global slot. With a pid the choice is re-checked every
+    KEY_REFRESH seconds and whenever the slot in use disappears, so an allocation ThrottleService
+    publishes (or withdraws) after attach is picked up.
+    """
+    def __init__(self, table, key=INSTALLER_KEY, pid=None):
+        self.table = table
+        self.pid = pid
+        self.keys = [key, GLOBAL_KEY]
+        self._hints = {}
+        self._resolved_at = time.monotonic()
+        if pid is not None:
+            self._resolve_key()
+        # Serialises charges from this process's own threads; other processes are not blocked by it
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_process(cls, pid, logger=None):
+        table = SharedRateTable.attach(logger=logger)
+        if table is None:
+            return None
+        return cls(table, pid=pid)
+
+    def _resolve_key(self):
+        self.keys[0] = self.pid if self.table.get_rate(self.pid) is not None else INSTALLER_KEY
+        self._resolved_at = time.monotonic()
+
+    def _delay(self, n):
+        if not self.table.is_fresh():
+            return 0.0
+        delay = 0.0
+        with self._lock:
+            if self.pid is not None and time.monotonic() - self._resolved_at > KEY_REFRESH:
+                self._resolve_key()
+            for key in self.keys:
+                d, self._hints[key] = self.table.charge(key, n, self._hints.get(key))
+                if self._hints[key] is None and key == self.pid:
+                    # Our slot was withdrawn; fall back to the installer slot from this charge on
+                    self._resolve_key()
+                    d, self._hints[self.keys[0]] = self.table.charge(self.keys[0], n, self._hints.get(self.keys[0]))
+                delay = max(delay, d)
+        return delay
+
+    def consume(self, n):
+        delay = self._delay(n)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def consume_async(self, n):
+        delay = self._delay(n)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_process_lock = threading.Lock()
+_process_limiter = None
+_last_attach = -STALE_AFTER
+
+
+def process_limiter(logger=None):
+    """
+    Shared limiter for this process, attached once and reused by every DownloadManager in it.
+    Returns None while no table exists; attachment is retried at most every STALE_AFTER seconds.
+    """
+    global _process_limiter, _last_attach
+    with _process_lock:
+        if _process_limiter is None and time.monotonic() - _last_attach > STALE_AFTER:
+            _last_attach = time.monotonic()
+            _process_limiter = SharedLimiter.for_process(os.getpid(), logger=logger)
+        return _process_limiter
@@ -0,0 +1,188 @@
+import os
+import bisect
+import hashlib
+import threading
+try:
+    import blake3
+    HAS_BLAKE3 = True
+except ImportError:
+    blake3 = None
+    HAS_BLAKE3 = False
+try:
+    import xxhash
+    HAS_XXHASH = True
+except ImportError:
+    xxhash = None
+    HAS_XXHASH = False
+
+
+def new_hash(name):
+    """hashlib-style object for name: any hashlib algorithm, 'blake3', or an xxhash variant ('xxh64', 'xxh3_64', 'xxh3_128')."""
+    name = name.lower().replace('-', '')
+    if name == 'blake3':
+        if not HAS_BLAKE3:
+            raise ValueError("blake3 is not installed")
+        return blake3.blake3()
+    if name.startswith('xxh'):
+        if not HAS_XXHASH or not hasattr(xxhash, name):
+            raise ValueError(f"xxhash is not installed or has no {name}")
+        return getattr(xxhash, name)()
+    return hashlib.new(name)
+
+
+def parse_expected(expected, default='sha256'):
+    """Accepts 'algo:hex', a bare hex digest (default algorithm) or a {algo: hex} dict; returns {algo: hex}."""
+    if not expected:
+        return {}
+    if isinstance(expected, dict):
+        return {k.lower().replace('-', ''): v.lower() for k, v in expected.items()}
+    if ':' in expected:
+        algo, digest = expected.split(':', 1)
+        return {algo.lower().replace('-', ''): digest.strip().lower()}
+    return {default: expected.strip().lower()}
+
+
+class StreamingHasher:
+    """
+    Whole-file digests computed while the file is being written, so finishing a download needs no
+    second read of the data.
+    Writers report every buffer with update_at(offset, data, f). Bytes at the hash frontier are
+    hashed straight from the buffer; buffers that land ahead of it (other segments) are held in memory
+    up to PENDING_LIMIT and otherwise only remembered as written. As the frontier reaches written data
+    that is no longer in memory it is read back from the file in CATCHUP_STEP slices — recently written,
+    so normally still in the page cache — and finish() hashes whatever is left.
+    `sinks` (e.g. an ExtractPipeline) receive the same in-order bytes through their write() method.
+    Usage:
+        hasher = StreamingHasher(('sha256',))
+        writer = DiskWriter(hasher=hasher)
+        ...
+        digests = hasher.finish(path, total_size)
+    """
+    PENDING_LIMIT = 32 * 1024 * 1024
+    CATCHUP_STEP = 8 * 1024 * 1024
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, algorithms=('sha256',), sinks=()):
+        self._hashes = {name.lower().replace('-', ''): new_hash(name) for name in algorithms}
+        self.sinks = list(sinks)
+        if not self._hashes and not self.sinks:
+            raise ValueError("At least one hash algorithm or sink is required")
+        self.frontier = 0
+        self._pending = {}        # offset -> buffer held in memory
+        self._pending_bytes = 0
+        self._written = []        # sorted, merged [start, end) ranges written beyond the frontier
+        self._lock = threading.Lock()
+        self.read_back_bytes = 0  # bytes that had to be re-read from the file
+
+    @property
+    def algorithms(self):
+        return list(self._hashes)
+
+    def mark_written(self, start, end):
+        """Record that [start, end) is already on disk (e.g. resumed from a journal) and must be read back."""
+        with self._lock:
+            self._add_written(start, end)
+
+    def update(self, data):
+        """Sequential writers: hash data as the next bytes of the file."""
+        with self._lock:
+            self._feed(data)
+
+    def update_at(self, offset, data, f=None):
+        n = len(data)
+        if n == 0:
+            return
+        with self._lock:
+            if offset + n <= self.frontier:
+                return
+            if offset <= self.frontier:
+                self._feed(memoryview(data)[self.frontier - offset:])
+            else:
+                self._add_written(offset, offset + n)
+                if offset > self.frontier and self._pending_bytes + n <= self.PENDING_LIMIT:
+                    self._pending[offset] = bytes(data)
+                    self._pending_bytes += n
+            self._advance(f.fileno() if f is not None else None, self.CATCHUP_STEP)
+
+    def finish(self, path=None, total_size=None):
+        """
+        Hash everything not yet consumed (reading it back from path if needed) and return {algorithm: hexdigest}.
+        Raises IOError if the file holds fewer than total_size bytes.
+        """
+        with self._lock:
+            fd = os.open(path, os.O_RDONLY) if path else None
+            try:
+                self._advance(fd, None)
+                if fd is not None and total_size is not None and self.frontier < total_size:
+                    # Bytes nobody reported (e.g. a writer without a hasher); read them so the digest is complete
+                    self._add_written(self.frontier, total_size)
+                    self._advance(fd, None)
+            finally:
+                if fd is not None:
+                    os.close(fd)
+            if total_size is not None and self.frontier != total_size:
+                raise IOError(f"Hashed {self.frontier} bytes, expected {total_size}")
+            return self.hexdigests()
+
+    def hexdigests(self):
+        return {name: h.hexdigest() for name, h in self._hashes.items()}
+
+    def _feed(self, data):
+        for h in self._hashes.values():
+            h.update(data)
+        for sink in self.sinks:
+            sink.write(data)
+        self.frontier += len(data)
+
+    def _add_written(self, start, end):
+        # Keep self._written sorted and merged
+        i = bisect.bisect_left(self._written, [start, start])
+        if i > 0 and self._written[i - 1][1] >= start:
+            i -= 1
+            start = self._written[i][0]
+        j = i
+        while j < len(self._written) and self._written[j][0] <= end:
+            end = max(end, self._written[j][1])
+            j += 1
+        self._written[i:j] = [[start, end]]
+
+    def _advance(self, fd, budget):
+        read_budget = budget
+        while True:
+            while self._written and self._written[0][1] <= self.frontier:
+                self._written.pop(0)
+            chunk = self._pending.pop(self.frontier, None)
+            if chunk is not None:
+                self._pending_bytes -= len(chunk)
+                self._feed(chunk)
+                continue
+            if not self._written or self._written[0][0] > self.frontier or fd is None:
+                break
+            if read_budget is not None and read_budget <= 0:
+                break
+            # Written but not held in memory: read up to the next held buffer or the end of the written run
+            stop = self._written[0][1]
+            ahead = [o for o in self._pending if o > self.frontier]
+            if ahead:
+                stop = min(stop, min(ahead))
+            size = min(stop - self.frontier, self.READ_SIZE)
+            if read_budget is not None:
+                size = min(size, read_budget)
+                read_budget -= size
+            try:
+                data = os.pread(fd, size, self.frontier) if hasattr(os, 'pread') else self._read_at(fd, size)
+            except OSError:
+                if budget is None:
+                    raise
+                break  # e.g. a write-only handle; finish() reads it back through its own descriptor
+            if not data:
+                raise IOError(f"Short read at {self.frontier} while hashing")
+            self.read_back_bytes += len(data)
+            self._feed(data)
+        # Buffers the frontier has passed (covered by a read-back) are no longer needed
+        for offset in [o for o in self._pending if o < self.frontier]:
+            self._pending_bytes -= len(self._pending.pop(offset))
+
+    def _read_at(self, fd, size):
+        os.lseek(fd, self.frontier, os.SEEK_SET)
+        return os.read(fd, size)
@@ -0,0 +1,228 @@
+import os
+import bz2
+import gzip
+import lzma
+import shutil
+import tarfile
+import zipfile
+import logging
+import threading
+from collections import deque
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# name suffix -> (compression, is_tar); longest suffixes first
+_KINDS = [
+    ('.tar.gz', ('gzip', True)), ('.tgz', ('gzip', True)),
+    ('.tar.xz', ('xz', True)), ('.txz', ('xz', True)),
+    ('.tar.bz2', ('bz2', True)), ('.tbz2', ('bz2', True)), ('.tbz', ('bz2', True)),
+    ('.tar.zst', ('zstd', True)), ('.tzst', ('zstd', True)),
+    ('.tar', (None, True)),
+    ('.gz', ('gzip', False)), ('.xz', ('xz', False)), ('.bz2', ('bz2', False)), ('.zst', ('zstd', False)),
+    ('.zip', ('zip', False)),
+]
+
+
+def detect_kind(name):
+    """(compression, is_tar, output name) for an archive file name; raises ValueError if it is not one we decode."""
+    lower = name.lower()
+    for suffix, (compression, is_tar) in _KINDS:
+        if lower.endswith(suffix):
+            return compression, is_tar, name[:-len(suffix)]
+    raise ValueError(f"Don't know how to extract {name}")
+
+
+class _QueueReader:
+    """Blocking file-like view of the byte chunks handed to an ExtractPipeline."""
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self._buf = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        if not self._buf:
+            chunk = self.pipeline._take()
+            if chunk is None:
+                return b''
+            self._buf = memoryview(chunk)
+        if n is None or n < 0 or n >= len(self._buf):
+            data, self._buf = self._buf, memoryview(b'')
+        else:
+            data, self._buf = self._buf[:n], self._buf[n:]
+        return bytes(data)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class ExtractPipeline:
+    """
+    Decompresses (.gz/.xz/.bz2/.zst) and unpacks (.tar and its compressed forms) a download while it
+    is still arriving. The writer side hands over the file's bytes in order through write(); a worker
+    thread decodes them and writes the output into a staging directory, which close() moves into
+    `output` once the stream ends, next to whatever `output` already held. Buffered input is capped
+    at MAX_BUFFERED bytes, so an extractor that falls behind slows the transfer down instead of
+    growing memory.
+    .zip cannot be unpacked from a stream (its index is at the end); it is extracted by close() from
+    the finished file instead. content_encoding is for callers that feed still-encoded bytes.
+    Usage:
+        pipeline = ExtractPipeline('/opt/app', name='app.tar.zst')
+        hasher = StreamingHasher(('sha256',), sinks=[pipeline])
+        ...
+        pipeline.close(finished_path)
+    """
+    MAX_BUFFERED = 32 * 1024 * 1024
+
+    def __init__(self, output, name, content_encoding=None, logger=None):
+        self.output = output
+        self.compression, self.is_tar, self.member_name = detect_kind(name)
+        self.content_encoding = (content_encoding or '').lower() or None
+        if 'zstd' in (self.compression, self.content_encoding) and zstandard is None:
+            raise ValueError("zstandard is not installed")
+        self.logger = logger or logging.getLogger('ExtractPipeline')
+        self.staging = output.rstrip(os.sep) + '.extracting'
+        self._chunks = deque()
+        self._buffered = 0
+        self._cond = threading.Condition()
+        self._ended = False
+        self._aborted = False
+        self.error = None
+        self.bytes_in = 0
+        self._thread = None
+        if self.compression != 'zip':
+            shutil.rmtree(self.staging, ignore_errors=True)
+            os.makedirs(self.staging)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    # --- writer side ---
+    def write(self, data):
+        if self._thread is None or self.error or self._aborted:
+            return
+        data = bytes(data)
+        with self._cond:
+            while self._buffered >= self.MAX_BUFFERED and not (self.error or self._aborted):
+                self._cond.wait(0.25)
+            self._chunks.append(data)
+            self._buffered += len(data)
+            self.bytes_in += len(data)
+            self._cond.notify_all()
+
+    def close(self, source_path=None):
+        """
+        End the stream, wait for the worker and publish the output directory.
+        source_path (the finished download) is needed for .zip. Raises the extraction error, if any.
+        """
+        if self.compression == 'zip':
+            shutil.rmtree(self.staging, ignore_errors=True)
+            with zipfile.ZipFile(source_path) as zf:
+                zf.extractall(self.staging)
+        else:
+            with self._cond:
+                self._ended = True
+                self._cond.notify_all()
+            self._thread.join()
+            if self.error:
+                shutil.rmtree(self.staging, ignore_errors=True)
+                raise self.error
+        self._publish()
+        return self.output
+
+    def abort(self):
+        with self._cond:
+            self._aborted = True
+            self._ended = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+    # --- worker side ---
+    def _take(self):
+        with self._cond:
+            while not self._chunks and not self._ended:
+                self._cond.wait(0.25)
+            if self._aborted or not self._chunks:
+                return None
+            chunk = self._chunks.popleft()
+            self._buffered -= len(chunk)
+            self._cond.notify_all()
+            return chunk
+
+    def _decoded_stream(self):
+        stream = _QueueReader(self)
+        for codec in (self.content_encoding, self.compression):
+            if codec in ('gzip', 'x-gzip'):
+                stream = gzip.GzipFile(fileobj=stream, mode='rb')
+            elif codec == 'xz':
+                stream = lzma.LZMAFile(stream)
+            elif codec == 'bz2':
+                stream = bz2.BZ2File(stream)
+            elif codec == 'zstd':
+                stream = zstandard.ZstdDecompressor().stream_reader(stream)
+            elif codec not in (None, 'identity'):
+                raise ValueError(f"Unsupported encoding {codec}")
+        return stream
+
+    def _run(self):
+        try:
+            stream = self._decoded_stream()
+            if self.is_tar:
+                with tarfile.open(fileobj=stream, mode='r|') as tar:
+                    if hasattr(tarfile, 'data_filter'):
+                        tar.extractall(self.staging, filter='data')
+                    else:
+                        tar.extractall(self.staging)
+            else:
+                with open(os.path.join(self.staging, os.path.basename(self.member_name)), 'wb') as out:
+                    shutil.copyfileobj(stream, out, 1024 * 1024)
+            # Drain anything after the end of the archive so the writer never blocks on a full buffer
+            while self._take() is not None:
+                pass
+        except Exception as e:
+            self.error = e
+            self.logger.error(f"Extraction into {self.output} failed: {e}")
+            with self._cond:
+                self._chunks.clear()
+                self._buffered = 0
+                self._cond.notify_all()
+
+    def _publish(self):
+        """
+        Move the staged output into place. An existing output directory is merged into, not replaced:
+        only paths the archive itself contains are overwritten; anything else already there is kept.
+        """
+        if not os.path.lexists(self.output):
+            os.replace(self.staging, self.output)
+            return
+        if not os.path.isdir(self.output):
+            shutil.rmtree(self.staging, ignore_errors=True)
+            raise NotADirectoryError(f"Cannot extract into {self.output}: it exists and is not a directory")
+        try:
+            self._merge_into_output()
+        finally:
+            shutil.rmtree(self.staging, ignore_errors=True)
+
+    def _merge_into_output(self):
+        for root, dirs, files in os.walk(self.staging):
+            rel = os.path.relpath(root, self.staging)
+            target_root = self.output if rel == os.curdir else os.path.join(self.output, rel)
+            # Symlinked directories are moved like files rather than descended into
+            files = files + [d for d in dirs if os.path.islink(os.path.join(root, d))]
+            dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(root, d))]
+            for d in dirs:
+                target = os.path.join(target_root, d)
+                if os.path.islink(target) or (os.path.lexists(target) and not os.path.isdir(target)):
+                    os.remove(target)
+                os.makedirs(target, exist_ok=True)
+            for name in files:
+                target = os.path.join(target_root, name)
+                if os.path.isdir(target) and not os.path.islink(target):
+                    raise IsADirectoryError(f"Cannot extract {os.path.join(rel, name)} over the directory {target}")
+                os.replace(os.path.join(root, name), target)
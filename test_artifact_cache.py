@@ -0,0 +1,65 @@
+import os
+import tempfile
+import hashlib
+from testing_support import PAYLOAD, ETagHandler, start_server
+from download_manager import DownloadManager
+from artifact_cache import ArtifactCache
+import fast_copy
+
+def test_cached_artifact_delivered_without_network():
+    server, url = start_server(ETagHandler)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # store_copies: the test directory's filesystem may not be able to clone
+            cache = ArtifactCache(os.path.join(tmpdir, "cache"), max_bytes=2 * len(PAYLOAD), store_copies=True)
+            first = os.path.join(tmpdir, "first.bin")
+            DownloadManager(url, first, virus_check=False, conditional=False, artifact_cache=cache).download()
+            ETagHandler.requests_seen.clear()
+            second = os.path.join(tmpdir, "second.bin")
+            result = DownloadManager(url, second, virus_check=False, conditional=False, artifact_cache=cache,
+                                     expected_hash=hashlib.sha256(PAYLOAD).hexdigest()).download()
+            assert result['cached'] and result['verified'], "Expected hash was not served from the cache!"
+            assert not ETagHandler.requests_seen, "Cache hit still used the network!"
+            with open(second, 'rb') as f:
+                assert f.read() == PAYLOAD, "Cached delivery is corrupt!"
+            third = os.path.join(tmpdir, "third.bin")
+            result = DownloadManager(url, third, virus_check=False, conditional=False, artifact_cache=cache).download()
+            assert result['cached'] and len(ETagHandler.requests_seen) == 1, "URL+ETag lookup did not hit the cache!"
+            stats = cache.stats()
+            assert stats['hits'] == 2 and stats['objects'] == 1, f"Unexpected cache stats {stats}"
+            other = os.path.join(tmpdir, "other.bin")
+            with open(other, 'wb') as f:
+                f.write(os.urandom(len(PAYLOAD)))
+            cache.store(other, 'f' * 64)
+            cache.store(other, 'e' * 64)
+            assert not cache.has(hashlib.sha256(PAYLOAD).hexdigest()) and cache.stats()['evictions'] == 1, "LRU eviction failed!"
+            cache.close()
+            print("Artifact cache test passed.")
+    finally:
+        server.shutdown()
+
+def test_store_without_clone_support_is_skipped():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "finished.bin")
+        with open(path, 'wb') as f:
+            f.write(PAYLOAD)
+        try:
+            fast_copy.reflink(path, os.path.join(tmpdir, "clone-probe"))
+            can_clone = True
+        except OSError:
+            can_clone = False
+        cache = ArtifactCache(os.path.join(tmpdir, "cache"))
+        digest = hashlib.sha256(PAYLOAD).hexdigest()
+        # By default a finished download is only cached when that costs no full copy
+        assert cache.store(path, digest, url="http://example/finished.bin") == can_clone, "Store ignored clone support!"
+        assert cache.has(digest) == can_clone, "Cache holds a full copy it was not allowed to make!"
+        cache.close()
+        print("Clone-only store test passed.")
+
+def run_all():
+    test_cached_artifact_delivered_without_network()
+    test_store_without_clone_support_is_skipped()
+    print("All artifact cache tests passed.")
+
+if __name__ == "__main__":
+    run_all()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+from testing_support import PAYLOAD, start_server
+from segmented_download import SegmentedDownloader
+from disk_writer import DiskWriter
+from buffer_pool import BufferPool
+import http_pool
+
+def test_pooled_buffers_are_reused():
+    server, url = start_server()
+    saved = http_pool.httpx
+    http_pool.httpx = None  # the requests path is the one that reads into pooled buffers
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            engine = SegmentedDownloader(url, dest, len(PAYLOAD), threads=4, chunk_size=48 * 1024)
+            engine.pool = BufferPool(48 * 1024)
+            engine.run()
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Pooled-buffer download content mismatch!"
+            stats = engine.pool.stats()
+            assert stats['reused'] > stats['allocated'], stats
+            # Vectored write of several buffers in one call
+            with open(dest, 'r+b') as f:
+                parts = [bytearray(PAYLOAD[i:i + 1000]) for i in range(0, 5000, 1000)]
+                assert DiskWriter().write_at_many(f, parts, 123) == 5000
+            with open(dest, 'rb') as f:
+                f.seek(123)
+                assert f.read(5000) == PAYLOAD[:5000], "Vectored write content mismatch!"
+            print("Buffer pool test passed.")
+    finally:
+        http_pool.httpx = saved
+        server.shutdown()
+
+def run_all():
+    test_pooled_buffers_are_reused()
+    print("All buffer pool tests passed.")
+
+if __name__ == "__main__":
+    run_all()
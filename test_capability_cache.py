@@ -0,0 +1,75 @@
+import os
+import tempfile
+from testing_support import PAYLOAD, NoRangeHandler, start_server
+from metadata_store import MetadataStore
+from download_manager import DownloadManager
+from capability_cache import CapabilityCache
+
+class RedirectingNoRangeHandler(NoRangeHandler):
+    paths_seen = []
+
+    def do_GET(self):
+        self.paths_seen.append(self.path)
+        if self.path == '/old.bin':
+            self.send_response(302)
+            self.send_header('Location', '/payload.bin')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        NoRangeHandler.do_GET(self)
+
+def test_capabilities_cached_per_origin():
+    server, url = start_server(RedirectingNoRangeHandler)
+    old_url = url.replace('payload.bin', 'old.bin')
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            store = MetadataStore(os.path.join(tmpdir, "metadata.db"))
+            caps = CapabilityCache(os.path.join(tmpdir, "metadata.db"))
+            mgr = DownloadManager(old_url, dest, virus_check=False, threads=4, metadata_store=store, capability_cache=caps,
+                                  artifact_cache=False)
+            assert mgr.download(), "Download from a server without Range support failed!"
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Range-less download is corrupt!"
+            assert caps.get(url)['accept_ranges'] is False, "Missing Range support was not cached!"
+            assert caps.get_redirect(old_url) == url, "Redirect target was not cached!"
+            RedirectingNoRangeHandler.paths_seen.clear()
+            DownloadManager(old_url, dest, virus_check=False, threads=4, conditional=False, capability_cache=caps,
+                            artifact_cache=False).download()
+            assert '/old.bin' not in RedirectingNoRangeHandler.paths_seen, "Cached redirect was not used!"
+            store.close()
+            caps.close()
+            print("Capability cache test passed.")
+    finally:
+        server.shutdown()
+
+def test_known_origin_skips_rediscovery():
+    server, url = start_server(NoRangeHandler)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            caps = CapabilityCache(os.path.join(tmpdir, "metadata.db"))
+            caps.update(url, accept_ranges=True, max_connections=3)
+            mgr = DownloadManager(url, dest, virus_check=False, threads=2, conditional=False, capability_cache=caps,
+                                  artifact_cache=False)
+            mgr._load_capabilities()
+            assert mgr.accept_ranges is True, "Cached range support was not read before probing!"
+            assert mgr._concurrency_controller(8).target == 3, "Controller did not start at the known ceiling!"
+            # This URL ignores Range: it is fetched in one stream, but the origin keeps its cached support
+            assert mgr.download(), "Download of a Range-ignoring URL failed!"
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Range-ignoring download is corrupt!"
+            assert mgr.accept_ranges is False, "Probe result was not used for this URL!"
+            assert caps.get(url)['accept_ranges'] is True, "One URL's probe overwrote the origin's range support!"
+            caps.close()
+            print("Known origin test passed.")
+    finally:
+        server.shutdown()
+
+def run_all():
+    test_capabilities_cached_per_origin()
+    test_known_origin_skips_rediscovery()
+    print("All capability cache tests passed.")
+
+if __name__ == "__main__":
+    run_all()
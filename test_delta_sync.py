@@ -0,0 +1,75 @@
+import os
+import tempfile
+import json
+from testing_support import PAYLOAD, RangeHandler, start_server
+from download_manager import DownloadManager
+import delta_sync
+
+def test_delta_fetches_only_changed_blocks():
+    server, url = start_server()
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            block = 64 * 1024
+            source = os.path.join(tmpdir, "new.bin")
+            with open(source, 'wb') as f:
+                f.write(PAYLOAD)
+            manifest = os.path.join(tmpdir, "new.bin.delta.json")
+            with open(manifest, 'w') as f:
+                json.dump(delta_sync.build_manifest(source, block), f)
+            # Old build: one block rewritten, and 1000 bytes inserted so everything after it is shifted
+            old = bytearray(PAYLOAD)
+            old[5 * block:6 * block] = os.urandom(block)
+            old[20 * block + 17:20 * block + 17] = os.urandom(1000)
+            dest = os.path.join(tmpdir, "app.bin")
+            with open(dest, 'wb') as f:
+                f.write(old)
+            RangeHandler.served_ranges.clear()
+            result = DownloadManager(url, dest, virus_check=False, conditional=False, artifact_cache=False,
+                                     delta_manifest=manifest).download()
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Delta reassembly is corrupt!"
+            assert result['verified'], "Delta result was not verified against the manifest!"
+            fetched = sum(e - s + 1 for s, e in RangeHandler.served_ranges if (s, e) != (0, 0))
+            assert fetched <= 4 * block, f"Delta fetched {fetched} bytes!"
+            assert result['delta']['reused_bytes'] + fetched >= len(PAYLOAD), "Delta left a gap!"
+            print("Delta download test passed.")
+    finally:
+        server.shutdown()
+
+def test_delta_plan_rolls_only_when_blocks_moved():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        block = 16 * 1024
+        source = os.path.join(tmpdir, "new.bin")
+        with open(source, 'wb') as f:
+            f.write(PAYLOAD)
+        manifest = delta_sync.build_manifest(source, block)
+        base = os.path.join(tmpdir, "old.bin")
+        rolls = []
+        search = delta_sync._rolling_search
+        delta_sync._rolling_search = lambda *args: rolls.append(args) or search(*args)
+        try:
+            # Same size, blocks rewritten in place: nothing moved, so there is nothing to roll for
+            old = bytearray(PAYLOAD)
+            for i in range(0, len(manifest['blocks']), 10):
+                old[i * block:(i + 1) * block] = os.urandom(block)[:len(old[i * block:(i + 1) * block])]
+            with open(base, 'wb') as f:
+                f.write(old)
+            found = delta_sync.plan(manifest, base)
+            assert not rolls, "Rolled through a file whose blocks only changed in place!"
+            assert len(found) == len(manifest['blocks']) - len(range(0, len(manifest['blocks']), 10))
+            # Shifted: the roll realigns after the insertion, but never beyond its byte budget
+            with open(base, 'wb') as f:
+                f.write(PAYLOAD[:3 * block + 5] + os.urandom(999) + PAYLOAD[3 * block + 5:])
+            assert len(delta_sync.plan(manifest, base)) >= len(manifest['blocks']) - 2, "Shifted blocks not found!"
+            assert len(delta_sync.plan(manifest, base, max_roll=0)) <= 3, "Roll budget was ignored!"
+        finally:
+            delta_sync._rolling_search = search
+        print("Delta plan test passed.")
+
+def run_all():
+    test_delta_fetches_only_changed_blocks()
+    test_delta_plan_rolls_only_when_blocks_moved()
+    print("All delta sync tests passed.")
+
+if __name__ == "__main__":
+    run_all()
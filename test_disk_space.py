@@ -0,0 +1,49 @@
+import os
+import tempfile
+from testing_support import PAYLOAD, start_server
+from async_download import AsyncDownloadEngine
+from disk_writer import DiskWriter
+from download_manager import DownloadManager
+from disk_space import InsufficientSpace, ReservationLedger, allocated_bytes, free_bytes
+
+def test_disk_space_reserved_and_preallocated():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ledger = ReservationLedger(os.path.join(tmpdir, "reservations.db"), min_free=0)
+        first, second = os.path.join(tmpdir, "a.part"), os.path.join(tmpdir, "b.part")
+        share = free_bytes(tmpdir) * 6 // 10
+        rid = ledger.reserve(first, share)
+        # Each download fits on its own, but not both at once
+        try:
+            ledger.reserve(second, share)
+            assert False, "Ledger let two downloads overcommit the volume"
+        except InsufficientSpace:
+            pass
+        ledger.release(rid)
+        ledger.release(ledger.reserve(second, share))
+        ledger.close()
+        with open(first, 'wb') as f:
+            DiskWriter().preallocate(f, len(PAYLOAD))
+        assert os.path.getsize(first) == len(PAYLOAD), "Preallocated file has the wrong size"
+        assert allocated_bytes(first) >= len(PAYLOAD), "Blocks were not allocated up front"
+        # The async engine reserves (and releases) space like download() does
+        server, url = start_server()
+        try:
+            full = ReservationLedger(os.path.join(tmpdir, "full.db"), min_free=free_bytes(tmpdir))
+            roomy = ReservationLedger(os.path.join(tmpdir, "roomy.db"), min_free=0)
+            jobs = [DownloadManager(url, os.path.join(tmpdir, name), virus_check=False, engine='async', conditional=False,
+                                    artifact_cache=False, space_ledger=ledger)
+                    for name, ledger in (("refused.bin", full), ("fits.bin", roomy))]
+            refused, fits = AsyncDownloadEngine().run_many(jobs)
+            assert not refused['ok'] and 'needed' in refused['error'], refused
+            assert fits['ok'], fits
+            assert roomy._db.execute('SELECT COUNT(*) FROM reservations').fetchone()[0] == 0, "Reservation not released"
+        finally:
+            server.shutdown()
+        print("Disk space reservation test passed.")
+
+def run_all():
+    test_disk_space_reserved_and_preallocated()
+    print("All disk space tests passed.")
+
+if __name__ == "__main__":
+    run_all()
@@ -2,6 +2,7 @@ import os
 import tempfile
 import shutil
 import time
+import testing_support  # keeps the default stores out of ~/.download_manager
 from download_manager import DownloadManager
 
 def test_http_download():
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import threading
+import time
+from testing_support import PAYLOAD, RangeHandler, start_server
+from download_manager_pool import DownloadManagerPool, SmallDownloadQueue
+
+class SlowHandler(RangeHandler):
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_GET(self):
+        with SlowHandler.lock:
+            SlowHandler.in_flight += 1
+            SlowHandler.max_in_flight = max(SlowHandler.max_in_flight, SlowHandler.in_flight)
+        try:
+            time.sleep(0.2)
+            RangeHandler.do_GET(self)
+        finally:
+            with SlowHandler.lock:
+                SlowHandler.in_flight -= 1
+
+def test_small_downloads_use_worker_pool():
+    q = SmallDownloadQueue(aging_seconds=0.05)
+    q.put('old-background', 'background')
+    q.put('installer', 'installer')
+    assert q.get(lambda: False) == 'installer'
+    time.sleep(0.15)
+    q.put('new-installer', 'installer')
+    # Waited long enough to outrank fresh urgent work
+    assert q.get(lambda: False) == 'old-background', "Aging did not prevent starvation"
+    server, url = start_server(SlowHandler)
+    pool = DownloadManagerPool(small_workers=1)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            assert pool.set_small_workers(3)
+            dests = [os.path.join(tmpdir, f"small{i}.bin") for i in range(6)]
+            for i, dest in enumerate(dests):
+                pool.add_download(url, dest, priority='background' if i % 2 else 'normal', virus_check=False,
+                                  conditional=False, artifact_cache=False)
+            pool.wait_all()
+            for dest in dests:
+                with open(dest, 'rb') as f:
+                    assert f.read() == PAYLOAD, f"Small download {dest} incomplete!"
+            assert len(pool.small_threads) == 3, "Idle workers exited while the pool was running"
+            assert SlowHandler.max_in_flight > 1, "Small downloads ran one at a time"
+            print("Small download worker pool test passed.")
+    finally:
+        pool.stop()
+        server.shutdown()
+
+def run_all():
+    test_small_downloads_use_worker_pool()
+    print("All download manager pool tests passed.")
+
+if __name__ == "__main__":
+    run_all()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import asyncio
+import threading
+from testing_support import PAYLOAD, start_server
+from chunk_journal import ChunkJournal
+from disk_writer import DiskWriter
+from async_download import AsyncSegmentedDownloader
+
+def test_durability_syncs_only_at_checkpoints():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "durable.bin")
+        for mode, expect_syncs in (('none', False), ('checkpoint-aligned', True)):
+            writer = DiskWriter(durability=mode)
+            journal = ChunkJournal(path + '.journal', checkpoint_interval=3600, checkpoint_bytes=1024 * 1024)
+            journal.reset("http://example/x", len(PAYLOAD))
+            journal.on_checkpoint = writer.sync_for_checkpoint
+            with open(path, 'w+b') as f:
+                for offset in range(0, len(PAYLOAD), 256 * 1024):
+                    n = writer.write_at(f, PAYLOAD[offset:offset + 256 * 1024], offset)
+                    journal.add(offset, offset + n - 1)
+                syncs = writer.syncs
+                writer.fsync(f)
+            # About one sync per checkpoint_bytes of journal progress, never one per write
+            if expect_syncs:
+                assert 0 < syncs <= len(PAYLOAD) // (1024 * 1024) + 1, syncs
+                assert writer.syncs == syncs + 1, "End-of-transfer sync missing"
+            else:
+                assert writer.syncs == 0, "durability='none' synced"
+        with open(path, 'rb') as f:
+            assert f.read() == PAYLOAD, "Durability test content mismatch!"
+        print("Durability policy test passed.")
+
+class ThreadRecordingWriter(DiskWriter):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.threads = set()
+
+    def preallocate(self, f, size):
+        self.threads.add(threading.current_thread())
+        return super().preallocate(f, size)
+
+    def fsync(self, f):
+        self.threads.add(threading.current_thread())
+        return super().fsync(f)
+
+    def sync_for_checkpoint(self):
+        self.threads.add(threading.current_thread())
+        return super().sync_for_checkpoint()
+
+def test_async_engine_syncs_off_the_event_loop():
+    server, url = start_server()
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            writer = ThreadRecordingWriter(durability='checkpoint-aligned')
+            journal = ChunkJournal(dest + '.journal')
+            journal.reset(url, len(PAYLOAD))
+            journal.on_checkpoint = writer.sync_for_checkpoint
+            engine = AsyncSegmentedDownloader(url, dest, len(PAYLOAD), concurrency=4, chunk_size=64 * 1024,
+                                              writer=writer, journal=journal)
+            asyncio.run(engine.run())
+            assert engine.complete, "Async engine did not finish!"
+            # asyncio.run() drives the loop on this thread; none of the blocking disk calls may run on it
+            assert writer.threads and threading.current_thread() not in writer.threads, \
+                "Preallocation or sync ran on the event loop thread!"
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Async durable download is corrupt!"
+            print("Async sync-off-loop test passed.")
+    finally:
+        server.shutdown()
+
+def run_all():
+    test_durability_syncs_only_at_checkpoints()
+    test_async_engine_syncs_off_the_event_loop()
+    print("All durability tests passed.")
+
+if __name__ == "__main__":
+    run_all()
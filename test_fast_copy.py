@@ -0,0 +1,37 @@
+import os
+import tempfile
+import io
+from testing_support import PAYLOAD
+import disk_writer
+from download_manager import DownloadManager
+import fast_copy
+
+def test_local_copy_is_zero_copy():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, "source.bin")
+        with open(src, 'wb') as f:
+            f.write(PAYLOAD)
+        dest = os.path.join(tmpdir, "copy.bin")
+        synced = []
+        saved = disk_writer.sync_data
+        disk_writer.sync_data = lambda fd: synced.append(fd) or saved(fd)
+        try:
+            DownloadManager(f"file://{src}", dest, virus_check=False).download()
+        finally:
+            disk_writer.sync_data = saved
+        assert synced, "Local copy published without being synced"
+        with open(dest, 'rb') as f:
+            assert f.read() == PAYLOAD, "file:// copy content mismatch!"
+        assert not os.path.exists(dest + '.part'), "Partial copy left behind!"
+        # Stream fallback (SMB handles) through a small reused buffer
+        out = io.BytesIO()
+        assert fast_copy.copy_stream(io.BytesIO(PAYLOAD), out, buffer_size=64 * 1024) == len(PAYLOAD)
+        assert out.getvalue() == PAYLOAD, "Stream copy content mismatch!"
+        print("Zero-copy local file test passed.")
+
+def run_all():
+    test_local_copy_is_zero_copy()
+    print("All fast copy tests passed.")
+
+if __name__ == "__main__":
+    run_all()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import threading
+import time
+import testing_support  # isolates the default stores; see testing_support.py
+from disk_writer import DiskWriter
+from io_scheduler import DeviceScheduler
+
+def test_io_scheduler_priorities_and_budget():
+    scheduler = DeviceScheduler('test-device', workers=1)
+    gate = threading.Event()
+    order = []
+    threads = [threading.Thread(target=scheduler.submit, args=(gate.wait, 1, 'background'))]
+    threads[0].start()
+    time.sleep(0.1)  # the worker is now blocked inside the gate job
+    for name, priority in (('bg1', 'background'), ('bg2', 'background'), ('inst', 'installer')):
+        t = threading.Thread(target=scheduler.submit, args=(lambda name=name: order.append(name), 1, priority))
+        t.start()
+        threads.append(t)
+        time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert order[0] == 'inst', f"Installer write did not jump the queue: {order}"
+    # Device budget paces background writes: 5 x 100 KB at 1 MB/s, minus a 0.25 s burst
+    scheduler.set_budget(1000 * 1000)
+    started = time.monotonic()
+    for _ in range(5):
+        scheduler.submit(lambda: None, 100 * 1000, 'background')
+    assert time.monotonic() - started >= 0.15, "Device budget not enforced"
+    stats = scheduler.stats()
+    assert stats['jobs']['background'] == 8 and stats['jobs']['installer'] == 1, stats
+    # A hasher stuck on one download must not occupy the device's only worker
+    class BlockingHasher:
+        def update_at(self, offset, data, f):
+            gate.wait()
+    gate.clear()
+    scheduler.set_budget(None)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, "a.bin"), 'w+b') as a, open(os.path.join(tmpdir, "b.bin"), 'w+b') as b:
+            slow = threading.Thread(target=DiskWriter(scheduler=scheduler, hasher=BlockingHasher()).write_at,
+                                    args=(a, b'x' * 4096, 0))
+            slow.start()
+            time.sleep(0.1)
+            done = threading.Thread(target=DiskWriter(scheduler=scheduler, priority='installer').write_at,
+                                    args=(b, b'y' * 4096, 0))
+            done.start()
+            done.join(2)
+            stuck = done.is_alive()
+            gate.set()
+            slow.join()
+            done.join()
+            assert not stuck, "Hashing ran on the device worker and blocked another download's write"
+    print("I/O scheduler test passed.")
+
+def run_all():
+    test_io_scheduler_priorities_and_budget()
+    print("All io scheduler tests passed.")
+
+if __name__ == "__main__":
+    run_all()
@@ -0,0 +1,39 @@
+import os
+import tempfile
+from testing_support import PAYLOAD, start_server
+from segmented_download import SegmentedDownloader
+import http_pool
+from memory_budget import MemoryBudget
+
+def test_memory_budget_bounds_in_flight_data():
+    budget = MemoryBudget(limit=1024 * 1024, min_chunk=64 * 1024)
+    assert budget.acquire(768 * 1024) == 768 * 1024
+    # Under pressure the grant shrinks instead of blocking
+    assert budget.acquire(768 * 1024) == 256 * 1024
+    budget.release(1024 * 1024)
+    server, url = start_server()
+    saved = http_pool.httpx
+    http_pool.httpx = None  # the requests path sizes every read to the credit granted
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            budget = MemoryBudget(limit=256 * 1024, min_chunk=16 * 1024)
+            engine = SegmentedDownloader(url, dest, len(PAYLOAD), threads=8, chunk_size=128 * 1024, budget=budget)
+            engine.run()
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Budgeted download content mismatch!"
+            stats = budget.stats()
+            assert stats['in_use'] == 0, f"Credits leaked: {stats}"
+            assert stats['high_water'] <= stats['limit'], stats
+            assert stats['shrunk_grants'] or stats['waits'], stats
+            print("Memory budget test passed.")
+    finally:
+        http_pool.httpx = saved
+        server.shutdown()
+
+def run_all():
+    test_memory_budget_bounds_in_flight_data()
+    print("All memory budget tests passed.")
+
+if __name__ == "__main__":
+    run_all()
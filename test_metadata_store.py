@@ -0,0 +1,36 @@
+import os
+import tempfile
+from testing_support import PAYLOAD, ETagHandler, start_server
+from metadata_store import MetadataStore
+from download_manager import DownloadManager
+
+def test_unchanged_file_is_not_downloaded_again():
+    server, url = start_server(ETagHandler)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            store = MetadataStore(os.path.join(tmpdir, "metadata.db"))
+            first = DownloadManager(url, dest, virus_check=False, threads=4, metadata_store=store, artifact_cache=False).download()
+            assert first and not first['not_modified'], "First download did not complete!"
+            assert store.get(url, dest)['etag'] == '"v1"', "Validators were not stored!"
+            ETagHandler.requests_seen.clear()
+            second = DownloadManager(url, dest, virus_check=False, threads=4, metadata_store=store, artifact_cache=False).download()
+            assert second['not_modified'] and second['hashes'] == first['hashes'], "Unchanged file was not detected!"
+            assert len(ETagHandler.requests_seen) == 1, "Unchanged file was transferred again!"
+            with open(dest, 'ab') as f:
+                f.write(b'local edit')
+            third = DownloadManager(url, dest, virus_check=False, metadata_store=store, artifact_cache=False).download()
+            assert not third['not_modified'], "Locally modified file was trusted!"
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Re-download is corrupt!"
+            store.close()
+            print("Conditional download test passed.")
+    finally:
+        server.shutdown()
+
+def run_all():
+    test_unchanged_file_is_not_downloaded_again()
+    print("All metadata store tests passed.")
+
+if __name__ == "__main__":
+    run_all()
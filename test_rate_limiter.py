@@ -0,0 +1,85 @@
+import time
+import threading
+import os
+from rate_limiter import TokenBucket
+from shared_rate_table import SharedRateTable, SharedLimiter, INSTALLER_KEY, KEY_REFRESH
+
+def test_bucket_enforces_rate_across_threads():
+    bucket = TokenBucket(4 * 1024 * 1024, burst=64 * 1024)
+    def reader():
+        for _ in range(8):
+            bucket.consume(64 * 1024)
+    start = time.monotonic()
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    # 2MB shared by four readers at 4MB/s should take about half a second
+    assert 0.4 < elapsed < 0.9, f"Shared rate not enforced: {elapsed:.2f}s"
+    print("Token bucket shared rate test passed.")
+
+def test_live_rate_change_wakes_waiters():
+    bucket = TokenBucket(64 * 1024, burst=64 * 1024)
+    bucket.consume(64 * 1024)
+    done = threading.Event()
+    def reader():
+        bucket.consume(640 * 1024)  # ten seconds of debt at the original rate
+        done.set()
+    threading.Thread(target=reader, daemon=True).start()
+    time.sleep(0.1)
+    bucket.set_rate(None)
+    assert done.wait(1), "Removing the limit did not release the waiting reader!"
+    print("Token bucket live reconfiguration test passed.")
+
+def test_shared_table_budget_is_shared():
+    name = f"throttle_rate_table_test_{os.getpid()}"
+    owner = SharedRateTable.create(name=name)
+    try:
+        owner.publish({INSTALLER_KEY: 1024 * 1024}, global_rate=100 * 1024 * 1024)
+        first = SharedLimiter(SharedRateTable.attach(name=name))
+        second = SharedLimiter(SharedRateTable.attach(name=name))
+        start = time.monotonic()
+        for _ in range(16):
+            first.consume(64 * 1024)
+            second.consume(64 * 1024)
+        elapsed = time.monotonic() - start
+        # 2MB through two attachments of one 1MB/s slot, minus the 0.5MB burst, takes about 1.5s
+        assert 1.2 < elapsed < 2.2, f"Shared budget not enforced across attachments: {elapsed:.2f}s"
+        owner.publish({INSTALLER_KEY: 4 * 1024 * 1024}, global_rate=100 * 1024 * 1024)
+        assert first.table.get_rate(INSTALLER_KEY) == 4 * 1024 * 1024, "Republished rate not visible to readers!"
+        print("Shared rate table test passed.")
+    finally:
+        owner.close()
+
+def test_shared_limiter_follows_pid_allocation():
+    name = f"throttle_rate_table_pid_test_{os.getpid()}"
+    pid = 4242
+    owner = SharedRateTable.create(name=name)
+    try:
+        owner.publish({INSTALLER_KEY: 1024 * 1024}, global_rate=100 * 1024 * 1024)
+        limiter = SharedLimiter(SharedRateTable.attach(name=name), pid=pid)
+        assert limiter.keys[0] == INSTALLER_KEY, "No pid slot yet; the installer slot should be charged"
+        # ThrottleService allocates this pid a slot after the process attached
+        owner.publish({INSTALLER_KEY: 1024 * 1024, pid: 2 * 1024 * 1024}, global_rate=100 * 1024 * 1024)
+        time.sleep(KEY_REFRESH + 0.1)
+        limiter.consume(1024)
+        assert limiter.keys[0] == pid, "New pid allocation was never picked up"
+        # Withdrawn again: the next charge misses and falls back at once
+        owner.publish({INSTALLER_KEY: 1024 * 1024}, global_rate=100 * 1024 * 1024)
+        limiter.consume(1024)
+        assert limiter.keys[0] == INSTALLER_KEY, "Charges kept going to a withdrawn slot"
+        print("Shared limiter slot re-resolution test passed.")
+    finally:
+        owner.close()
+
+def run_all():
+    test_bucket_enforces_rate_across_threads()
+    test_live_rate_change_wakes_waiters()
+    test_shared_table_budget_is_shared()
+    test_shared_limiter_follows_pid_allocation()
+    print("All rate limiter tests passed.")
+
+if __name__ == "__main__":
+    run_all()
@@ -0,0 +1,256 @@
+import os
+import tempfile
+import time
+import asyncio
+import hashlib
+from testing_support import PAYLOAD, RangeHandler, NoRangeHandler, start_server
+from segmented_download import SegmentedDownloader, RangeNotSupported
+import segmented_download
+from chunk_journal import ChunkJournal
+from async_download import AsyncSegmentedDownloader, AsyncDownloadEngine
+from concurrency_controller import ConcurrencyController
+from mirrors import MirrorSet, parse_metalink
+from disk_writer import DiskWriter
+from stream_hash import StreamingHasher
+from download_manager import DownloadManager
+from buffer_pool import BufferPool
+import http_pool
+
+class SlowFirstRangeHandler(RangeHandler):
+    def do_GET(self):
+        start, end = self.headers.get('Range').split('=')[1].split('-')
+        start, end = int(start), int(end)
+        if start != 0:
+            return RangeHandler.do_GET(self)
+        # Trickle the first unit so the other worker has to steal its tail
+        body = PAYLOAD[start:end + 1]
+        self.send_response(206)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            for i in range(0, len(body), 16 * 1024):
+                self.wfile.write(body[i:i + 16 * 1024])
+                time.sleep(0.02)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class WrongLengthHandler(RangeHandler):
+    def do_GET(self):
+        start, end = self.headers.get('Range').split('=')[1].split('-')
+        start, end = int(start), int(end)
+        body = PAYLOAD[start:end + 1]
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(PAYLOAD) + 1}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def test_segments_written_in_place():
+    server, url = start_server()
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            written = SegmentedDownloader(url, dest, len(PAYLOAD), threads=6, chunk_size=64 * 1024).run()
+            assert written == len(PAYLOAD), "Byte count mismatch!"
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Segments reassembled incorrectly!"
+            print("Segmented in-place download test passed.")
+    finally:
+        server.shutdown()
+
+def test_range_ignored_is_detected():
+    server, url = start_server(NoRangeHandler)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            try:
+                SegmentedDownloader(url, dest, len(PAYLOAD), threads=4, chunk_size=64 * 1024).run()
+            except RangeNotSupported:
+                print("Range-ignored detection test passed.")
+                return
+            assert False, "Server ignoring Range was not detected!"
+    finally:
+        server.shutdown()
+
+def test_resume_fetches_only_missing_ranges():
+    server, url = start_server()
+    half = len(PAYLOAD) // 2
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            part = os.path.join(tmpdir, "payload.bin.part")
+            with open(part, 'wb') as f:
+                f.write(PAYLOAD[:half])
+            journal = ChunkJournal(part + '.journal')
+            journal.reset(url, len(PAYLOAD), etag='"v1"')
+            journal.add(0, half - 1)
+            journal.checkpoint(force=True)
+            journal = ChunkJournal.load(part + '.journal')
+            assert journal.matches(url, len(PAYLOAD), etag='"v1"'), "Journal did not survive reload!"
+            assert not journal.matches(url, len(PAYLOAD), etag='"v2"'), "Changed ETag was accepted!"
+            RangeHandler.served_ranges = []
+            SegmentedDownloader(url, part, len(PAYLOAD), threads=3, chunk_size=64 * 1024, journal=journal).run()
+            assert all(start >= half for start, _ in RangeHandler.served_ranges), "Completed bytes were re-fetched!"
+            assert journal.missing() == [], "Journal still reports gaps!"
+            with open(part, 'rb') as f:
+                assert f.read() == PAYLOAD, "Resumed file is corrupt!"
+            print("Journal resume test passed.")
+    finally:
+        server.shutdown()
+
+def test_idle_worker_steals_slow_tail():
+    server, url = start_server(SlowFirstRangeHandler)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            engine = SegmentedDownloader(url, dest, len(PAYLOAD), threads=2, chunk_size=16 * 1024)
+            engine.MIN_STEAL_BYTES = 64 * 1024
+            engine.run()
+            assert engine.complete, "Download not marked complete!"
+            assert engine.steals > 0, "No work was stolen from the slow segment!"
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Stolen ranges reassembled incorrectly!"
+            print("Work stealing test passed.")
+    finally:
+        server.shutdown()
+
+def test_async_engine_writes_in_place():
+    server, url = start_server()
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            engine = AsyncSegmentedDownloader(url, dest, len(PAYLOAD), concurrency=5, chunk_size=64 * 1024)
+            written = asyncio.run(engine.run())
+            assert written == len(PAYLOAD) and engine.complete, "Async engine did not finish!"
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Async segments reassembled incorrectly!"
+            print("Async engine test passed.")
+    finally:
+        server.shutdown()
+
+def test_async_engine_falls_back_with_known_size():
+    server, url = start_server(NoRangeHandler)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            mgr = DownloadManager(url, dest, virus_check=False, engine='async', conditional=False, artifact_cache=False)
+            sizes = []
+            sequential = mgr._download_singlethreaded
+            mgr._download_singlethreaded = lambda total_size: sizes.append(total_size) or sequential(total_size)
+            result, = AsyncDownloadEngine().run_many([mgr])
+            assert result['ok'], result
+            assert sizes == [len(PAYLOAD)], f"Sequential fallback lost the probed size: {sizes}"
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Async fallback content mismatch!"
+            print("Async sequential fallback test passed.")
+    finally:
+        server.shutdown()
+
+def test_controller_limits_and_backs_off():
+    server, url = start_server()
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            controller = ConcurrencyController(initial=2, maximum=8)
+            engine = SegmentedDownloader(url, dest, len(PAYLOAD), threads=8, chunk_size=64 * 1024, controller=controller)
+            engine.run()
+            assert engine.complete, "Controlled download did not finish!"
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Controlled download is corrupt!"
+        controller = ConcurrencyController(initial=8, maximum=16)
+        controller.record_overload()
+        assert controller.target == 4 and controller.ceiling == 7, "Overload did not halve concurrency!"
+        print("Concurrency controller test passed.")
+    finally:
+        server.shutdown()
+
+def test_mirrors_raced_and_mismatch_dropped():
+    good, good_url = start_server()
+    bad, bad_url = start_server(WrongLengthHandler)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            mirrors = MirrorSet([bad_url, good_url])
+            engine = SegmentedDownloader(good_url, dest, len(PAYLOAD), threads=4, chunk_size=64 * 1024, mirrors=mirrors)
+            engine.run()
+            assert engine.complete, "Mirrored download did not finish!"
+            with open(dest, 'rb') as f:
+                assert f.read() == PAYLOAD, "Mirrored download is corrupt!"
+            assert mirrors.mirrors[0].dropped and not mirrors.mirrors[1].dropped, "Mismatched mirror was not dropped!"
+        info = parse_metalink('''<metalink xmlns="urn:ietf:params:xml:ns:metalink">
+            <file name="payload.bin"><size>42</size><hash type="sha-256">ABC</hash>
+            <url priority="2">http://b/payload.bin</url><url priority="1">http://a/payload.bin</url></file></metalink>''')
+        assert info['urls'] == ['http://a/payload.bin', 'http://b/payload.bin'] and info['size'] == 42
+        assert info['hashes'] == {'sha256': 'abc'}, "Metalink hashes parsed incorrectly!"
+        print("Mirror racing test passed.")
+    finally:
+        good.shutdown()
+        bad.shutdown()
+
+def test_streaming_hash_matches_out_of_order_segments():
+    server, url = start_server()
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            hasher = StreamingHasher(('sha256', 'md5'))
+            hasher.PENDING_LIMIT = 256 * 1024  # force part of the file to be read back
+            engine = SegmentedDownloader(url, dest, len(PAYLOAD), threads=6, chunk_size=64 * 1024,
+                                         writer=DiskWriter(hasher=hasher), segment_hash='sha256')
+            engine.run()
+            digests = hasher.finish(dest, len(PAYLOAD))
+            assert digests['sha256'] == hashlib.sha256(PAYLOAD).hexdigest(), "Streaming SHA-256 is wrong!"
+            assert digests['md5'] == hashlib.md5(PAYLOAD).hexdigest(), "Streaming MD5 is wrong!"
+            assert hasher.read_back_bytes < len(PAYLOAD), "Hasher re-read the whole file!"
+            covered = 0
+            for seg in engine.segment_hashes:
+                assert seg['digest'] == hashlib.sha256(PAYLOAD[seg['start']:seg['end'] + 1]).hexdigest(), "Segment hash is wrong!"
+                covered += seg['end'] - seg['start'] + 1
+            assert covered == len(PAYLOAD), "Segment hashes do not cover the file!"
+            print("Streaming hash test passed.")
+    finally:
+        server.shutdown()
+
+class SlowHash:
+    def __init__(self, name):
+        self._h = hashlib.new(name)
+
+    def update(self, data):
+        time.sleep(0.001)  # lets the write-behind thread write the buffer and hand it back to the pool first
+        self._h.update(data)
+
+    def hexdigest(self):
+        return self._h.hexdigest()
+
+def test_segment_digest_taken_before_buffer_reuse():
+    server, url = start_server()
+    saved_httpx, saved_hash = http_pool.httpx, segmented_download.new_hash
+    http_pool.httpx = None
+    segmented_download.new_hash = SlowHash
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "payload.bin")
+            engine = SegmentedDownloader(url, dest, len(PAYLOAD), threads=4, chunk_size=16 * 1024, segment_hash='sha256')
+            engine.pool = BufferPool(16 * 1024)
+            engine.run()
+            for seg in engine.segment_hashes:
+                expected = hashlib.sha256(PAYLOAD[seg['start']:seg['end'] + 1]).hexdigest()
+                assert seg['digest'] == expected, f"Digest of {seg['start']}-{seg['end']} hashed a reused buffer"
+            print("Segment digest buffer reuse test passed.")
+    finally:
+        http_pool.httpx, segmented_download.new_hash = saved_httpx, saved_hash
+        server.shutdown()
+
+def run_all():
+    test_segments_written_in_place()
+    test_range_ignored_is_detected()
+    test_resume_fetches_only_missing_ranges()
+    test_idle_worker_steals_slow_tail()
+    test_async_engine_writes_in_place()
+    test_async_engine_falls_back_with_known_size()
+    test_controller_limits_and_backs_off()
+    test_mirrors_raced_and_mismatch_dropped()
+    test_streaming_hash_matches_out_of_order_segments()
+    test_segment_digest_taken_before_buffer_reuse()
+    print("All segmented download tests passed.")
+
+if __name__ == "__main__":
+    run_all()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+import hashlib
+import io
+import tarfile
+from http.server import SimpleHTTPRequestHandler
+import testing_support  # isolates the default stores; see testing_support.py
+from download_manager import DownloadManager
+from artifact_cache import ArtifactCache
+
+def test_archive_extracted_while_downloading():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        served = os.path.join(tmpdir, "served")
+        os.makedirs(served)
+        members = {f"dir/file{i}.bin": os.urandom(300 * 1024) for i in range(8)}
+        with tarfile.open(os.path.join(served, "bundle.tar.xz"), 'w:xz') as tar:
+            for name, data in members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        class Handler(SimpleHTTPRequestHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=served, **kwargs)
+            def log_message(self, *args):
+                pass
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/bundle.tar.xz"
+            out = os.path.join(tmpdir, "installed")
+            # What is already in the target directory stays; only the archive's own paths are replaced
+            os.makedirs(os.path.join(out, "dir"))
+            with open(os.path.join(out, "keep.txt"), 'w') as f:
+                f.write("user data")
+            with open(os.path.join(out, "dir", "file0.bin"), 'wb') as f:
+                f.write(b"stale")
+            result = DownloadManager(url, os.path.join(tmpdir, "bundle.tar.xz"), virus_check=False, conditional=False,
+                                     artifact_cache=False, extract_to=out).download()
+            assert result['extracted'] == out, "Archive was not extracted!"
+            for name, data in members.items():
+                with open(os.path.join(out, name), 'rb') as f:
+                    assert f.read() == data, f"{name} extracted incorrectly!"
+            assert not os.path.exists(out + '.extracting'), "Staging directory left behind!"
+            with open(os.path.join(out, "keep.txt")) as f:
+                assert f.read() == "user data", "Existing file in the target directory was lost!"
+            # A cache hit never streams, but extract_to must still be filled
+            cache = ArtifactCache(os.path.join(tmpdir, "cache"), store_copies=True)
+            with open(os.path.join(served, "bundle.tar.xz"), 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            cache.store(os.path.join(served, "bundle.tar.xz"), digest)
+            cached_out = os.path.join(tmpdir, "from-cache")
+            result = DownloadManager(url, os.path.join(tmpdir, "cached.tar.xz"), virus_check=False, conditional=False,
+                                     artifact_cache=cache, expected_hash=digest, extract_to=cached_out).download()
+            cache.close()
+            assert result['cached'] and result['extracted'] == cached_out, "Cache hit skipped extraction!"
+            for name, data in members.items():
+                with open(os.path.join(cached_out, name), 'rb') as f:
+                    assert f.read() == data, f"{name} extracted incorrectly from the cached copy!"
+            print("Streaming extraction test passed.")
+        finally:
+            server.shutdown()
+
+def run_all():
+    test_archive_extracted_while_downloading()
+    print("All stream pipeline tests passed.")
+
+if __name__ == "__main__":
+    run_all()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+from testing_support import PAYLOAD
+from download_manager import DownloadManager
+from tree_copy import TreeCopy
+
+def test_tree_copy_skips_unchanged_files():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, "share")
+        files = {f"pkg{i % 3}/f{i}.bin": os.urandom(100 * i + 1) for i in range(30)}
+        files["big/blob.bin"] = PAYLOAD
+        for rel, data in files.items():
+            os.makedirs(os.path.dirname(os.path.join(src, rel)), exist_ok=True)
+            with open(os.path.join(src, rel), 'wb') as f:
+                f.write(data)
+        os.makedirs(os.path.join(src, "empty"))
+        dest = os.path.join(tmpdir, "mirror")
+        manifest = DownloadManager(f"file://{src}", dest, virus_check=False).download()
+        assert manifest['totals'] == {'copied': len(files)}, manifest['totals']
+        for rel, data in files.items():
+            with open(os.path.join(dest, rel), 'rb') as f:
+                assert f.read() == data, f"{rel} copied incorrectly!"
+        assert os.path.isdir(os.path.join(dest, "empty")), "Empty directory not copied!"
+        # Second run: only the changed file moves; an interrupted .part of an unchanged source resumes
+        with open(os.path.join(src, "pkg0/f0.bin"), 'wb') as f:
+            f.write(b"changed")
+        os.remove(os.path.join(dest, "big/blob.bin"))
+        with open(os.path.join(dest, "big/blob.bin.part"), 'wb') as f:
+            f.write(PAYLOAD[:1000000])
+        manifest = TreeCopy(src, dest, workers=4).run()
+        assert manifest['files']['pkg0/f0.bin']['status'] == 'copied'
+        assert manifest['files']['big/blob.bin']['status'] == 'resumed'
+        assert manifest['totals']['unchanged'] == len(files) - 2
+        with open(os.path.join(dest, "big/blob.bin"), 'rb') as f:
+            assert f.read() == PAYLOAD, "Resumed file content mismatch!"
+        print("Tree copy test passed.")
+
+def run_all():
+    test_tree_copy_skips_unchanged_files()
+    print("All tree copy tests passed.")
+
+if __name__ == "__main__":
+    run_all()
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import time
+from testing_support import PAYLOAD
+from disk_writer import DiskWriter
+from write_behind import WriteBehind
+
+def test_write_behind_coalesces_and_backpressures():
+    class SlowWriter(DiskWriter):
+        def write_at(self, f, data, offset):
+            time.sleep(0.02)
+            return super().write_at(f, data, offset)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "behind.bin")
+        written = []
+        chunk = 64 * 1024
+        with open(path, 'w+b') as f:
+            sink = WriteBehind(SlowWriter(), f, max_bytes=4 * chunk, threads=1)
+            for offset in range(0, len(PAYLOAD), chunk):
+                sink.submit(PAYLOAD[offset:offset + chunk], offset, lambda o, n: written.append((o, n)))
+            sink.close()
+        with open(path, 'rb') as f:
+            assert f.read() == PAYLOAD, "Write-behind content mismatch!"
+        stats = sink.stats()
+        assert sum(n for _, n in written) == len(PAYLOAD), "on_written missed buffers"
+        assert stats['max_queued_bytes'] <= 4 * chunk, "Queue exceeded its bound"
+        assert stats['stalls'] > 0 and stats['writes'] < stats['buffers'], stats
+        print("Write-behind test passed.")
+
+def run_all():
+    test_write_behind_coalesces_and_backpressures()
+    print("All write behind tests passed.")
+
+if __name__ == "__main__":
+    run_all()
@@ -0,0 +1,76 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Shared fixtures for the test modules: a local HTTP server (range-capable by default) serving PAYLOAD.
+# Import this before any module under test: the persistent default stores (metadata and capability database,
+# artifact cache, disk reservation ledger) read their locations at import time, and are pointed here at a
+# throwaway directory so the tests never touch ~/.download_manager.
+assert not {'metadata_store', 'capability_cache', 'artifact_cache', 'disk_space'} & set(sys.modules), \
+    "testing_support must be imported before the modules under test"
+STATE_DIR = tempfile.mkdtemp(prefix='download-manager-tests-')
+atexit.register(shutil.rmtree, STATE_DIR, True)
+os.environ['DOWNLOAD_METADATA_DB'] = os.path.join(STATE_DIR, 'metadata.db')
+os.environ['DOWNLOAD_RESERVATIONS_DB'] = os.path.join(STATE_DIR, 'reservations.db')
+os.environ['DOWNLOAD_CACHE_DIR'] = os.path.join(STATE_DIR, 'artifacts')
+
+PAYLOAD = os.urandom(3 * 1024 * 1024 + 123)
+
+class RangeHandler(BaseHTTPRequestHandler):
+    honor_ranges = True
+    served_ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        rng = self.headers.get('Range')
+        if rng and self.honor_ranges:
+            start, end = rng.split('=')[1].split('-')
+            start = int(start)
+            end = int(end) if end else len(PAYLOAD) - 1
+            self.served_ranges.append((start, end))
+            body = PAYLOAD[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(PAYLOAD)}')
+        else:
+            body = PAYLOAD
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.wfile.write(body)
+
+class NoRangeHandler(RangeHandler):
+    honor_ranges = False
+
+class ETagHandler(RangeHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        rng = self.headers.get('Range')
+        start, end = rng.split('=')[1].split('-') if rng else ('0', '')
+        start = int(start)
+        end = int(end) if end else len(PAYLOAD) - 1
+        body = PAYLOAD[start:end + 1]
+        self.send_response(206 if rng else 200)
+        if rng:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(PAYLOAD)}')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_server(handler=RangeHandler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/payload.bin"
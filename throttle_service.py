@@ -10,6 +10,7 @@ import win32serviceutil
 import win32service
 import win32event
 from throttle_utils import ThrottleUtils
+from shared_rate_table import SharedRateTable, INSTALLER_KEY
 
 # List of known large downloaders (add more as needed)
 LARGE_DOWNLOADERS = ['Steam.exe', 'XboxApp.exe', 'EpicGamesLauncher.exe']
@@ -27,6 +28,11 @@ class ThrottleService:
         self.utils = ThrottleUtils()
         self.logger = logging.getLogger('ThrottleService')
         logging.basicConfig(level=logging.INFO)
+        try:
+            self.rate_table = SharedRateTable.create(logger=self.logger)
+        except Exception as e:
+            self.logger.warning(f"Shared rate table unavailable, downloaders will not be throttled: {e}")
+            self.rate_table = None
 
     def detect_downloads(self):
         downloads = self.utils.get_active_downloads()
@@ -137,6 +143,19 @@ class ThrottleService:
         }
         return {'installer': installer_bw, 'other': available_bw - installer_bw}
 
+    def publish_rates(self, allocation):
+        # Downloader processes read these slots directly from shared memory on every chunk
+        if not self.rate_table:
+            return
+        allocations = {}
+        for d in getattr(self, 'current_state', {}).get('downloads', []):
+            key = INSTALLER_KEY if d['pid'] == 'installer' else int(d['pid'])
+            allocations[key] = d['bw']
+        try:
+            self.rate_table.publish(allocations, global_rate=allocation['installer'] + allocation['other'])
+        except Exception as e:
+            self.logger.error(f"Failed to publish rate table: {e}")
+
     def ipc_server(self):
         # Enhanced: respond to GUI requests with full state and allow priority updates
         import json
@@ -258,6 +277,7 @@ class ThrottleService:
                     allocation = self.calculate_bandwidth(downloads)
                     with self.lock:
                         self.bandwidth_allocation = allocation
+                    self.publish_rates(allocation)
                     self.logger.info(f"[ThrottleService] Allocation: {allocation}")
                     # Heartbeat file update
                     try:
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import stat
+import logging
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import fast_copy
+try:
+    import smbclient
+except ImportError:
+    smbclient = None
+
+DEFAULT_WORKERS = 16
+PART_SUFFIX = '.part'
+
+
+def smb_unc(url):
+    """smb://host/share/dir -> \\\\host\\share\\dir, the form smbclient expects."""
+    parsed = urlparse(url)
+    path = parsed.path.strip('/').replace('/', '\\')
+    return f"\\\\{parsed.hostname}\\{path}" if path else f"\\\\{parsed.hostname}"
+
+
+class _LocalSource:
+    """A directory on a local disk or a mounted share; files go through the kernel copy path."""
+    def __init__(self, root):
+        self.root = root
+
+    def walk(self):
+        """Yield (relative path, kind, size, mtime in ns) for every entry; kind is 'dir', 'file' or 'link'."""
+        stack = ['']
+        while stack:
+            rel_dir = stack.pop()
+            with os.scandir(os.path.join(self.root, rel_dir)) as it:
+                for entry in it:
+                    rel = os.path.join(rel_dir, entry.name)
+                    st = entry.stat(follow_symlinks=False)
+                    if entry.is_symlink():
+                        yield rel, 'link', 0, st.st_mtime_ns
+                    elif entry.is_dir(follow_symlinks=False):
+                        stack.append(rel)
+                        yield rel, 'dir', 0, st.st_mtime_ns
+                    elif stat.S_ISREG(st.st_mode):
+                        yield rel, 'file', st.st_size, st.st_mtime_ns
+
+    def readlink(self, rel):
+        return os.readlink(os.path.join(self.root, rel))
+
+    def copy(self, rel, part, size, offset, on_chunk):
+        src = os.path.join(self.root, rel)
+        if offset == 0:
+            method, _ = fast_copy.copy_file(src, part, on_chunk=on_chunk)
+            return method
+        with open(src, 'rb') as s, open(part, 'r+b') as d:
+            method, _ = fast_copy.copy_fds(s.fileno(), d.fileno(), size, on_chunk, start=offset)
+        return method
+
+
+class _SmbSource:
+    """A directory on an SMB share read through smbclient (no kernel mount needed)."""
+    def __init__(self, root):
+        self.root = root
+
+    def walk(self):
+        stack = ['']
+        while stack:
+            rel_dir = stack.pop()
+            base = self.root + ('\\' + rel_dir.replace(os.sep, '\\') if rel_dir else '')
+            for entry in smbclient.scandir(base):
+                rel = os.path.join(rel_dir, entry.name)
+                st = entry.stat()
+                if entry.is_dir():
+                    stack.append(rel)
+                    yield rel, 'dir', 0, st.st_mtime_ns
+                elif entry.is_file():
+                    yield rel, 'file', st.st_size, st.st_mtime_ns
+
+    def readlink(self, rel):
+        raise OSError("Symlinks are not copied from SMB shares")
+
+    def copy(self, rel, part, size, offset, on_chunk):
+        with smbclient.open_file(self.root + '\\' + rel.replace(os.sep, '\\'), mode='rb') as s, \
+                open(part, 'r+b' if offset else 'wb') as d:
+            s.seek(offset)
+            d.seek(offset)
+            fast_copy.copy_stream(s, d, on_chunk)
+        return 'smb'
+
+
+class TreeCopy:
+    """
+    Copies a whole directory tree (a local/mounted path, or an smb:// URL) with a bounded pool of workers.
+    Files are queued smallest first, so tens of thousands of small files are not stuck behind a few big
+    ones and per-file latency overlaps across workers. Each file is written to <name>.part and renamed
+    when complete; the source mtime is copied over so the next run can skip it.
+    Progress is recorded in a manifest (dest + '.manifest.json', checkpointed while running). On a rerun,
+    files with the same size and mtime are skipped and a .part whose source is unchanged is resumed from
+    where it stopped.
+    Usage:
+        manifest = TreeCopy('/mnt/share/tools', '/opt/tools', workers=16).run()
+        failed = [p for p, f in manifest['files'].items() if f['status'] == 'failed']
+    """
+    CHECKPOINT_INTERVAL = 2.0
+
+    def __init__(self, source, dest, workers=DEFAULT_WORKERS, on_chunk=None, should_continue=None,
+                 manifest_path=None, logger=None):
+        if source.lower().startswith('smb://'):
+            if smbclient is None:
+                raise ValueError("smbclient is not installed. SMB not supported.")
+            self.source = _SmbSource(smb_unc(source))
+        else:
+            self.source = _LocalSource(source)
+        self.source_name = source
+        self.dest = dest
+        self.workers = max(1, workers)
+        self.on_chunk = on_chunk
+        self.should_continue = should_continue or (lambda: True)
+        self.manifest_path = manifest_path or dest.rstrip(os.sep) + '.manifest.json'
+        self.logger = logger or logging.getLogger('TreeCopy')
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._last_checkpoint = 0.0
+        self.manifest = None
+
+    def _previous(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f).get('files', {})
+        except (OSError, ValueError):
+            return {}
+
+    def run(self):
+        previous = self._previous()
+        files = {}
+        links = []
+        os.makedirs(self.dest, exist_ok=True)
+        for rel, kind, size, mtime in self.source.walk():
+            if kind == 'dir':
+                os.makedirs(os.path.join(self.dest, rel), exist_ok=True)
+            elif kind == 'link':
+                links.append(rel)
+            else:
+                files[rel] = {'size': size, 'mtime_ns': mtime, 'status': 'pending'}
+        self.manifest = {'source': self.source_name, 'dest': self.dest, 'started': time.time(),
+                         'finished': None, 'files': files}
+        for rel in links:
+            self._copy_link(rel)
+        order = sorted(files, key=lambda rel: files[rel]['size'])
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for rel in order:
+                pool.submit(self._copy_one, rel, previous.get(rel))
+        self.manifest['finished'] = time.time()
+        self.manifest['totals'] = self._totals()
+        self._checkpoint(force=True)
+        return self.manifest
+
+    def _copy_link(self, rel):
+        target = os.path.join(self.dest, rel)
+        try:
+            if os.path.lexists(target):
+                os.remove(target)
+            os.symlink(self.source.readlink(rel), target)
+        except OSError as e:
+            self.logger.warning(f"Could not recreate link {rel}: {e}")
+
+    def _copy_one(self, rel, before):
+        entry = self.manifest['files'][rel]
+        if not self.should_continue():
+            return
+        target = os.path.join(self.dest, rel)
+        part = target + PART_SUFFIX
+        size, mtime = entry['size'], entry['mtime_ns']
+        try:
+            if os.path.exists(target):
+                st = os.stat(target)
+                if st.st_size == size and st.st_mtime_ns == mtime:
+                    self._set(rel, status='unchanged')
+                    return
+            offset = 0
+            # A .part is only trusted if the last run saw the same version of the source file
+            if (before and before.get('size') == size and before.get('mtime_ns') == mtime
+                    and os.path.exists(part)):
+                offset = min(os.path.getsize(part), size)
+            stopped = []
+
+            def step(n):
+                if self.on_chunk:
+                    self.on_chunk(n)
+                if not self.should_continue():
+                    stopped.append(True)
+                    return False
+                return True
+            method = self.source.copy(rel, part, size, offset, step)
+            if stopped or os.path.getsize(part) != size:
+                self._set(rel, status='pending')
+                return
+            os.utime(part, ns=(mtime, mtime))
+            os.replace(part, target)
+            self._set(rel, status='resumed' if offset else 'copied', method=method)
+        except Exception as e:
+            self.logger.error(f"Copying {rel} failed: {e}")
+            self._set(rel, status='failed', error=str(e))
+
+    def _set(self, rel, **fields):
+        with self._lock:
+            self.manifest['files'][rel].update(fields)
+        self._checkpoint()
+
+    def _totals(self):
+        totals = {}
+        with self._lock:
+            for entry in self.manifest['files'].values():
+                totals[entry['status']] = totals.get(entry['status'], 0) + 1
+        return totals
+
+    def _checkpoint(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_checkpoint < self.CHECKPOINT_INTERVAL:
+                return
+            self._last_checkpoint = now
+            state = json.dumps(self.manifest)
+        tmp = self.manifest_path + '.tmp'
+        try:
+            with self._io_lock:
+                with open(tmp, 'w') as f:
+                    f.write(state)
+                os.replace(tmp, self.manifest_path)
+        except OSError as e:
+            self.logger.warning(f"Failed to write tree manifest {self.manifest_path}: {e}")
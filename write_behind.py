@@ -0,0 +1,150 @@
+import time
+import logging
+import threading
+
+
+class WriteBehind:
+    """
+    Moves positional disk writes off the network threads.
+    Readers hand each received buffer to submit(); writer threads take queued buffers, merge runs that
+    are contiguous on disk into one write of up to MAX_COALESCE bytes, and pass them to
+    DiskWriter.write_at. At most max_bytes may be queued: a reader that would exceed it blocks until the
+    disk catches up, so a slow disk slows the sockets down instead of growing memory.
+    on_written(offset, length) runs on the writer thread once a buffer is on disk, which is where a resume
+    journal must be updated. A failed write is re-raised from the next submit(), flush() or close().
+    Coalesced runs go to disk in one vectored write (DiskWriter.write_at_many) without being joined, and
+    with a BufferPool every written buffer is released back to it. With a MemoryBudget (memory_budget.py) the
+    credits each buffer carries are returned once it is written, or dropped after a failed write.
+    Usage:
+        sink = WriteBehind(writer, f)
+        sink.submit(chunk, offset, on_written=lambda o, n: journal.add(o, o + n - 1))
+        ...
+        sink.close()
+    """
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+    MAX_COALESCE = 8 * 1024 * 1024
+
+    def __init__(self, writer, f, max_bytes=DEFAULT_MAX_BYTES, threads=2, logger=None, pool=None, budget=None):
+        self.writer = writer
+        self.f = f
+        self.pool = pool
+        self.budget = budget
+        self.max_bytes = max(1, max_bytes)
+        self.logger = logger or logging.getLogger('WriteBehind')
+        self._cond = threading.Condition()
+        self._pending = []  # (offset, data, on_written) in arrival order
+        self._queued = 0
+        self._inflight = 0
+        self._closed = False
+        self.error = None
+        # Instrumentation, see stats()
+        self.bytes_written = 0
+        self.writes = 0
+        self.buffers = 0
+        self.max_queued = 0
+        self.stalls = 0
+        self.stall_seconds = 0.0
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(max(1, threads))]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, data, offset, on_written=None):
+        """Queue data for writing at offset; blocks while the queue is full. The caller must not modify data afterwards."""
+        n = len(data)
+        with self._cond:
+            if self.error:
+                raise self.error
+            if self._queued and self._queued + n > self.max_bytes:
+                self.stalls += 1
+                started = time.monotonic()
+                while self._queued and self._queued + n > self.max_bytes and not self.error:
+                    self._cond.wait()
+                self.stall_seconds += time.monotonic() - started
+                if self.error:
+                    raise self.error
+            self._pending.append((offset, data, on_written))
+            self._queued += n
+            self.max_queued = max(self.max_queued, self._queued)
+            self._cond.notify_all()
+
+    def flush(self):
+        """Wait until everything submitted so far is on disk (written, not synced)."""
+        with self._cond:
+            while (self._pending or self._inflight) and not self.error:
+                self._cond.wait()
+            if self.error:
+                raise self.error
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            for t in self._threads:
+                t.join()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'bytes': self.bytes_written,
+                'writes': self.writes,
+                'buffers': self.buffers,
+                'queued_bytes': self._queued,
+                'max_queued_bytes': self.max_queued,
+                'stalls': self.stalls,
+                'stall_seconds': round(self.stall_seconds, 3),
+            }
+
+    def _take_run(self):
+        """Remove the oldest queued buffer plus any queued buffers that directly follow it on disk."""
+        first = self._pending.pop(0)
+        run = [first]
+        size = len(first[1])
+        end = first[0] + size
+        by_offset = {item[0]: item for item in self._pending}
+        while end in by_offset and size < self.MAX_COALESCE:
+            item = by_offset.pop(end)
+            self._pending.remove(item)
+            run.append(item)
+            size += len(item[1])
+            end += len(item[1])
+        return run, size
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                run, size = self._take_run()
+                self._inflight += 1
+            written = 0
+            try:
+                written = self.writer.write_at_many(self.f, [item[1] for item in run], run[0][0])
+                for offset, buf, on_written in run:
+                    if on_written:
+                        on_written(offset, len(buf))
+                    if self.pool:
+                        self.pool.release(buf)
+            except Exception as e:
+                self.logger.error(f"Write-behind at offset {run[0][0]} failed: {e}")
+                with self._cond:
+                    self.error = self.error or e
+                    # Nothing queued will be written now; release readers blocked on a full queue
+                    dropped = sum(len(item[1]) for item in self._pending)
+                    self._queued -= dropped
+                    self._pending.clear()
+                if self.budget:
+                    self.budget.release(dropped)
+            if self.budget:
+                self.budget.release(size)
+            with self._cond:
+                self._inflight -= 1
+                self._queued -= size
+                self.bytes_written += written
+                self.writes += 1
+                self.buffers += len(run)
+                self._cond.notify_all()